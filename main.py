@@ -1,20 +1,188 @@
 from src import (
     preprocessing as pp,
     bootstrap as bt,
-    trajectory as tj
+    euclidean_matrix as me,
+    trajectory as tj,
+    export as ex,
+    consensus as cs,
+    render,
+    profiling
 )
+from src.projection import ModeloProjecao
 import pandas as pd
 
-# Pré-processamento dos dados
-df_norm, df_real, severity_label = pp.preprocessing_pts()
-pp.export_data_pp(df_norm, df_real, severity_label) # exportar dados preprocessamento
-severity_label_serie = pd.Series(severity_label, index=df_norm.index)
+# --- CONFIGURAÇÕES DA EXECUÇÃO ---
+K = 1500          # quantidade de amostras (bootstrap)
+T = 30            # tamanho de cada amostra/trajetória
+SEED = 42         # seed das amostras (None = não reprodutível)
+REGRA_RAIZ = 'centroide' # raiz de cada amostra: 'centroide' (regra original) ou 'medoide' (tj.REGRAS_RAIZ)
+# Distância entre pacientes: 'euclidiana' (exata, igual ao pdist), 'euclidiana_padronizada', 'mahalanobis',
+# 'euclidiana_ponderada' ou 'correlacao' (ver me.METRICAS em src/euclidean_matrix.py)
+METRICA = 'euclidiana'
+N_WORKERS = 1     # processos para calcular as trajetórias (None = todos os núcleos)
+TAMANHO_CHUNK = 500
+# Matriz de distâncias global (me.MatrizDistanciaGlobal): as distâncias de todos os pacientes são calculadas
+# uma vez e cada amostra recorta o seu bloco. Só com METRICA = 'euclidiana' e no motor em lote/paralelo;
+# ocupa N*(N-1)/2 valores (~220 MB em float64 com 7.4k pacientes).
+# False = desligado; True = em memória; um caminho .npy = em disco (memmap, reaberto pelos workers)
+MATRIZ_GLOBAL = False
+# Checkpoint: grava cada chunk concluído nessa pasta e, se a execução cair, retoma de onde parou (None = desligado)
+PASTA_CHECKPOINT = None # ex.: "data/checkpoint"
+# Parada antecipada: com uma tolerância (ex.: 0.05), K vira o máximo e o sorteio para quando o consenso
+# estabiliza (erro padrão relativo do pseudo-tempo médio <= tolerância e consensos de metades disjuntas das
+# amostras concordando; ver cs.MonitorEstabilidade)
+TOLERANCIA_ESTABILIDADE = None
+QTD_PLOTS = 5     # quantidade de amostras (primeiras) plotadas
+# Figuras: None abre as janelas (plt.show); uma pasta salva os arquivos em paralelo, sem janelas (headless)
+PASTA_FIGURAS = "figures/amostras"
+N_WORKERS_FIGURAS = 1
+CAMINHO_RAW = "data/raw/thyroidDF.csv" # CSV bruto ou pasta com shards CSV (mesmo cabeçalho, lidos em ordem de nome)
+USAR_CACHE = True # reaproveita o pré-processamento (data/cache) se o arquivo bruto e as configurações não mudaram
+DTYPE = 'float64' # dtype de todo o caminho numérico (dados padronizados, distâncias, MST): 'float64' ou 'float32'
+VALIDAR_DTYPE = True # com 'float32', compara as ordenações das primeiras amostras com as de float64
+IMPUTACAO = 'knn' # 'knn', 'knn_classe', 'knn_arvore', 'iterativo' ou 'mediana' (ver pp.ESTRATEGIAS_IMPUTACAO)
 
-# 2. Bootstrap (Pode mandar a Series ou o array, tanto faz)
-amostras = bt.gerar_amostras_bootstrap(severity_label_serie, k=1500, T=30)
+# Exportação: 'csv' (Excel Brasil), 'parquet' ou 'arrow' (esses dois precisam do pyarrow)
+FORMATO_EXPORTACAO = 'csv'
+ARQUIVO_TRAJETORIAS = "data/results/trajectories.csv"
+ARQUIVO_CONSENSO = "data/results/consensus.csv"
+# MSTs das amostras para dashboards (arestas, layout e ordenação; None = não gera)
+ARQUIVO_ARVORES = "data/results/mst_samples.jsonl"
+FORMATO_ARVORES = 'json' # 'json' (JSON Lines) ou 'arrow' (precisa do pyarrow)
+# As MSTs exportadas são recalculadas depois das trajetórias: exportar todas (None) dobra o custo das MSTs.
+QTD_ARVORES = 50 # um número = subconjunto sorteado (com a SEED); None = todas as amostras
+LAYOUT_ARVORES = 'radial' # 'radial' (vetorizado), 'kamada_kawai' (o das figuras, mais lento) ou None
+# Trajetória única com a coorte inteira (MST do grafo k-NN), comparada com o consenso (None = não gera)
+ARQUIVO_TRAJETORIA_COORTE = "data/results/cohort_trajectory.npz"
+N_VIZINHOS_COORTE = 10
+# Modelo para posicionar pacientes novos na trajetória de consenso (None = não gera)
+ARQUIVO_MODELO_PROJECAO = "data/results/projection_model.pkl"
 
-# 3. Processar as trajetórias (calcular matriz, gerar MST e ordenar)
-trajetorias = tj.processar_todas_trajetorias(df_norm, severity_label_serie, amostras, qtd_plots=5)
+# Desempenho: tempo/CPU/memória por etapa em JSON (None = desligado)
+ARQUIVO_PERFIL = "data/results/profile.json"
+PERFIL_MEMORIA = False # tracemalloc (pico de memória por etapa; deixa a execução mais lenta)
+PERFIL_CPROFILE = False # cProfile (funções mais caras no relatório + arquivo .prof)
+PERFIL_AMOSTRAS_INDIVIDUAIS = 8 # amostras por lote processadas uma a uma (histograma do tempo por amostra; 0 = não)
 
-# 4. Exportar as trajetorias para csv
-tj.exportar_trajetorias(df_real, trajetorias, severity_label_serie, nome_arquivo="data/results/trajectories.csv")
+# O guard é necessário para o modo paralelo (os processos filhos importam este arquivo)
+if __name__ == "__main__":
+    if ARQUIVO_PERFIL is None:
+        perfilador = profiling.NULO
+    else:
+        perfilador = profiling.Perfilador(memoria=PERFIL_MEMORIA, cprofile=PERFIL_CPROFILE,
+                                          amostras_individuais=PERFIL_AMOSTRAS_INDIVIDUAIS)
+        perfilador.metadados.update(K=K, T=T, seed=SEED, n_workers=N_WORKERS, imputacao=IMPUTACAO,
+                                    formato_exportacao=FORMATO_EXPORTACAO)
+
+    # Pré-processamento dos dados
+    with perfilador.etapa('preprocessamento'):
+        df_norm, df_real, severity_label, modelos = pp.preprocessing_pts(CAMINHO_RAW, usar_cache=USAR_CACHE,
+                                                                          estrategia_imputacao=IMPUTACAO,
+                                                                          retornar_modelos=True,
+                                                                          medir_memoria=PERFIL_MEMORIA)
+        perfilador.metadados['imputacao_relatorio'] = modelos.get('relatorio_imputacao')
+        # O pré-processamento sai em float64; a cópia float64 só é mantida para a validação do DTYPE reduzido
+        df_norm_64 = df_norm if VALIDAR_DTYPE and DTYPE != 'float64' else None
+        df_norm = df_norm.astype(DTYPE)
+        pp.export_data_pp(df_norm, df_real, severity_label) # exportar dados preprocessamento
+    severity_label_serie = pd.Series(severity_label, index=df_norm.index)
+
+    # 2. Bootstrap (Pode mandar a Series ou o array, tanto faz)
+    # Sorteio vetorizado: array (K, T) int32. Amostra i depende só de (seed, i) (blocos bt.BLOCO_SORTEIO),
+    # igual ao sorteio dos workers (tj.processar_trajetorias_paralelo com k/seed) e do checkpoint.
+    # NÃO é intercambiável com bt.gerar_amostras_bootstrap (versão em loop): mesma SEED, outras amostras.
+    with perfilador.etapa('bootstrap'):
+        amostras = bt.gerar_amostras_vetorizado(severity_label_serie, k=K, T=T, seed=SEED)
+
+    # Validação do dtype reduzido: as mesmas amostras em float64 e no DTYPE escolhido
+    if df_norm_64 is not None:
+        print(f"Validação {DTYPE} x float64:", tj.validar_dtype(df_norm_64, severity_label_serie, amostras[:200], DTYPE,
+                                                                regra_raiz=REGRA_RAIZ, metrica=METRICA))
+        del df_norm_64
+
+    # Gráficos das primeiras amostras: no modo headless são gerados num processo separado,
+    # enquanto as trajetórias são calculadas
+    with perfilador.etapa('graficos'):
+        if PASTA_FIGURAS is None:
+            tj.processar_trajetorias_lote(df_norm, severity_label_serie, amostras[:QTD_PLOTS], qtd_plots=QTD_PLOTS,
+                                          regra_raiz=REGRA_RAIZ, metrica=METRICA)
+        else:
+            renderizador = render.RenderizadorFiguras(pasta=PASTA_FIGURAS, n_workers=N_WORKERS_FIGURAS,
+                                                      metrica=METRICA)
+            trajetorias_plot = tj.processar_trajetorias_lote(df_norm, severity_label_serie, amostras[:QTD_PLOTS],
+                                                         regra_raiz=REGRA_RAIZ, metrica=METRICA)
+            for i, trajetoria in enumerate(trajetorias_plot):
+                renderizador.submeter_amostra(df_norm, severity_label_serie, amostras[i], trajetoria, i)
+
+    # 3. Processar as trajetórias (calcular matriz, gerar MST e ordenar)
+    # Motor em lote (vetorizado); tj.processar_todas_trajetorias segue como implementação de referência
+    # O resultado fica em arrays compactos (K, T): posições, pseudo-tempo e severidade
+    # (No modo paralelo as etapas internas rodam nos workers e só o total 'trajetorias' é medido)
+    matriz_global = None
+    if MATRIZ_GLOBAL:
+        with perfilador.etapa('matriz_global'):
+            caminho_memmap = MATRIZ_GLOBAL if isinstance(MATRIZ_GLOBAL, str) else None
+            matriz_global = me.MatrizDistanciaGlobal.calcular(df_norm.to_numpy(), dtype=DTYPE,
+                                                              caminho_memmap=caminho_memmap)
+    with perfilador.etapa('trajetorias'):
+        if PASTA_CHECKPOINT is not None:
+            resultado = tj.processar_trajetorias_checkpoint(df_norm, severity_label_serie, PASTA_CHECKPOINT,
+                                                            amostras_indices=amostras, n_workers=N_WORKERS,
+                                                            tamanho_chunk=TAMANHO_CHUNK, regra_raiz=REGRA_RAIZ,
+                                                            metrica=METRICA)
+        elif TOLERANCIA_ESTABILIDADE is not None:
+            resultado, monitor = tj.processar_trajetorias_estabilidade(df_norm, severity_label_serie,
+                                                                       amostras_indices=amostras, n_workers=N_WORKERS,
+                                                                       regra_raiz=REGRA_RAIZ, metrica=METRICA,
+                                                                       tolerancia_erro=TOLERANCIA_ESTABILIDADE)
+            perfilador.metadados.update(k_usado=monitor.n_amostras, convergiu=monitor.convergiu)
+        elif N_WORKERS == 1:
+            resultado = tj.processar_trajetorias_resultado(df_norm, severity_label_serie, amostras,
+                                                           matriz_global=matriz_global, perfilador=perfilador,
+                                                           regra_raiz=REGRA_RAIZ, metrica=METRICA)
+        else:
+            resultado = tj.processar_trajetorias_paralelo(df_norm, severity_label_serie, amostras_indices=amostras,
+                                                          n_workers=N_WORKERS, tamanho_chunk=TAMANHO_CHUNK,
+                                                          matriz_global=matriz_global, como_resultado=True,
+                                                          regra_raiz=REGRA_RAIZ, metrica=METRICA)
+
+    # 4. Exportar as trajetorias (gravadas chunk a chunk)
+    with perfilador.etapa('exportacao'):
+        ex.exportar_resultado(df_real, resultado, severity_label_serie, nome_arquivo=ARQUIVO_TRAJETORIAS,
+                              formato=FORMATO_EXPORTACAO, tamanho_chunk=TAMANHO_CHUNK)
+
+    # MSTs das amostras (arestas, coordenadas e ordenação) para os dashboards, sem matplotlib
+    if ARQUIVO_ARVORES is not None:
+        with perfilador.etapa('exportacao_arvores'):
+            selecao = ex.selecionar_amostras(len(resultado), QTD_ARVORES, SEED)
+            lotes_arvores = tj.iterar_arvores_lote(df_norm, severity_label_serie, amostras[selecao],
+                                                   regra_raiz=REGRA_RAIZ, metrica=METRICA, layout=LAYOUT_ARVORES)
+            ex.exportar_arvores_stream(lotes_arvores, ARQUIVO_ARVORES, FORMATO_ARVORES, ids_amostras=selecao)
+
+    # 5. Pseudo-tempo de consenso por paciente (agregando todas as trajetórias)
+    with perfilador.etapa('consenso'):
+        df_consenso = cs.consenso_exato(resultado)
+        df_consenso.to_csv(ARQUIVO_CONSENSO, sep=';', decimal=',', index_label='paciente_id')
+    print(f"Arquivo '{ARQUIVO_CONSENSO}' gerado com sucesso!")
+
+    # Trajetória da coorte inteira (sem bootstrap) e concordância com o consenso
+    if ARQUIVO_TRAJETORIA_COORTE is not None:
+        with perfilador.etapa('trajetoria_coorte'):
+            resultado_coorte = tj.trajetoria_coorte(df_norm, severity_label_serie, n_vizinhos=N_VIZINHOS_COORTE,
+                                                    metrica=METRICA)
+        resultado_coorte.salvar(ARQUIVO_TRAJETORIA_COORTE)
+        print("Concordância coorte x consenso:", cs.comparar_com_consenso(df_consenso, resultado_coorte))
+
+    # Modelo de projeção: imputador + scaler + consenso (ModeloProjecao.carregar(...).projetar(df_novos))
+    if ARQUIVO_MODELO_PROJECAO is not None:
+        ModeloProjecao.ajustar(df_norm, severity_label_serie, df_consenso, modelos,
+                               metrica=METRICA).salvar(ARQUIVO_MODELO_PROJECAO)
+
+    # 6. Espera as figuras que ainda estiverem sendo geradas
+    if PASTA_FIGURAS is not None:
+        with perfilador.etapa('graficos'):
+            renderizador.fechar()
+
+    if ARQUIVO_PERFIL is not None:
+        perfilador.resumo()
+        perfilador.salvar(ARQUIVO_PERFIL)
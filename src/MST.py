@@ -1,6 +1,11 @@
+import numpy as np
 import networkx as nx
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import minimum_spanning_tree, breadth_first_order, connected_components
+from sklearn.neighbors import KDTree
 from matplotlib.lines import Line2D
 import matplotlib.pyplot as plt
+from src.render import finalizar_figura
 
 # Cria o grafo e calcula a MST usando o algoritmo de Prim
 def mst(df_matrix_numerica):
@@ -15,15 +20,337 @@ def mst(df_matrix_numerica):
     
     return G_mst
 
-def plotar_mst_amostra(grafo_mst, id_severity_recorte, numero_amostra):
+# Prim denso e vetorizado para um lote de amostras (sem networkx)
+def mst_prim_lote(tensor_dist, inicios):
+    """
+    Calcula a MST de k matrizes de distância de uma vez (Prim denso, O(k*T²)).
+    Reproduz exatamente a árvore de mst(), inclusive nos empates:
+    - distância zero (pacientes duplicados) não vira aresta, como em nx.from_pandas_adjacency;
+    - entre arestas de mesmo peso vence a que entrou antes na fronteira do heap do networkx
+      (ordem de entrada do pai e, depois, posição do vértice).
+    Args:
+        tensor_dist: array (k, T, T) com as matrizes de distância das amostras.
+        inicios: array (k,) com a posição do vértice onde o Prim começa em cada amostra.
+    Returns:
+        pais: array (k, T) com a posição do pai de cada vértice (-1 no vértice inicial).
+        pesos: array (k, T) com o peso da aresta vértice-pai (0 no vértice inicial).
+    """
+    k, T, _ = tensor_dist.shape
+    linhas = np.arange(k)
+    inicios = np.asarray(inicios)
+
+    # Distância zero não é aresta (o networkx ignora entradas nulas da matriz)
+    custos = np.where(tensor_dist > 0, tensor_dist, np.inf)
+
+    na_arvore = np.zeros((k, T), dtype=bool)
+    pais = np.full((k, T), -1, dtype=np.int64)
+    pesos = np.zeros((k, T), dtype=tensor_dist.dtype)
+
+    # Melhor aresta conhecida até cada vértice fora da árvore
+    na_arvore[linhas, inicios] = True
+    melhor_peso = custos[linhas, inicios].copy()
+    melhor_pai = np.repeat(inicios[:, None], T, axis=1)
+    melhor_passo = np.zeros((k, T), dtype=np.int64) # passo em que o pai entrou na árvore
+
+    for passo in range(1, T):
+        # Menor peso entre os vértices que ainda estão fora da árvore
+        peso_livre = np.where(na_arvore, np.inf, melhor_peso)
+        menor = peso_livre.min(axis=1, keepdims=True)
+
+        # Desempate: pai mais antigo na árvore e, depois, menor posição
+        empatados = (peso_livre == menor) & ~na_arvore
+        passo_empate = np.where(empatados, melhor_passo, T)
+        v = np.argmin(passo_empate, axis=1)
+
+        na_arvore[linhas, v] = True
+        pais[linhas, v] = melhor_pai[linhas, v]
+        pesos[linhas, v] = melhor_peso[linhas, v]
+
+        # Atualiza a fronteira com as arestas do novo vértice
+        # (só se for estritamente menor: no empate fica a aresta mais antiga)
+        novos = custos[linhas, v]
+        melhora = novos < melhor_peso
+        melhor_peso = np.where(melhora, novos, melhor_peso)
+        melhor_pai = np.where(melhora, v[:, None], melhor_pai)
+        melhor_passo = np.where(melhora, passo, melhor_passo)
+
+    return pais, pesos
+
+# --- BACKENDS DE MST (REPRESENTAÇÃO COMPACTA: PAIS + PESOS) ---
+# Todos recebem a matriz de distâncias (T x T) e devolvem a árvore como dois arrays:
+#   pais[v]  -> posição do pai de v (-1 no vértice inicial)
+#   pesos[v] -> peso da aresta v-pai (0 no vértice inicial)
+# O grafo networkx só é montado quando for preciso plotar (arvore_para_grafo).
+
+def _mst_prim_denso(matriz_dist, inicio):
+    # Prim denso O(T²) em NumPy (lote de uma amostra só)
+    pais, pesos = mst_prim_lote(matriz_dist[None, :, :], np.array([inicio]))
+    return pais[0], pesos[0]
+
+def _mst_scipy(matriz_dist, inicio):
+    # scipy.sparse.csgraph (zeros também não viram aresta)
+    arvore = minimum_spanning_tree(matriz_dist)
+    _, predecessores = breadth_first_order(arvore, inicio, directed=False, return_predecessors=True)
+    pais = np.where(predecessores < 0, -1, predecessores).astype(np.int64)
+    pesos = np.where(pais >= 0, matriz_dist[np.arange(len(pais)), pais], 0.0)
+    return pais, pesos
+
+def _mst_networkx(matriz_dist, inicio):
+    # Caminho de referência: grafo completo + Prim do networkx
+    G_mst = nx.minimum_spanning_tree(nx.from_numpy_array(matriz_dist), algorithm='prim')
+    pais = np.full(len(matriz_dist), -1, dtype=np.int64)
+    for filho, pai in nx.bfs_predecessors(G_mst, inicio):
+        pais[filho] = pai
+    pesos = np.where(pais >= 0, matriz_dist[np.arange(len(pais)), pais], 0.0)
+    return pais, pesos
+
+BACKENDS_MST = {
+    'prim_denso': _mst_prim_denso,
+    'scipy': _mst_scipy,
+    'networkx': _mst_networkx,
+}
+
+def mst_arvore(matriz_dist, backend='prim_denso', inicio=0):
+    """
+    Calcula a MST de uma matriz de distâncias com o backend escolhido pelo nome.
+    Args:
+        matriz_dist: array (T, T) (ou DataFrame) com as distâncias da amostra.
+        backend: 'prim_denso' (NumPy), 'scipy' (csgraph) ou 'networkx' (referência).
+        inicio: posição do vértice inicial (raiz da representação por pais).
+            Com o vértice inicial do networkx, 'prim_denso' devolve exatamente a árvore de mst().
+    Returns:
+        pais: array (T,) com a posição do pai de cada vértice (-1 no vértice inicial).
+        pesos: array (T,) com o peso da aresta vértice-pai.
+    """
+    if backend not in BACKENDS_MST:
+        raise ValueError(f"Backend de MST desconhecido: '{backend}'. Opções: {list(BACKENDS_MST)}")
+
+    return BACKENDS_MST[backend](np.asarray(matriz_dist, dtype=float), inicio)
+
+def arvore_para_grafo(pais, pesos, rotulos=None):
+    """
+    Converte a representação (pais, pesos) em um Grafo networkx (só para plotar).
+    Args:
+        pais, pesos: saída de mst_arvore.
+        rotulos: (Opcional) IDs dos pacientes na ordem das posições; por padrão usa as posições.
+    Returns:
+        G_mst: Grafo da MST com o atributo 'weight' nas arestas.
+    """
+    rotulos = list(range(len(pais))) if rotulos is None else list(rotulos)
+
+    G_mst = nx.Graph()
+    G_mst.add_nodes_from(rotulos)
+    for filho, pai in enumerate(pais):
+        if pai >= 0:
+            G_mst.add_edge(rotulos[pai], rotulos[filho], weight=float(pesos[filho]))
+
+    return G_mst
+
+
+def pseudotempo_arvore_lote(pais, pesos, raizes):
+    """
+    Pseudo-tempo na árvore para um lote de MSTs, com uma única busca em largura (BFS) em O(k*T):
+    numa árvore o caminho até a raiz é único, então não é preciso Dijkstra.
+    Soma os pesos na mesma ordem do Dijkstra (raiz -> folhas), dando exatamente as mesmas distâncias.
+    Args:
+        pais: array (k, T) com a posição do pai de cada vértice (-1 no vértice inicial do Prim),
+            ou seja, a árvore pode estar enraizada em qualquer vértice.
+        pesos: array (k, T) com o peso da aresta vértice-pai.
+        raizes: array (k,) com a posição da raiz (pseudo-tempo zero) de cada amostra.
+    Returns:
+        dist: array (k, T) com a distância de cada vértice até a raiz.
+        profundidade: array (k, T) com a quantidade de arestas até a raiz.
+        ramo: array (k, T) com o filho da raiz por onde passa o caminho de cada vértice (-1 na raiz).
+    """
+    k, T = pais.shape
+    n = k * T
+    linhas = np.arange(k)
+    raizes = np.asarray(raizes)
+
+    # Floresta com as k árvores (vértice global = amostra * T + posição) e um super-vértice (n)
+    # ligado à raiz de cada amostra: uma BFS só percorre o lote inteiro
+    amostra, vertice = np.nonzero(pais >= 0)
+    origem = np.concatenate([amostra * T + vertice, np.full(k, n)])
+    destino = np.concatenate([amostra * T + pais[amostra, vertice], linhas * T + raizes])
+    floresta = csr_matrix((np.ones(len(origem), dtype=np.int8), (origem, destino)), shape=(n + 1, n + 1))
+    ordem, predecessores = breadth_first_order(floresta, n, directed=False, return_predecessors=True)
+    if len(ordem) != n + 1:
+        raise ValueError("A árvore de alguma amostra não é conexa.")
+
+    # Ordem da BFS separada por amostra (stable: o pai continua antes do filho); a raiz vem primeiro
+    ordem = ordem[1:]
+    ordem = (ordem[np.argsort(ordem // T, kind='stable')] % T).reshape(k, T)
+    predecessores = predecessores[:n].reshape(k, T) % T
+
+    dist = np.zeros((k, T), dtype=pesos.dtype) # acumula no dtype dos pesos (float32 ou float64)
+    profundidade = np.zeros((k, T), dtype=np.int64)
+    ramo = np.full((k, T), -1, dtype=np.int64)
+    for j in range(1, T):
+        v = ordem[:, j]
+        p = predecessores[linhas, v]
+        # A aresta v-p está guardada no filho da representação por pais (v ou p)
+        peso = np.where(pais[linhas, v] == p, pesos[linhas, v], pesos[linhas, p])
+        dist[linhas, v] = dist[linhas, p] + peso
+        profundidade[linhas, v] = profundidade[linhas, p] + 1
+        ramo[linhas, v] = np.where(p == raizes, v, ramo[linhas, p])
+
+    return dist, profundidade, ramo
+
+
+# --- MST DA COORTE INTEIRA (GRAFO k-NN ESPARSO) ---
+# Para N grande a matriz completa (N x N) não cabe na memória: a MST é calculada sobre o grafo
+# dos k vizinhos mais próximos (KD-tree), que tem só N*k arestas.
+
+_LIMITE_BUSCA_GLOBAL = 1000 # componentes maiores que isso usam uma KD-tree só com os outros pontos
+
+def _arestas_entre_componentes(X, arvore, componentes):
+    """
+    Uma aresta por componente (exceto o maior) até o ponto mais próximo fora dele (passo de Borůvka):
+    ao adicioná-las, a quantidade de componentes cai pelo menos pela metade.
+    """
+    maior = np.argmax(np.bincount(componentes))
+    origem, destino, pesos = [], [], []
+    for c in np.unique(componentes):
+        if c == maior:
+            continue
+        dentro = np.where(componentes == c)[0]
+        if len(dentro) <= _LIMITE_BUSCA_GLOBAL:
+            # Com len(dentro) + 1 vizinhos, pelo menos um está fora do componente
+            dist, vizinhos = arvore.query(X[dentro], k=min(len(dentro) + 1, len(X)))
+            fora = componentes[vizinhos] != c
+            dist = np.where(fora, dist, np.inf)
+            linha, coluna = np.unravel_index(np.argmin(dist), dist.shape)
+            origem.append(dentro[linha])
+            destino.append(vizinhos[linha, coluna])
+            pesos.append(dist[linha, coluna])
+        else:
+            fora = np.where(componentes != c)[0]
+            dist, vizinhos = KDTree(X[fora]).query(X[dentro], k=1)
+            linha = np.argmin(dist[:, 0])
+            origem.append(dentro[linha])
+            destino.append(fora[vizinhos[linha, 0]])
+            pesos.append(dist[linha, 0])
+    return np.array(origem), np.array(destino), np.array(pesos)
+
+def mst_knn(X, n_vizinhos=10):
+    """
+    MST aproximada de uma coorte inteira a partir do grafo k-NN esparso (memória O(N*k), não O(N²)).
+    Se o grafo k-NN ficar desconexo, os componentes são ligados pelas arestas mais curtas entre eles.
+    Os pontos precisam ser distintos (distância zero não vira aresta no csgraph);
+    ver trajectory.trajetoria_coorte, que junta os pacientes duplicados antes.
+    Args:
+        X: array (N, F) com os dados normalizados.
+        n_vizinhos: vizinhos por ponto no grafo k-NN.
+    Returns:
+        arvore: matriz esparsa (N, N) com as N - 1 arestas da MST (peso = distância euclidiana).
+            Só euclidiana: para outra métrica, passe os pontos já transformados (Metrica.transformar),
+            como faz trajectory.trajetoria_coorte.
+        n_componentes: quantidade de componentes do grafo k-NN (1 = não precisou ligar nada).
+    """
+    n = len(X)
+    arvore_kd = KDTree(X)
+    dist, vizinhos = arvore_kd.query(X, k=min(n_vizinhos + 1, n))
+
+    # Descarta o próprio ponto (coluna 0) e monta o grafo esparso com N*k arestas
+    origem = np.repeat(np.arange(n), vizinhos.shape[1] - 1)
+    grafo = csr_matrix((dist[:, 1:].ravel(), (origem, vizinhos[:, 1:].ravel())), shape=(n, n))
+
+    n_componentes, _ = connected_components(grafo, directed=False)
+    while True:
+        qtd, componentes = connected_components(grafo, directed=False)
+        if qtd == 1:
+            break
+        extra_origem, extra_destino, extra_pesos = _arestas_entre_componentes(X, arvore_kd, componentes)
+        grafo = grafo + csr_matrix((extra_pesos, (extra_origem, extra_destino)), shape=(n, n))
+
+    return minimum_spanning_tree(grafo), n_componentes
+
+
+# Cache do layout: as figuras da mesma amostra (MST e trajetória) reaproveitam o mesmo cálculo
+_CACHE_LAYOUT = {}
+_TAMANHO_CACHE_LAYOUT = 32
+
+def layout_mst(grafo_mst):
+    """
+    Layout Kamada-Kawai (ponderado pelos pesos) da MST, com cache pela estrutura do grafo
+    (nós + arestas com peso): o mesmo grafo nunca é "desenhado" duas vezes.
+    """
+    chave = (
+        tuple(grafo_mst.nodes()),
+        tuple(sorted((u, v, d.get('weight', 1)) for u, v, d in grafo_mst.edges(data=True))),
+    )
+    if chave not in _CACHE_LAYOUT:
+        if len(_CACHE_LAYOUT) >= _TAMANHO_CACHE_LAYOUT:
+            _CACHE_LAYOUT.pop(next(iter(_CACHE_LAYOUT))) # descarta o mais antigo
+        _CACHE_LAYOUT[chave] = nx.kamada_kawai_layout(grafo_mst, weight='weight')
+    return _CACHE_LAYOUT[chave]
+
+def layout_radial_lote(pais, pseudotempo, profundidade):
+    """
+    Layout radial de um lote de MSTs, vetorizado (sem networkx): a raiz fica na origem, o raio de
+    cada paciente é o pseudo-tempo (distância até a raiz na árvore) e cada subárvore ocupa uma fatia
+    do círculo proporcional à sua quantidade de folhas (irmãos na ordem da posição na amostra).
+    Args:
+        pais: array (k, T) com o pai de cada vértice na MST do Prim (-1 no vértice inicial).
+        pseudotempo, profundidade: saída de pseudotempo_arvore_lote.
+    Returns:
+        (x, y): arrays (k, T) com as coordenadas de cada vértice.
+    """
+    k, T = pais.shape
+    linhas = np.arange(k)[:, None]
+
+    # Pai na árvore enraizada na raiz do pseudo-tempo (a aresta do Prim pode estar "ao contrário")
+    pai_prim = np.where(pais >= 0, pais, 0)
+    desce = (pais >= 0) & (profundidade[linhas, pai_prim] == profundidade - 1)
+    pai = np.where(desce, pais, -1)
+    sobe = (pais >= 0) & ~desce # o pai do Prim é filho na árvore enraizada
+    amostra_sobe, vertice_sobe = np.nonzero(sobe)
+    pai[amostra_sobe, pais[amostra_sobe, vertice_sobe]] = vertice_sobe
+
+    # Folhas de cada subárvore, das folhas para a raiz (profundidade decrescente)
+    linhas = np.arange(k)
+    ordem = np.argsort(profundidade, axis=1, kind='stable')
+    folhas = np.zeros((k, T), dtype=np.int64)
+    for j in range(T - 1, -1, -1):
+        v = ordem[:, j]
+        folhas[linhas, v] = np.maximum(folhas[linhas, v], 1)
+        p = pai[linhas, v]
+        tem_pai = p >= 0
+        folhas[linhas[tem_pai], p[tem_pai]] += folhas[linhas[tem_pai], v[tem_pai]]
+
+    # Deslocamento de cada vértice entre os irmãos (soma das folhas dos irmãos anteriores)
+    amostra = np.repeat(linhas, T)
+    chave_pai = pai.ravel()
+    seq = np.lexsort((np.tile(np.arange(T), k), chave_pai, amostra))
+    folhas_seq = folhas.ravel()[seq]
+    acumulado = np.cumsum(folhas_seq) - folhas_seq
+    novo_grupo = np.r_[True, (amostra[seq][1:] != amostra[seq][:-1]) | (chave_pai[seq][1:] != chave_pai[seq][:-1])]
+    inicio_grupo = np.maximum.accumulate(np.where(novo_grupo, np.arange(k * T), 0))
+    deslocamento = np.empty(k * T, dtype=np.int64)
+    deslocamento[seq] = acumulado - acumulado[inicio_grupo]
+    deslocamento = deslocamento.reshape(k, T)
+
+    # Intervalo de folhas de cada vértice = início do pai + deslocamento (da raiz para as folhas)
+    inicio = np.zeros((k, T), dtype=np.int64)
+    for j in range(1, T):
+        v = ordem[:, j]
+        inicio[linhas, v] = inicio[linhas, pai[linhas, v]] + deslocamento[linhas, v]
+
+    total = folhas.max(axis=1, keepdims=True) # folhas da raiz
+    angulo = 2 * np.pi * (inicio + folhas / 2) / total
+    raio = np.asarray(pseudotempo, dtype=np.float64)
+    return raio * np.cos(angulo), raio * np.sin(angulo)
+
+def plotar_mst_amostra(grafo_mst, id_severity_recorte, numero_amostra, salvar_em=None):
     """
     Função auxiliar para visualizar a MST gerada.
     Usa o layout Kamada-Kawai para respeitar as distâncias reais (pesos).
+    salvar_em: (Opcional) caminho do arquivo; se definido, salva a figura em vez de abrir a janela.
     """
     plt.figure(figsize=(10, 6))
     
     # 1. Layout "Físico" (Respeita o peso das arestas para definir a distância visual)
-    pos = nx.kamada_kawai_layout(grafo_mst, weight='weight')
+    pos = layout_mst(grafo_mst)
     
     # 2. Mapeamento de Cores
     # 0: Saudável (Verde), 1: Moderado (Laranja), 2: Grave (Vermelho)
@@ -52,17 +379,18 @@ def plotar_mst_amostra(grafo_mst, id_severity_recorte, numero_amostra):
     
     plt.title(f"Visualização da MST - Amostra #{numero_amostra}\n(Layout baseado na Similaridade Biológica)")
     plt.axis('off')
-    plt.show()
+    finalizar_figura(salvar_em)
 
 
-def plotar_trajetoria_mst(grafo_mst, indices_ordenados, num_amostra):
+def plotar_trajetoria_mst(grafo_mst, indices_ordenados, num_amostra, salvar_em=None):
     """
     Gera o gráfico da MST com gradiente de cores baseado na ordem da trajetória.
+    salvar_em: (Opcional) caminho do arquivo; se definido, salva a figura em vez de abrir a janela.
     """
     plt.figure(figsize=(10, 8))
     
-    # 1. Definir a posição dos nós (Layout)
-    pos = nx.kamada_kawai_layout(grafo_mst) 
+    # 1. Definir a posição dos nós (Layout) - o mesmo de plotar_mst_amostra, vindo do cache
+    pos = layout_mst(grafo_mst)
     
     # 2. Criar o Mapa de Cores baseado na POSIÇÃO na lista ordenada
     mapa_ordem = {id_pac: i for i, id_pac in enumerate(indices_ordenados)}
@@ -90,10 +418,10 @@ def plotar_trajetoria_mst(grafo_mst, indices_ordenados, num_amostra):
     )
     sm.set_array([])
     plt.colorbar(sm, ax=plt.gca(), label="Ordem na Trajetória (Pseudotempo)")
-    plt.show()
+    finalizar_figura(salvar_em)
 
 
-def plotar_evolucao_clinica_individual(df_recorte, indices_ordenados, id_severity_recorte):
+def plotar_evolucao_clinica_individual(df_recorte, indices_ordenados, id_severity_recorte, salvar_em=None):
     # --- 1. Reorganizar os dados na ordem da trajetória ---
     df_ordenado = df_recorte.loc[indices_ordenados].copy()
     severidade_ordenada = id_severity_recorte.loc[indices_ordenados]
@@ -144,13 +472,14 @@ def plotar_evolucao_clinica_individual(df_recorte, indices_ordenados, id_severit
     ax3.set_xlabel('Progresso da Doença (Ordem dos Pacientes na Trajetória)')
 
     plt.tight_layout()
-    plt.show()
+    finalizar_figura(salvar_em)
 
 
 
-def plotar_evolucao_clinica(df_amostra, indices_ordenados, serie_severidade, num_amostra):
+def plotar_evolucao_clinica(df_amostra, indices_ordenados, serie_severidade, num_amostra, salvar_em=None):
     """
     Plota o painel de 3 gráficos (TSH, T4, T3) baseados na ordem da trajetória.
+    salvar_em: (Opcional) caminho do arquivo; se definido, salva a figura em vez de abrir a janela.
     """
     # 1. Reorganizar os dados na ordem da trajetória
     df_ord = df_amostra.loc[indices_ordenados].copy()
@@ -195,4 +524,4 @@ def plotar_evolucao_clinica(df_amostra, indices_ordenados, serie_severidade, num
     ax3.set_xlabel('Progresso da Doença (Ordem dos Pacientes na Trajetória)')
     
     plt.tight_layout()
-    plt.show()
\ No newline at end of file
+    finalizar_figura(salvar_em)
\ No newline at end of file
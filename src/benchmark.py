@@ -0,0 +1,251 @@
+"""
+Benchmark do pipeline de trajetórias com coortes sintéticas (sem rede, sem o arquivo bruto).
+
+Uso (na raiz do projeto):
+    python -m src.benchmark                          # grade padrão + checagens de corretude
+    python -m src.benchmark --rapido                 # grade pequena (alguns segundos)
+    python -m src.benchmark --salvar-baseline        # grava data/benchmarks/baseline.json
+    python -m src.benchmark --baseline data/benchmarks/baseline.json --tolerancia 0.2
+"""
+import argparse
+import contextlib
+import io
+import itertools
+import json
+import os
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+from src import (
+    bootstrap as bt,
+    trajectory as tj,
+    export as ex,
+    consensus as cs,
+    profiling
+)
+from src.result import TrajectoryResult
+
+FEATURES = ['TSH', 'T3', 'TT4', 'T4U', 'FTI', 'age'] # mesmas colunas de preprocessing.num_features
+PROPORCOES = (0.75, 0.15, 0.10) # Saudável, Moderado, Grave (parecido com a base real)
+
+GRADE_PADRAO = {'N': [1000, 4000, 16000], 'k': [200, 1500], 'T': [30, 100]}
+GRADE_RAPIDA = {'N': [1000], 'k': [200], 'T': [30]}
+PASTA_BENCHMARK = "data/benchmarks"
+ARQUIVO_BASELINE = os.path.join(PASTA_BENCHMARK, "baseline.json")
+
+def coorte_sintetica(n, seed=0, proporcoes=PROPORCOES, duplicados=0.0):
+    """
+    Coorte no formato de saída de preprocessing.preprocessing_pts: 6 features, 3 classes de severidade.
+    Cada classe é uma nuvem gaussiana com o centro deslocado (saudáveis perto da origem).
+    Args:
+        n: quantidade de pacientes.
+        seed: seed do gerador.
+        proporcoes: fração de pacientes de cada severidade (0, 1, 2).
+        duplicados: fração de pacientes que são cópias exatas de outro (testa empates na MST).
+    Returns:
+        (df_norm, df_real, severity_label_serie)
+    """
+    rng = np.random.default_rng(seed)
+    severidade = rng.choice(3, size=n, p=proporcoes).astype(np.int64)
+    severidade[:30] = np.repeat([0, 1, 2], 10) # garante as cotas mínimas do bootstrap
+    centros = np.array([np.zeros(len(FEATURES)),
+                        np.linspace(1.0, -1.0, len(FEATURES)),
+                        np.linspace(3.0, -2.0, len(FEATURES))])
+    X = centros[severidade] + rng.normal(size=(n, len(FEATURES)))
+
+    n_dup = int(n * duplicados)
+    if n_dup:
+        copias = rng.choice(n, size=n_dup, replace=False)
+        originais = rng.choice(n, size=n_dup)
+        X[copias] = X[originais]
+        severidade[copias] = severidade[originais]
+
+    X = (X - X.mean(axis=0)) / X.std(axis=0)
+    indice = pd.Index(rng.permutation(n) + 1, name='patient_id') # IDs fora de ordem, como na base real
+    df_norm = pd.DataFrame(X, columns=FEATURES, index=indice)
+    df_real = pd.DataFrame(np.abs(X) * 10, columns=FEATURES, index=indice)
+    return df_norm, df_real, pd.Series(severidade, index=indice)
+
+
+def _silencioso():
+    # As funções do pipeline imprimem o progresso; no benchmark isso só atrapalha
+    return contextlib.redirect_stdout(io.StringIO())
+
+
+def medir_configuracao(N, k, T, seed=0, repeticoes=3):
+    """
+    Fluxo do main.py (bootstrap -> trajetórias -> exportação -> consenso) numa coorte sintética,
+    medindo cada etapa com profiling.Perfilador.
+    Returns:
+        dicionário {etapa: menor tempo de parede (s) entre as repetições}, com 'total' (fluxo completo).
+    """
+    df_norm, df_real, sev = coorte_sintetica(N, seed)
+    melhores = {}
+    with tempfile.TemporaryDirectory() as pasta, _silencioso():
+        for _ in range(repeticoes):
+            perfilador = profiling.Perfilador()
+            t0 = time.perf_counter()
+            with perfilador.etapa('bootstrap'):
+                amostras = bt.gerar_amostras_vetorizado(sev, k=k, T=T, seed=seed)
+            with perfilador.etapa('trajetorias'):
+                resultado = tj.processar_trajetorias_resultado(df_norm, sev, amostras, perfilador=perfilador)
+            with perfilador.etapa('exportacao'):
+                ex.exportar_resultado(df_real, resultado, sev, os.path.join(pasta, "trajetorias.csv"))
+            with perfilador.etapa('consenso'):
+                cs.consenso_exato(resultado)
+            total = time.perf_counter() - t0
+
+            tempos = {nome: stats['parede_s'] for nome, stats in perfilador.etapas.items()}
+            tempos['total'] = total
+            for nome, tempo in tempos.items():
+                melhores[nome] = min(melhores.get(nome, np.inf), tempo)
+    return melhores
+
+
+def verificar_corretude(N=500, k=60, T=30, seed=0):
+    """
+    Confere se os caminhos otimizados produzem exatamente as mesmas trajetórias da implementação
+    de referência (processar_todas_trajetorias com networkx), numa coorte normal e noutra com
+    pacientes duplicados (empates na MST). Confere também o sorteio vetorizado (independente do
+    tamanho do chunk e dos blocos, igual ao dos workers e válido com T menor que a soma das cotas) e o
+    deslocamento de tj.comparar_ordenacoes numa troca conhecida.
+    Returns:
+        dicionário {caso: True/False}.
+    """
+    from src import euclidean_matrix as me
+
+    checagens = {}
+    for duplicados in (0.0, 0.2):
+        df_norm, _, sev = coorte_sintetica(N, seed, duplicados=duplicados)
+        sufixo = '_duplicados' if duplicados else ''
+
+        with _silencioso():
+            amostras = bt.gerar_amostras_vetorizado(sev, k=k, T=T, seed=seed)
+            referencia = tj.processar_todas_trajetorias(df_norm, sev, list(amostras), qtd_plots=0)
+            matriz_global = me.MatrizDistanciaGlobal.calcular(df_norm.to_numpy())
+            candidatos = {
+                'backend_prim_denso': lambda: tj.processar_todas_trajetorias(df_norm, sev, list(amostras), qtd_plots=0,
+                                                                             backend_mst='prim_denso'),
+                'lote': lambda: tj.processar_trajetorias_lote(df_norm, sev, amostras),
+                'lote_matriz_global': lambda: tj.processar_trajetorias_lote(df_norm, sev, amostras,
+                                                                            matriz_global=matriz_global),
+                'resultado': lambda: tj.processar_trajetorias_resultado(df_norm, sev, amostras).trajetorias(),
+                'lote_amostras_individuais': lambda: tj.processar_trajetorias_lote(
+                    df_norm, sev, amostras, tamanho_lote=16, perfilador=profiling.Perfilador(amostras_individuais=3)),
+                'paralelo': lambda: tj.processar_trajetorias_paralelo(df_norm, sev, amostras_indices=amostras,
+                                                                      n_workers=2, tamanho_chunk=max(k // 4, 1)),
+            }
+            for nome, calcular in candidatos.items():
+                checagens[nome + sufixo] = calcular() == referencia
+
+    # Sorteio vetorizado: independente do tamanho do chunk, igual ao dos workers e com T < 24 (cotas cortadas)
+    with _silencioso():
+        amostras = bt.gerar_amostras_vetorizado(sev, k=k, T=T, seed=seed)
+        checagens['bootstrap_chunk'] = np.array_equal(
+            amostras, bt.gerar_amostras_vetorizado(sev, k=k, T=T, seed=seed, tamanho_chunk=7))
+        paralelo = tj.processar_trajetorias_paralelo(df_norm, sev, k=k, T=T, seed=seed, n_workers=1,
+                                                     tamanho_chunk=max(k // 3, 1), como_resultado=True)
+        checagens['paralelo_seed'] = paralelo.trajetorias() == tj.processar_trajetorias_lote(df_norm, sev, amostras)
+        # Pedaço que começa e termina no meio de blocos de sorteio (bt.BLOCO_SORTEIO)
+        longas = bt.gerar_amostras_vetorizado(sev, k=2 * bt.BLOCO_SORTEIO + 50, T=T, seed=seed)
+        pedaco = bt.gerar_amostras_vetorizado(sev, k=bt.BLOCO_SORTEIO, T=T, seed=seed, inicio=bt.BLOCO_SORTEIO // 2)
+        checagens['bootstrap_blocos'] = np.array_equal(pedaco, longas[bt.BLOCO_SORTEIO // 2:][:bt.BLOCO_SORTEIO])
+        pequenas = bt.gerar_amostras_vetorizado(sev, k=k, T=20, seed=seed)
+        checagens['bootstrap_T_pequeno'] = (pequenas.shape == (k, 20)
+                                            and all(len(set(amostra)) == 20 for amostra in pequenas.tolist()))
+
+    # Validação de dtype com uma troca conhecida: pacientes 5 e 9 trocam de lugar (slots 0 e 2)
+    pseudotempo = np.arange(4, dtype=np.float64)[None]
+    severidade = np.zeros((1, 4), dtype=np.int8)
+    base = TrajectoryResult(np.array([[5, 3, 9, 1]]), pseudotempo, severidade, None)
+    trocado = TrajectoryResult(np.array([[9, 3, 5, 1]]), pseudotempo, severidade, None)
+    comparacao = tj.comparar_ordenacoes(base, trocado)
+    checagens['validar_dtype_troca'] = (comparacao['deslocamento_max'] == 2
+                                        and comparacao['posicoes_diferentes_media'] == 2.0)
+    return checagens
+
+
+def rodar_grade(grade=GRADE_PADRAO, seed=0, repeticoes=3):
+    """Mede todas as combinações (N, k, T) da grade. Returns: {'N=..,k=..,T=..': tempos por etapa}."""
+    resultados = {}
+    for N, k, T in itertools.product(grade['N'], grade['k'], grade['T']):
+        chave = f"N={N},k={k},T={T}"
+        print(f"Medindo {chave}...")
+        resultados[chave] = medir_configuracao(N, k, T, seed, repeticoes)
+    return resultados
+
+
+def comparar_baseline(resultados, baseline, tolerancia=0.2):
+    """
+    Compara os tempos com o baseline (mesmas chaves de rodar_grade).
+    Returns:
+        lista de regressões (configuração, etapa, tempo baseline, tempo atual, razão) acima de 1 + tolerancia.
+    """
+    regressoes = []
+    print(f"{'Configuração':<24}{'Etapa':<20}{'Baseline (s)':>13}{'Atual (s)':>11}{'Razão':>8}")
+    for chave, tempos in resultados.items():
+        for etapa, tempo in tempos.items():
+            anterior = baseline.get(chave, {}).get(etapa)
+            if not anterior:
+                continue
+            razao = tempo / anterior
+            marca = '  <-- regressão' if razao > 1 + tolerancia else ''
+            print(f"{chave:<24}{etapa:<20}{anterior:>13.4f}{tempo:>11.4f}{razao:>8.2f}{marca}")
+            if marca:
+                regressoes.append((chave, etapa, anterior, tempo, razao))
+    return regressoes
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark do pipeline de trajetórias (coortes sintéticas).")
+    parser.add_argument('--rapido', action='store_true', help="grade pequena")
+    parser.add_argument('--repeticoes', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--sem-corretude', action='store_true', help="pula as checagens contra a referência")
+    parser.add_argument('--validar-float32', action='store_true',
+                        help="compara as ordenações em float32 com as de float64")
+    parser.add_argument('--baseline', default=None, help="JSON de um benchmark anterior para comparar")
+    parser.add_argument('--tolerancia', type=float, default=0.2, help="aumento de tempo aceito (0.2 = 20%%)")
+    parser.add_argument('--salvar-baseline', action='store_true', help=f"grava o resultado em {ARQUIVO_BASELINE}")
+    parser.add_argument('--saida', default=os.path.join(PASTA_BENCHMARK, "ultimo.json"))
+    args = parser.parse_args(argv)
+
+    relatorio = {}
+    falhou = False
+    if not args.sem_corretude:
+        relatorio['corretude'] = verificar_corretude(seed=args.seed)
+        for caso, ok in relatorio['corretude'].items():
+            print(f"Corretude {caso:<32}{'OK' if ok else 'DIFERENTE DA REFERÊNCIA'}")
+        falhou = not all(relatorio['corretude'].values())
+
+    if args.validar_float32:
+        df_norm, _, sev = coorte_sintetica(4000, args.seed)
+        with _silencioso():
+            amostras = bt.gerar_amostras_vetorizado(sev, k=1500, T=30, seed=args.seed)
+        with _silencioso():
+            relatorio['validacao_float32'] = tj.validar_dtype(df_norm, sev, amostras, np.float32)
+        print("Validação float32 x float64:", relatorio['validacao_float32'])
+
+    grade = GRADE_RAPIDA if args.rapido else GRADE_PADRAO
+    relatorio['grade'] = grade
+    relatorio['tempos'] = rodar_grade(grade, args.seed, args.repeticoes)
+
+    if args.baseline:
+        with open(args.baseline) as arquivo:
+            baseline = json.load(arquivo)['tempos']
+        regressoes = comparar_baseline(relatorio['tempos'], baseline, args.tolerancia)
+        relatorio['regressoes'] = regressoes
+        falhou = falhou or bool(regressoes)
+
+    os.makedirs(PASTA_BENCHMARK, exist_ok=True)
+    for caminho in [args.saida] + ([ARQUIVO_BASELINE] if args.salvar_baseline else []):
+        with open(caminho, 'w') as arquivo:
+            json.dump(relatorio, arquivo, indent=2)
+        print(f"Benchmark salvo em '{caminho}'.")
+
+    return 1 if falhou else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
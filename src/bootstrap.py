@@ -1,6 +1,51 @@
 import numpy as np
 
-def gerar_amostras_bootstrap(severity_label, k=1500, T=30):
+def gerador_amostra(seed, i):
+    """
+    Gerador de números aleatórios exclusivo da amostra i.
+    Equivale ao i-ésimo filho de SeedSequence(seed).spawn(k), mas pode ser criado
+    direto em qualquer processo, sem depender da ordem em que as amostras são sorteadas.
+    """
+    return np.random.default_rng(np.random.SeedSequence(seed, spawn_key=(i,)))
+
+def sortear_amostra(rng, pool_indices, n_total, T=30):
+    """
+    Sorteia UMA amostra com as mesmas cotas de gerar_amostras_bootstrap, usando o gerador rng.
+    Args:
+        rng: np.random.Generator da amostra (ver gerador_amostra).
+        pool_indices: dicionário {classe: posições dos pacientes daquela classe}.
+        n_total: quantidade total de pacientes.
+        T: tamanho da amostra.
+    Returns:
+        amostra_final: array (T,) com as posições dos pacientes sorteados.
+    """
+    # Cotas: Grave 1 a 10, Moderado 5 a 10, Saudável 1 a 4 (high exclusivo)
+    configuracao_atual = [
+        (2, rng.integers(1, 11)),
+        (1, rng.integers(5, 11)),
+        (0, rng.integers(1, 5))
+    ]
+    # Com T < 24 (soma dos máximos) as cotas são cortadas para a amostra não passar de T
+    cotas = limitar_cotas([qtd for _, qtd in configuracao_atual], T)
+    configuracao_atual = [(classe, int(qtd)) for (classe, _), qtd in zip(configuracao_atual, cotas)]
+
+    indices_selecionados = []
+    for classe, qtd_alvo in configuracao_atual:
+        indices_selecionados.extend(rng.choice(pool_indices[classe], size=qtd_alvo, replace=False))
+
+    # Preenchimento Natural: sorteia sem reposição no pool global e descarta quem já foi usado
+    falta = T - len(indices_selecionados)
+    if falta > 0:
+        usados = set(indices_selecionados)
+        candidatos = rng.choice(n_total, size=falta + len(usados), replace=False)
+        extras = [c for c in candidatos if c not in usados][:falta]
+        indices_selecionados.extend(extras)
+
+    amostra_final = np.array(indices_selecionados)
+    rng.shuffle(amostra_final) # remover viés de ordem
+    return amostra_final
+
+def gerar_amostras_bootstrap(severity_label, k=1500, T=30, seed=None, inicio=0):
     """
     Gera amostras (T=30) com Alta Variabilidade nos Graves.
     Regras de Seleção (Cotas Mínimas):
@@ -9,11 +54,22 @@ def gerar_amostras_bootstrap(severity_label, k=1500, T=30):
     - Saudável (0): 1 a 4 pacientes.  (Raiz mínima)
     
     O restante (T - soma) é preenchido pelo pool global (majoritariamente saudáveis).
+
+    seed: (Opcional) se definido, cada amostra i usa o próprio gerador (gerador_amostra(seed, i)),
+        então o resultado é reprodutível e pode ser dividido entre processos.
+        Sem seed, usa o estado global do np.random (comportamento original).
+    inicio: número da primeira amostra (só com seed), para gerar um pedaço [inicio, inicio + k).
     """
     
     classes_unicas = np.unique(severity_label)
     pool_indices = {c: np.where(severity_label == c)[0] for c in classes_unicas}
     all_indices = np.arange(len(severity_label))
+
+    if seed is not None:
+        return [
+            sortear_amostra(gerador_amostra(seed, i), pool_indices, len(all_indices), T)
+            for i in range(inicio, inicio + k)
+        ]
     
     amostras = []
     
@@ -31,6 +87,8 @@ def gerar_amostras_bootstrap(severity_label, k=1500, T=30):
             (1, np.random.randint(5, 11)), # Moderado: 5 a 10
             (0, np.random.randint(1, 5))   # Saudável: 1 a 4
         ]
+        cotas = limitar_cotas([qtd for _, qtd in configuracao_atual], T) # soma nunca passa de T
+        configuracao_atual = [(classe, int(qtd)) for (classe, _), qtd in zip(configuracao_atual, cotas)]
         
         # Loop de Seleção Obrigatória
         for classe, qtd_alvo in configuracao_atual:
@@ -61,3 +119,157 @@ def gerar_amostras_bootstrap(severity_label, k=1500, T=30):
     return amostras
 
 
+
+
+# --- VERSÃO VETORIZADA (TODAS AS AMOSTRAS DE UMA VEZ) ---
+# Cotas por classe: (classe, mínimo, máximo) - mesmas regras de gerar_amostras_bootstrap
+COTAS = [(2, 1, 10), (1, 5, 10), (0, 1, 4)]
+
+def limitar_cotas(quantidades, T):
+    """
+    Corta as cotas sorteadas (na ordem de COTAS) para que a soma nunca passe de T:
+    com T < 24 (soma dos máximos) a última classe fica com o que sobrar.
+    Args:
+        quantidades: array (..., n_classes) com as cotas sorteadas.
+    Returns:
+        array do mesmo formato com as cotas limitadas.
+    """
+    quantidades = np.asarray(quantidades)
+    antes = np.cumsum(quantidades, axis=-1) - quantidades # soma das classes anteriores
+    return np.clip(np.minimum(quantidades, T - antes), 0, None)
+
+def _primeira_ocorrencia(candidatos):
+    # Marca True só na primeira ocorrência de cada valor em cada linha
+    ordem = np.argsort(candidatos, axis=1, kind='stable')
+    ordenados = np.take_along_axis(candidatos, ordem, axis=1)
+    primeira_ordenada = np.ones(candidatos.shape, dtype=bool)
+    primeira_ordenada[:, 1:] = ordenados[:, 1:] != ordenados[:, :-1]
+    primeira = np.empty_like(primeira_ordenada)
+    np.put_along_axis(primeira, ordem, primeira_ordenada, axis=1)
+    return primeira
+
+# Contrato da seed do sorteio vetorizado: as amostras são sorteadas em blocos fixos de BLOCO_SORTEIO
+# (amostra i = linha i % BLOCO_SORTEIO do bloco i // BLOCO_SORTEIO) e cada etapa do sorteio de um bloco
+# usa um único gerador, SeedSequence(seed, spawn_key=(bloco, etapa)), com todas as linhas tiradas de uma vez.
+# Os sorteios são estáveis por prefixo (a linha r só usa números que vêm antes dos das linhas seguintes),
+# então as primeiras linhas de um bloco não dependem de quantas linhas dele são sorteadas.
+# Mudar BLOCO_SORTEIO ou a ordem das etapas muda as amostras de uma mesma seed.
+BLOCO_SORTEIO = 256
+ETAPA_COTAS, ETAPA_PREENCHIMENTO, ETAPA_EMBARALHAMENTO = 0, 1, 2 # as classes de COTAS usam 3, 4, 5
+
+def gerador_bloco(seed, bloco, etapa):
+    """Gerador de uma etapa (ETAPA_*) do sorteio do bloco de amostras bloco (ver BLOCO_SORTEIO)."""
+    return np.random.default_rng(np.random.SeedSequence(seed, spawn_key=(bloco, etapa)))
+
+def _sortear_distintos(gerador, n_pool, quantidades, q_limite, proibidos=None):
+    """
+    Para cada linha i sorteia quantidades[i] posições DISTINTAS de range(n_pool),
+    sem repetir nenhuma posição de proibidos[i].
+    Amostragem sequencial com rejeição: sorteia candidatos uniformes (com folga) para todas as
+    linhas de uma vez e fica com os primeiros válidos; linhas sem válidos suficientes são sorteadas
+    de novo (só elas, na mesma ordem). A folga depende só de q_limite (maior quantidade possível),
+    então o sorteio é estável por prefixo: as primeiras linhas não dependem das linhas seguintes.
+    Returns:
+        selecionados: array (k, max(quantidades)) com -1 nas sobras de cada linha.
+    """
+    k = len(quantidades)
+    q_max = int(quantidades.max()) if k else 0
+    n_proibidos = 0 if proibidos is None else (proibidos >= 0).sum(axis=1)
+    if k and (quantidades + n_proibidos).max() > n_pool:
+        raise ValueError(f"Pool com {n_pool} pacientes não comporta {q_max} sorteios distintos.")
+
+    selecionados = np.full((k, q_max), -1, dtype=np.int64)
+    pendentes = np.arange(k)
+    folga = 2 * q_limite + 8 # candidatos sorteados por linha
+
+    while len(pendentes):
+        candidatos = (gerador.random((len(pendentes), folga)) * n_pool).astype(np.int64)
+        validos = _primeira_ocorrencia(candidatos)
+        if proibidos is not None:
+            validos &= ~(candidatos[:, :, None] == proibidos[pendentes][:, None, :]).any(axis=2)
+
+        # Posição (1, 2, ...) de cada candidato entre os válidos da linha
+        rank = np.cumsum(validos, axis=1)
+        qtd = quantidades[pendentes]
+        completas = rank[:, -1] >= qtd
+
+        usar = validos & (rank <= qtd[:, None]) & completas[:, None]
+        linha, coluna = np.nonzero(usar)
+        selecionados[pendentes[linha], rank[linha, coluna] - 1] = candidatos[linha, coluna]
+
+        pendentes = pendentes[~completas]
+
+    return selecionados
+
+def _sortear_bloco(pool_indices, n_total, T, seed, bloco, n):
+    """As n primeiras amostras (array (n, T)) do bloco bloco, todas sorteadas juntas em NumPy."""
+    # Cotas obrigatórias por classe (limitadas a T no total)
+    sorteio_cotas = gerador_bloco(seed, bloco, ETAPA_COTAS).random((n, len(COTAS)))
+    cotas = np.column_stack([minimo + (sorteio_cotas[:, j] * (maximo - minimo + 1)).astype(np.int64)
+                             for j, (_, minimo, maximo) in enumerate(COTAS)])
+    cotas = limitar_cotas(cotas, T)
+    partes = []
+    for j, (classe, _, maximo) in enumerate(COTAS):
+        pool = pool_indices[classe]
+        sorteio = _sortear_distintos(gerador_bloco(seed, bloco, 3 + j), len(pool), cotas[:, j], min(maximo, T))
+        partes.append(np.where(sorteio >= 0, pool[np.maximum(sorteio, 0)], -1))
+
+    # Preenchimento Natural: completa até T com o pool global, sem repetir os já escolhidos
+    usados = np.concatenate(partes, axis=1)
+    falta = T - (usados >= 0).sum(axis=1)
+    if falta.max() > 0:
+        partes.append(_sortear_distintos(gerador_bloco(seed, bloco, ETAPA_PREENCHIMENTO), n_total, falta, T,
+                                         proibidos=usados))
+
+    # Junta as partes (cada linha tem exatamente T posições válidas)
+    todas = np.concatenate(partes, axis=1)
+    amostras = todas[todas >= 0].reshape(n, T)
+
+    # Embaralha cada amostra (remover viés de ordem)
+    permutacao = np.argsort(gerador_bloco(seed, bloco, ETAPA_EMBARALHAMENTO).random((n, T)), axis=1)
+    return np.take_along_axis(amostras, permutacao, axis=1).astype(np.int32)
+
+def iterar_amostras_vetorizado(severity_label, k=1500, T=30, seed=None, tamanho_chunk=10000, inicio=0):
+    """
+    Gerador que produz as k amostras em chunks (arrays (<=tamanho_chunk, T) int32).
+    Mesmas regras de cota de gerar_amostras_bootstrap e sem pacientes repetidos na amostra,
+    mas sorteadas em blocos de BLOCO_SORTEIO amostras, cada etapa com um único gerador e uma
+    única chamada NumPy para o bloco inteiro (sem loop nem gerador por amostra).
+    Útil para k enorme: nunca guarda as k amostras na memória.
+    Contrato da seed (ver BLOCO_SORTEIO): a amostra i depende só de (seed, i), então mesma seed ->
+    mesmas amostras para qualquer tamanho_chunk, e um pedaço [inicio, inicio + k) pode ser sorteado
+    à parte (ex.: por um worker; quem começa no meio de um bloco sorteia o começo dele e descarta).
+    O algoritmo é outro, então as amostras NÃO são as de gerar_amostras_bootstrap com a mesma seed.
+    Sem seed, uma entropia nova é sorteada a cada chamada.
+    """
+    severity_label = np.asarray(severity_label)
+    pool_indices = {c: np.where(severity_label == c)[0] for c in np.unique(severity_label)}
+    n_total = len(severity_label)
+    seed = np.random.SeedSequence().entropy if seed is None else seed
+    fim = inicio + k
+
+    blocos = range(inicio // BLOCO_SORTEIO, (fim - 1) // BLOCO_SORTEIO + 1) if k > 0 else range(0)
+    pendentes, n_pendentes = [], 0
+    for bloco in blocos:
+        inicio_bloco = bloco * BLOCO_SORTEIO
+        n = min(fim, inicio_bloco + BLOCO_SORTEIO) - inicio_bloco # linhas do bloco até a última pedida
+        amostras = _sortear_bloco(pool_indices, n_total, T, seed, bloco, n)
+        pendentes.append(amostras[max(inicio - inicio_bloco, 0):])
+        n_pendentes += len(pendentes[-1])
+        # Reagrupa os blocos em chunks de tamanho_chunk
+        while n_pendentes >= tamanho_chunk:
+            juntas = np.concatenate(pendentes)
+            yield juntas[:tamanho_chunk]
+            pendentes, n_pendentes = [juntas[tamanho_chunk:]], n_pendentes - tamanho_chunk
+    if n_pendentes:
+        yield np.concatenate(pendentes)
+
+def gerar_amostras_vetorizado(severity_label, k=1500, T=30, seed=None, tamanho_chunk=10000, inicio=0):
+    """
+    Versão vetorizada de gerar_amostras_bootstrap (ver iterar_amostras_vetorizado).
+    Returns:
+        amostras: array contíguo (k, T) int32 com as posições dos pacientes de cada amostra.
+    """
+    print(f"Iniciando Bootstrap (vetorizado) | {k} iterações...")
+    chunks = list(iterar_amostras_vetorizado(severity_label, k, T, seed, tamanho_chunk, inicio))
+    return np.concatenate(chunks, axis=0) if chunks else np.empty((0, T), dtype=np.int32)
@@ -0,0 +1,126 @@
+import hashlib
+import json
+import os
+import numpy as np
+from src.result import TrajectoryResult
+
+VERSAO_CHECKPOINT = 1
+
+def impressao_digital(*arrays):
+    """
+    Hash dos arrays (ex.: dados e severidade, ou as amostras): um checkpoint só é retomado
+    com os mesmos pacientes e as mesmas amostras.
+    """
+    h = hashlib.sha256()
+    for array in arrays:
+        h.update(np.ascontiguousarray(array).tobytes())
+    return h.hexdigest()[:16]
+
+
+class CheckpointTrajetorias:
+    """
+    Checkpoint em disco de uma execução longa, chunk a chunk.
+    Conteúdo da pasta:
+        amostras.npy   -> array (k, T) com todas as amostras (gravado uma vez, no início)
+        rotulos.npy    -> IDs dos pacientes (posição -> ID)
+        posicoes.bin, pseudotempo.bin, severidade.bin
+                       -> binário "cru" (int32 / float32 / int8) ao qual cada chunk concluído é anexado
+        estado.json    -> configuração, estado do gerador aleatório e quantas trajetórias já estão completas
+    O estado.json só é atualizado (troca atômica) depois que os binários do chunk foram gravados no disco;
+    ao retomar, qualquer sobra de um chunk interrompido no meio é cortada dos binários.
+    """
+
+    ARRAYS = {'posicoes': np.int32, 'pseudotempo': np.float32, 'severidade': np.int8}
+
+    def __init__(self, pasta):
+        self.pasta = pasta
+        self.estado = None
+
+    def _caminho(self, nome):
+        return os.path.join(self.pasta, nome)
+
+    def existe(self):
+        return os.path.exists(self._caminho('estado.json'))
+
+    def _salvar_estado(self):
+        temporario = self._caminho('estado.json.tmp')
+        with open(temporario, 'w') as f:
+            json.dump(self.estado, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporario, self._caminho('estado.json'))
+
+    def iniciar(self, amostras, rotulos, config, estado_rng=None):
+        """
+        Começa um checkpoint novo (apaga o conteúdo anterior da pasta).
+        Args:
+            amostras: array (k, T) com todas as amostras da execução.
+            rotulos: IDs dos pacientes (índice do DataFrame).
+            config: dicionário (JSON) com o que precisa ser igual para poder retomar.
+            estado_rng: (Opcional) estado do gerador usado no sorteio (seed/entropia), para reprodução.
+        """
+        os.makedirs(self.pasta, exist_ok=True)
+        np.save(self._caminho('amostras.npy'), amostras)
+        np.save(self._caminho('rotulos.npy'), np.asarray(rotulos))
+        for nome in self.ARRAYS:
+            open(self._caminho(f"{nome}.bin"), 'wb').close()
+        k, T = amostras.shape
+        self.estado = {'versao': VERSAO_CHECKPOINT, 'k': k, 'T': T, 'config': config, 'estado_rng': estado_rng,
+                       'concluidas': 0, 'chunks': 0}
+        self._salvar_estado()
+
+    def config_gravada(self):
+        """Configuração gravada no estado.json (ex.: para reaproveitar a seed sorteada ao retomar)."""
+        with open(self._caminho('estado.json')) as f:
+            return json.load(f)['config']
+
+    def retomar(self, config):
+        """
+        Reabre o checkpoint para continuar a execução.
+        Returns:
+            (amostras, concluidas): todas as amostras e quantas trajetórias já estão prontas.
+        """
+        with open(self._caminho('estado.json')) as f:
+            self.estado = json.load(f)
+        if self.estado['versao'] != VERSAO_CHECKPOINT or self.estado['config'] != config:
+            raise ValueError(f"O checkpoint em '{self.pasta}' é de outra execução (dados ou configurações "
+                             "diferentes). Use retomar=False para começar de novo.")
+
+        # Corta o que foi gravado depois do último estado salvo (chunk interrompido no meio)
+        concluidas, T = self.estado['concluidas'], self.estado['T']
+        for nome, dtype in self.ARRAYS.items():
+            with open(self._caminho(f"{nome}.bin"), 'r+b') as f:
+                f.truncate(concluidas * T * np.dtype(dtype).itemsize)
+
+        return np.load(self._caminho('amostras.npy')), concluidas
+
+    def adicionar(self, resultado_chunk):
+        """Anexa um chunk concluído (result.TrajectoryResult) e registra o progresso."""
+        for nome, dtype in self.ARRAYS.items():
+            with open(self._caminho(f"{nome}.bin"), 'ab') as f:
+                f.write(np.ascontiguousarray(getattr(resultado_chunk, nome), dtype=dtype).tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+        self.estado['concluidas'] += len(resultado_chunk)
+        self.estado['chunks'] += 1
+        self._salvar_estado()
+
+    @property
+    def completo(self):
+        return self.estado is not None and self.estado['concluidas'] == self.estado['k']
+
+    def resultado(self, mmap_mode=None):
+        """
+        Trajetórias gravadas até agora como result.TrajectoryResult.
+        mmap_mode: (Opcional) ex.: 'r' abre os binários em memmap, sem ler tudo para a memória.
+        """
+        T = self.estado['T']
+        arrays = {}
+        for nome, dtype in self.ARRAYS.items():
+            caminho = self._caminho(f"{nome}.bin")
+            if mmap_mode is None or self.estado['concluidas'] == 0:
+                arrays[nome] = np.fromfile(caminho, dtype=dtype).reshape(-1, T)
+            else:
+                arrays[nome] = np.memmap(caminho, dtype=dtype, mode=mmap_mode).reshape(-1, T)
+        return TrajectoryResult(arrays['posicoes'], arrays['pseudotempo'], arrays['severidade'],
+                                np.load(self._caminho('rotulos.npy'), allow_pickle=True))
@@ -0,0 +1,386 @@
+import numpy as np
+import pandas as pd
+from scipy import stats
+
+# Quantis reportados por padrão no consenso
+QUANTIS = (0.05, 0.25, 0.5, 0.75, 0.95)
+
+class AgregadorConsenso:
+    """
+    Pseudo-tempo de consenso por paciente, agregando as k trajetórias de forma incremental
+    (chunk a chunk), sem montar a tabela longa (k*T linhas) em memória.
+    Por paciente acumula:
+        - quantidade de amostras em que apareceu;
+        - média e variância do pseudo-tempo (momentos combinados por chunk, fórmula de Chan);
+        - média e variância da posição normalizada (rank / (T - 1), entre 0 e 1);
+        - histograma do pseudo-tempo e do rank normalizado, de onde saem os quantis
+          (esboço: mesma regra de consenso_exato / np.quantile, com os valores de cada bin
+          espalhados uniformemente dentro dele; erro menor que a largura de um bin.
+          Para os quantis exatos use consenso_exato).
+    Uso:
+        agregador = AgregadorConsenso(n_pacientes=len(df_norm))
+        for resultado_chunk in ...:      # TrajectoryResult (ou arrays) de cada chunk
+            agregador.atualizar_resultado(resultado_chunk)
+        df_consenso = agregador.consenso(rotulos=df_norm.index)
+    """
+
+    def __init__(self, n_pacientes, n_bins=256, pseudotempo_max=None):
+        """
+        n_pacientes: quantidade de pacientes (N) da tabela de onde saem as posições.
+        n_bins: bins dos histogramas (mais bins = quantis mais precisos, mais memória: N * n_bins).
+        pseudotempo_max: limite inicial do histograma do pseudo-tempo. Se None, é definido no primeiro
+            chunk (2x o maior valor visto). Se um chunk passar do limite, a faixa é dobrada
+            (bins vizinhos são somados), então nenhum valor fica fora do histograma.
+        """
+        if n_bins % 2:
+            raise ValueError("n_bins precisa ser par (a faixa do histograma é dobrada somando pares de bins).")
+        self.n = n_pacientes
+        self.n_bins = n_bins
+        self.pseudotempo_max = pseudotempo_max
+
+        self.contagem = np.zeros(n_pacientes, dtype=np.int64)
+        self.media = np.zeros(n_pacientes)
+        self.m2 = np.zeros(n_pacientes) # soma dos quadrados dos desvios (variância = m2 / contagem)
+        self.media_rank = np.zeros(n_pacientes)
+        self.m2_rank = np.zeros(n_pacientes)
+        self.hist = np.zeros((n_pacientes, n_bins), dtype=np.int32)
+        self.hist_rank = np.zeros((n_pacientes, n_bins), dtype=np.int32)
+
+    def _combinar_momentos(self, media, m2, posicoes, valores):
+        # Momentos do chunk por paciente (bincount) combinados com os acumulados
+        n_b = np.bincount(posicoes, minlength=self.n)
+        soma_b = np.bincount(posicoes, weights=valores, minlength=self.n)
+        presentes = n_b > 0
+        media_b = np.zeros(self.n)
+        media_b[presentes] = soma_b[presentes] / n_b[presentes]
+        m2_b = np.bincount(posicoes, weights=(valores - media_b[posicoes]) ** 2, minlength=self.n)
+
+        n_a = self.contagem
+        n_ab = n_a + n_b
+        delta = media_b - media
+        with np.errstate(invalid='ignore', divide='ignore'):
+            nova_media = np.where(presentes, media + delta * n_b / np.maximum(n_ab, 1), media)
+            novo_m2 = np.where(presentes, m2 + m2_b + delta ** 2 * n_a * n_b / np.maximum(n_ab, 1), m2)
+        return nova_media, novo_m2
+
+    def atualizar(self, posicoes, pseudotempo):
+        """
+        Acrescenta um chunk de trajetórias.
+        Args:
+            posicoes: array (b, T) com a posição (iloc) dos pacientes, na ordem da trajetória.
+            pseudotempo: array (b, T) com a distância de cada paciente até a raiz.
+        """
+        posicoes = np.asarray(posicoes)
+        if posicoes.size == 0:
+            return
+        T = posicoes.shape[1]
+        rank = np.broadcast_to(np.arange(T) / max(T - 1, 1), posicoes.shape)
+
+        pos = posicoes.ravel()
+        valores = np.asarray(pseudotempo, dtype=np.float64).ravel()
+        valores_rank = rank.ravel()
+
+        maximo = float(valores.max())
+        if self.pseudotempo_max is None:
+            self.pseudotempo_max = 2 * maximo if maximo > 0 else 1.0
+        while maximo >= self.pseudotempo_max:
+            self._dobrar_faixa()
+
+        self.media, self.m2 = self._combinar_momentos(self.media, self.m2, pos, valores)
+        self.media_rank, self.m2_rank = self._combinar_momentos(self.media_rank, self.m2_rank, pos, valores_rank)
+        self.contagem += np.bincount(pos, minlength=self.n)
+
+        # Histogramas (um por paciente) acumulados com np.add.at
+        bins = np.clip((valores / self.pseudotempo_max * self.n_bins).astype(np.int64), 0, self.n_bins - 1)
+        np.add.at(self.hist, (pos, bins), 1)
+        bins_rank = np.clip((valores_rank * self.n_bins).astype(np.int64), 0, self.n_bins - 1)
+        np.add.at(self.hist_rank, (pos, bins_rank), 1)
+
+    def _dobrar_faixa(self):
+        # Dobra a faixa do histograma do pseudo-tempo: cada par de bins vira um bin só
+        metade = self.hist.reshape(self.n, self.n_bins // 2, 2).sum(axis=2)
+        self.hist = np.concatenate([metade, np.zeros_like(metade)], axis=1)
+        self.pseudotempo_max *= 2
+
+    def atualizar_resultado(self, resultado):
+        """Acrescenta um result.TrajectoryResult inteiro (ou um chunk dele)."""
+        self.atualizar(resultado.posicoes, resultado.pseudotempo)
+
+    def _quantis_histograma(self, hist, limite, quantis):
+        # Mesma regra de consenso_exato (interpolação linear entre as estatísticas de ordem
+        # floor(h) e floor(h) + 1, h = (n - 1) * q), com a estatística de ordem j estimada
+        # espalhando uniformemente as c observações do bin em que ela cai
+        acumulado = np.cumsum(hist, axis=1)
+        total = acumulado[:, -1]
+        largura = limite / self.n_bins
+        linhas = np.arange(len(hist))
+
+        def estatistica_ordem(j):
+            b = np.minimum((acumulado <= j[:, None]).sum(axis=1), self.n_bins - 1)
+            c = np.maximum(hist[linhas, b], 1)
+            antes = acumulado[linhas, b] - hist[linhas, b]
+            return (b + (j - antes + 0.5) / c) * largura
+
+        saida = {}
+        for q in quantis:
+            h = np.maximum(total - 1, 0) * q
+            baixo = np.floor(h).astype(np.int64)
+            alto = np.minimum(baixo + 1, np.maximum(total - 1, 0))
+            v_baixo = estatistica_ordem(baixo)
+            valor = v_baixo + (h - baixo) * (estatistica_ordem(alto) - v_baixo)
+            saida[q] = np.where(total > 0, valor, np.nan)
+        return saida
+
+    def consenso(self, rotulos=None, quantis=QUANTIS, apenas_presentes=True):
+        """
+        Tabela de consenso (uma linha por paciente).
+        Args:
+            rotulos: (Opcional) IDs dos pacientes (ex.: df_norm.index) usados como índice.
+            quantis: quantis do pseudo-tempo a reportar.
+            apenas_presentes: remove os pacientes que não apareceram em nenhuma amostra.
+        Returns:
+            DataFrame com n_amostras, pseudotempo_media, pseudotempo_desvio, pseudotempo_q..
+            (q50, a mediana, sempre incluído), rank_norm_media, rank_norm_desvio e rank_norm_mediana.
+        """
+        quantis = sorted(set(quantis) | {0.5})
+        presentes = self.contagem > 0
+        with np.errstate(invalid='ignore', divide='ignore'):
+            desvio = np.sqrt(self.m2 / self.contagem)
+            desvio_rank = np.sqrt(self.m2_rank / self.contagem)
+
+        q_pseudo = self._quantis_histograma(self.hist, self.pseudotempo_max or 1.0, quantis)
+        q_rank = self._quantis_histograma(self.hist_rank, 1.0, (0.5,))
+
+        df = pd.DataFrame({
+            'n_amostras': self.contagem,
+            'pseudotempo_media': np.where(presentes, self.media, np.nan),
+            'pseudotempo_desvio': desvio,
+        }, index=rotulos)
+        for q in quantis:
+            df[f'pseudotempo_q{int(round(q * 100)):02d}'] = q_pseudo[q]
+        df['rank_norm_media'] = np.where(presentes, self.media_rank, np.nan)
+        df['rank_norm_desvio'] = desvio_rank
+        df['rank_norm_mediana'] = q_rank[0.5]
+
+        return df[presentes] if apenas_presentes else df
+
+
+class MonitorEstabilidade:
+    """
+    Acompanha, chunk a chunk, se o consenso do bootstrap já estabilizou, para parar de sortear
+    amostras antes de k (ver trajectory.processar_trajetorias_estabilidade).
+    Depois de cada chunk mede:
+        - erro_relativo (critério principal): mediana, entre os pacientes, do erro padrão do
+          pseudo-tempo médio (desvio / sqrt(n)) dividido pelo pseudo-tempo médio da coorte;
+        - tau_metades: Kendall tau entre os consensos (pseudo-tempo médio) de duas metades
+          disjuntas das amostras (amostras de índice par x ímpar), nos pacientes cobertos que
+          aparecem nas duas. Não tende a 1 só porque o total cresce (ao contrário de comparar
+          médias acumuladas seguidas): as metades são independentes;
+        - concordancia_amostras: Kendall tau médio entre a ordem de cada trajetória do chunk e o
+          consenso acumulado até o chunk anterior. Só diagnóstico (fora da regra de parada): mede a
+          variação de uma amostra em torno do consenso, que não diminui com mais amostras;
+        - cobertura: fração dos pacientes com pelo menos min_aparicoes aparições.
+    Convergiu quando, com pelo menos min_amostras, erro_relativo <= tolerancia_erro,
+    1 - tau_metades <= tolerancia (se tolerancia não for None) e cobertura >= min_cobertura
+    em `paciencia` verificações seguidas.
+    O que as tolerâncias garantem (na parada):
+        - tolerancia_erro: o erro padrão típico (mediana) do pseudo-tempo médio de um paciente é no
+          máximo tolerancia_erro vezes o pseudo-tempo médio da coorte;
+        - tolerancia: dois consensos feitos com metades disjuntas das amostras ordenam de forma
+          diferente no máximo tolerancia / 2 dos pares de pacientes (tau = 1 - 2 x fração
+          discordante, sem empates); o consenso com todas as amostras varia menos que o de cada metade.
+    Uso:
+        monitor = MonitorEstabilidade(n_pacientes=len(df_norm), tolerancia_erro=0.05)
+        for resultado_chunk in ...:
+            monitor.atualizar_resultado(resultado_chunk)
+            if monitor.convergiu:
+                break
+        monitor.historico() # DataFrame com as medidas de cada verificação
+    """
+
+    def __init__(self, n_pacientes, tolerancia=None, tolerancia_erro=0.05, min_amostras=200, min_aparicoes=5,
+                 min_cobertura=0.0, paciencia=2, agregador=None):
+        """
+        n_pacientes: quantidade de pacientes (N) da tabela de onde saem as posições.
+        tolerancia: limite de 1 - tau_metades (None = não usa as metades na parada).
+        tolerancia_erro: limite do erro_relativo (critério principal).
+        agregador: (Opcional) AgregadorConsenso já existente que também deve receber os chunks;
+            se None, é criado um (monitor.agregador.consenso() dá o consenso das amostras usadas).
+        Demais argumentos: critérios de parada (ver acima).
+        """
+        self.n = n_pacientes
+        self.tolerancia = tolerancia
+        self.tolerancia_erro = tolerancia_erro
+        self.min_amostras = min_amostras
+        self.min_aparicoes = min_aparicoes
+        self.min_cobertura = min_cobertura
+        self.paciencia = paciencia
+        self.agregador = agregador or AgregadorConsenso(n_pacientes)
+
+        self.n_amostras = 0
+        self.soma_concordancia = 0.0
+        self.n_concordancia = 0
+        # Soma e contagem do pseudo-tempo por paciente em cada metade (amostras pares / ímpares)
+        self.soma_metades = np.zeros((2, n_pacientes))
+        self.contagem_metades = np.zeros((2, n_pacientes), dtype=np.int64)
+        self.verificacoes_ok = 0
+        self._historico = []
+
+    @staticmethod
+    def _concordancia_trajetorias(pseudotempo, referencia):
+        # Kendall tau-b entre pseudo-tempo e referência em cada linha (b, T), vetorizado nos T x T pares
+        sinal_a = np.sign(pseudotempo[:, :, None] - pseudotempo[:, None, :])
+        sinal_b = np.sign(referencia[:, :, None] - referencia[:, None, :])
+        concordantes = (sinal_a * sinal_b).sum(axis=(1, 2))
+        normalizacao = np.sqrt(np.abs(sinal_a).sum(axis=(1, 2)) * np.abs(sinal_b).sum(axis=(1, 2)))
+        with np.errstate(invalid='ignore', divide='ignore'):
+            tau = concordantes / normalizacao
+        return tau[normalizacao > 0]
+
+    def atualizar(self, posicoes, pseudotempo):
+        """
+        Acrescenta um chunk de trajetórias e faz uma verificação.
+        Args:
+            posicoes: array (b, T) com a posição (iloc) dos pacientes, na ordem da trajetória.
+            pseudotempo: array (b, T) com a distância de cada paciente até a raiz.
+        Returns:
+            dicionário com as medidas desta verificação (também guardado no histórico).
+        """
+        posicoes = np.asarray(posicoes)
+        pseudotempo = np.asarray(pseudotempo, dtype=np.float64)
+
+        # Ordem de cada trajetória x consenso acumulado até aqui (antes de incluir o chunk)
+        if self.n_amostras > 0:
+            taus = self._concordancia_trajetorias(pseudotempo, self.agregador.media[posicoes])
+            self.soma_concordancia += taus.sum()
+            self.n_concordancia += len(taus)
+
+        # Metade de cada amostra pelo índice global (par/ímpar): não depende do tamanho do chunk
+        metade = (self.n_amostras + np.arange(len(posicoes))) % 2
+        for h in (0, 1):
+            linhas = metade == h
+            self.soma_metades[h] += np.bincount(posicoes[linhas].ravel(), weights=pseudotempo[linhas].ravel(),
+                                                minlength=self.n)
+            self.contagem_metades[h] += np.bincount(posicoes[linhas].ravel(), minlength=self.n)
+
+        self.agregador.atualizar(posicoes, pseudotempo)
+        self.n_amostras += len(posicoes)
+
+        contagem = self.agregador.contagem
+        media = self.agregador.media
+        cobertos = contagem >= self.min_aparicoes
+        cobertura = float(cobertos.mean())
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            erro_padrao = np.sqrt(self.agregador.m2[cobertos] / contagem[cobertos]) / np.sqrt(contagem[cobertos])
+        escala = media[cobertos].mean() if cobertos.any() else np.nan
+        erro_relativo = float(np.median(erro_padrao) / escala) if cobertos.any() and escala > 0 else np.nan
+
+        tau_metades = np.nan
+        comuns = cobertos & (self.contagem_metades > 0).all(axis=0)
+        if comuns.sum() > 1:
+            medias_metades = self.soma_metades[:, comuns] / self.contagem_metades[:, comuns]
+            tau_metades = float(stats.kendalltau(medias_metades[0], medias_metades[1])[0])
+
+        medidas = {
+            'n_amostras': self.n_amostras,
+            'erro_relativo': erro_relativo,
+            'tau_metades': tau_metades,
+            'concordancia_amostras': (self.soma_concordancia / self.n_concordancia if self.n_concordancia
+                                      else np.nan),
+            'cobertura': cobertura,
+        }
+
+        estavel = (self.n_amostras >= self.min_amostras
+                   and erro_relativo <= self.tolerancia_erro  # NaN -> False
+                   and (self.tolerancia is None or 1 - tau_metades <= self.tolerancia)
+                   and cobertura >= self.min_cobertura)
+        self.verificacoes_ok = self.verificacoes_ok + 1 if estavel else 0
+        medidas['convergiu'] = self.convergiu
+        self._historico.append(medidas)
+        return medidas
+
+    def atualizar_resultado(self, resultado):
+        """Acrescenta um result.TrajectoryResult (ou um chunk dele) e faz uma verificação."""
+        return self.atualizar(resultado.posicoes, resultado.pseudotempo)
+
+    @property
+    def convergiu(self):
+        return self.verificacoes_ok >= self.paciencia
+
+    def historico(self):
+        """DataFrame com as medidas de cada verificação (uma linha por chunk)."""
+        return pd.DataFrame(self._historico)
+
+
+def consenso_exato(resultado, rotulos=None, quantis=QUANTIS):
+    """
+    Consenso exato (quantis sem aproximação) a partir de um result.TrajectoryResult completo.
+    Vetorizado: ordena todas as observações por paciente uma vez e calcula os quantis por grupo.
+    Returns:
+        DataFrame com as mesmas colunas de AgregadorConsenso.consenso.
+    """
+    quantis = sorted(set(quantis) | {0.5})
+    k, T = resultado.posicoes.shape
+    pos = resultado.posicoes.ravel()
+    valores = resultado.pseudotempo.astype(np.float64).ravel()
+    valores_rank = np.tile(np.arange(T) / max(T - 1, 1), k)
+
+    n = len(resultado.rotulos)
+    contagem = np.bincount(pos, minlength=n)
+    presentes = contagem > 0
+    inicio_grupo = np.concatenate([[0], np.cumsum(contagem)[:-1]])
+
+    def _estatisticas(v):
+        # Ordena por (paciente, valor): cada paciente vira um trecho ordenado do vetor
+        ordem = np.lexsort((v, pos))
+        v_ord = v[ordem]
+        media = np.bincount(pos, weights=v, minlength=n) / np.maximum(contagem, 1)
+        desvio = np.sqrt(np.bincount(pos, weights=(v - media[pos]) ** 2, minlength=n) / np.maximum(contagem, 1))
+
+        def quantil(q):
+            # Interpolação linear (mesma regra de np.quantile) dentro do trecho de cada paciente
+            h = (contagem - 1) * q
+            baixo = np.floor(h).astype(np.int64)
+            alto = np.minimum(baixo + 1, contagem - 1)
+            idx_baixo = np.clip(inicio_grupo + baixo, 0, len(v_ord) - 1)
+            idx_alto = np.clip(inicio_grupo + alto, 0, len(v_ord) - 1)
+            return v_ord[idx_baixo] + (h - baixo) * (v_ord[idx_alto] - v_ord[idx_baixo])
+
+        return media, desvio, quantil
+
+    media, desvio, quantil = _estatisticas(valores)
+    media_rank, desvio_rank, quantil_rank = _estatisticas(valores_rank)
+
+    rotulos = resultado.rotulos if rotulos is None else rotulos
+    df = pd.DataFrame({
+        'n_amostras': contagem,
+        'pseudotempo_media': media,
+        'pseudotempo_desvio': desvio,
+    }, index=rotulos)
+    for q in quantis:
+        df[f'pseudotempo_q{int(round(q * 100)):02d}'] = quantil(q)
+    df['rank_norm_media'] = media_rank
+    df['rank_norm_desvio'] = desvio_rank
+    df['rank_norm_mediana'] = quantil_rank(0.5)
+
+    return df[presentes]
+
+
+def comparar_com_consenso(df_consenso, resultado_coorte, coluna='pseudotempo_q50'):
+    """
+    Concordância entre a trajetória única da coorte (trajectory.trajetoria_coorte) e o consenso
+    do bootstrap, nos pacientes presentes nos dois.
+    Returns:
+        dicionário com n_pacientes e as correlações de Spearman e Kendall do pseudo-tempo.
+    """
+    pseudotempo_coorte = pd.Series(resultado_coorte.pseudotempo[0],
+                                   index=resultado_coorte.rotulos[resultado_coorte.posicoes[0]])
+    comum = df_consenso.index.intersection(pseudotempo_coorte.index)
+    consenso = df_consenso.loc[comum, coluna]
+    coorte = pseudotempo_coorte.loc[comum]
+    return {
+        'n_pacientes': len(comum),
+        'spearman': float(consenso.corr(coorte, method='spearman')),
+        'kendall': float(consenso.corr(coorte, method='kendall')),
+    }
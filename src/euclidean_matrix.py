@@ -1,25 +1,34 @@
+import hashlib
+import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 import seaborn as sns
 from scipy.spatial.distance import pdist, squareform
+from src.render import finalizar_figura
 
 # --- 1. FUNÇÃO AUX PARA CALCULAR A MATRIZ ---
-def compute_distance_matrix(df_normalized, sample_size=None):
+def compute_distance_matrix(df_normalized, sample_size=None, metrica=None):
     """
     Calcula a matriz de distância euclidiana.
     Args:
         df_normalized: DataFrame com dados normalizados.
         sample_size: (Opcional) Inteiro. Se definido, faz uma amostragem aleatória 
+        metrica: (Opcional) Metrica já ajustada na coorte (ver preparar_metrica); padrão: euclidiana.
     Returns:
-        dist_matrix: Matriz quadrada (numpy array) com as distâncias.
+        dist_matrix: Matriz quadrada (numpy array) com as distâncias (float32 se os dados forem float32).
         df_used: amostra do DataSet que foi usado para gerar a matriz.
     """
 
     df_used = df_normalized.copy()
 
     # Cálculo da Distância Euclidiana
-    dist_vector = pdist(df_used.values, metric='euclidean') #vetor de distancias
-    dist_matrix = squareform(dist_vector) # converte para matriz quadrada
+    if metrica is None:
+        dist_vector = pdist(df_used.values, metric='euclidean') #vetor de distancias
+        if df_used.values.dtype == np.float32:
+            dist_vector = dist_vector.astype(np.float32) # pdist sempre calcula em float64
+        dist_matrix = squareform(dist_vector) # converte para matriz quadrada
+    else:
+        dist_matrix = metrica.distancias(metrica.transformar(df_used.values)[None])[0]
     
     # Gera o DataFrame Pandas com os nomes
     df_matrix_formatada = pd.DataFrame(
@@ -31,10 +40,280 @@ def compute_distance_matrix(df_normalized, sample_size=None):
     return dist_matrix, df_matrix_formatada
 
 
+# --- 1.1 VERSÃO EM LOTE (TODAS AS AMOSTRAS DE UMA VEZ) ---
+def compute_distance_tensor(dados, amostras_indices):
+    """
+    Calcula as matrizes de distância euclidiana de várias amostras numa única passada NumPy.
+    Mesmo resultado (bit a bit) de rodar pdist/squareform amostra por amostra.
+    O cálculo é feito no dtype dos dados (float32 usa metade da memória no tensor (k, T, T, F)).
+    Args:
+        dados: array (N, F) (ou DataFrame) com os dados normalizados de todos os pacientes.
+        amostras_indices: array (k, T) com as posições (iloc) dos pacientes de cada amostra.
+    Returns:
+        tensor_dist: array (k, T, T) com a matriz de distâncias de cada amostra.
+    """
+    X = np.asarray(dados)
+    X_amostras = X[np.asarray(amostras_indices)] # (k, T, F)
+
+    # Diferença entre todos os pares de pacientes da mesma amostra (k, T, T, F)
+    diff = X_amostras[:, :, None, :] - X_amostras[:, None, :, :]
+    tensor_dist = np.sqrt((diff * diff).sum(axis=-1))
+
+    return tensor_dist
+
+
+# --- 1.1.1 MÉTRICAS DE DISTÂNCIA (REGISTRO) ---
+# Todas as métricas daqui viram distância euclidiana depois de uma transformação por paciente
+# (z = transformar(x)), cujos parâmetros (desvios, covariância inversa, pesos) são ajustados uma
+# única vez na coorte inteira. As distâncias do lote saem da identidade da matriz de Gram:
+#   ||a - b||² = ||a||² + ||b||² - 2 a·b   (um matmul por lote, sem o tensor (k, T, T, F))
+
+class Metrica:
+    """Métrica base: transformação identidade (distância euclidiana)."""
+    nome = 'euclidiana'
+    quadrado = False # True: a distância é ||za - zb||² / 2 (correlação) em vez de ||za - zb||
+    ajustada = False # ajustar() marca True na instância (preparar_metrica não ajusta de novo)
+
+    def ajustar(self, X, colunas=None):
+        """Ajusta os parâmetros da métrica na coorte (X: array (N, F) normalizado)."""
+        self.ajustada = True
+        return self
+
+    def impressao_digital(self):
+        """Hash do nome e dos parâmetros (pesos, desvios, L...): identifica a métrica no checkpoint."""
+        h = hashlib.sha256(self.nome.encode())
+        for nome, valor in sorted(vars(self).items()):
+            h.update(nome.encode())
+            if isinstance(valor, dict):
+                h.update(repr(sorted(valor.items())).encode())
+            else:
+                h.update(np.ascontiguousarray(valor).tobytes())
+        return h.hexdigest()[:16]
+
+    def transformar(self, X):
+        """Leva os pacientes para o espaço onde a métrica é euclidiana."""
+        return np.asarray(X)
+
+    def distancias(self, Z_amostras):
+        """
+        Matrizes de distância de um lote já transformado, pela identidade de Gram.
+        Args:
+            Z_amostras: array (k, T, F) com os pacientes transformados de cada amostra.
+        Returns:
+            tensor_dist: array (k, T, T).
+        """
+        normas = (Z_amostras * Z_amostras).sum(axis=-1)
+        d2 = normas[:, :, None] + normas[:, None, :] - 2 * (Z_amostras @ Z_amostras.transpose(0, 2, 1))
+        # Erro de arredondamento da identidade: pares idênticos (ou quase) viram distância zero,
+        # como no pdist (distância zero não vira aresta na MST)
+        tolerancia = 8 * np.finfo(d2.dtype).eps * (normas[:, :, None] + normas[:, None, :])
+        d2 = np.where(d2 > tolerancia, d2, 0.0)
+        return d2 / 2 if self.quadrado else np.sqrt(d2)
+
+
+class MetricaEuclidianaPadronizada(Metrica):
+    """Euclidiana com cada feature dividida pelo desvio padrão da coorte (como 'seuclidean' do scipy)."""
+    nome = 'euclidiana_padronizada'
+
+    def ajustar(self, X, colunas=None):
+        self.desvios_ = np.asarray(X).std(axis=0, ddof=1)
+        self.desvios_[self.desvios_ == 0] = 1.0
+        self.ajustada = True
+        return self
+
+    def transformar(self, X):
+        return np.asarray(X) / self.desvios_.astype(np.asarray(X).dtype)
+
+
+class MetricaMahalanobis(Metrica):
+    """
+    Mahalanobis com a covariância da coorte inteira: (a - b)ᵀ VI (a - b) = ||(a - b) L||²,
+    com VI = L Lᵀ (Cholesky da covariância inversa).
+    """
+    nome = 'mahalanobis'
+
+    def ajustar(self, X, colunas=None):
+        covariancia = np.cov(np.asarray(X, dtype=np.float64), rowvar=False)
+        self.L_ = np.linalg.cholesky(np.linalg.pinv(covariancia))
+        self.ajustada = True
+        return self
+
+    def transformar(self, X):
+        return np.asarray(X) @ self.L_.astype(np.asarray(X).dtype)
+
+
+class MetricaEuclidianaPonderada(Metrica):
+    """
+    Euclidiana com peso por feature: sqrt(sum w_f * (a_f - b_f)²).
+    pesos: dicionário {feature: peso} (as que faltarem ficam com peso 1) ou array (F,).
+    """
+    nome = 'euclidiana_ponderada'
+
+    def __init__(self, pesos=None):
+        self.pesos = {'age': 0.5} if pesos is None else pesos # padrão: idade pesa metade
+
+    def ajustar(self, X, colunas=None):
+        F = np.asarray(X).shape[1]
+        if isinstance(self.pesos, dict):
+            if colunas is None:
+                raise ValueError("Pesos por nome de feature precisam das colunas (ajustar(X, colunas=...)).")
+            pesos = np.array([self.pesos.get(col, 1.0) for col in colunas], dtype=np.float64)
+        else:
+            pesos = np.asarray(self.pesos, dtype=np.float64)
+        if len(pesos) != F:
+            raise ValueError(f"Esperados {F} pesos, recebidos {len(pesos)}.")
+        self.raiz_pesos_ = np.sqrt(pesos)
+        self.ajustada = True
+        return self
+
+    def transformar(self, X):
+        return np.asarray(X) * self.raiz_pesos_.astype(np.asarray(X).dtype)
+
+
+class MetricaCorrelacao(Metrica):
+    """
+    Distância de correlação (1 - r de Pearson entre os perfis de dois pacientes), como 'correlation'
+    do scipy: com cada paciente centrado e normalizado, 1 - r = ||za - zb||² / 2.
+    """
+    nome = 'correlacao'
+    quadrado = True
+
+    def transformar(self, X):
+        X = np.asarray(X)
+        centrado = X - X.mean(axis=1, keepdims=True)
+        normas = np.linalg.norm(centrado, axis=1, keepdims=True)
+        return np.divide(centrado, normas, out=np.zeros_like(centrado), where=normas > 0)
+
+
+METRICAS = {m.nome: m for m in (Metrica, MetricaEuclidianaPadronizada, MetricaMahalanobis,
+                                 MetricaEuclidianaPonderada, MetricaCorrelacao)}
+
+def preparar_metrica(metrica, dados, colunas=None):
+    """
+    Resolve a métrica usada pelo motor de trajetórias.
+    Args:
+        metrica: None ou 'euclidiana' (caminho exato, igual ao pdist), nome do registro METRICAS
+            ou instância de Metrica (se já ajustada, metrica.ajustada, é usada como está).
+        dados: array (N, F) (ou DataFrame) da coorte, para ajustar os parâmetros uma vez.
+        colunas: nomes das features (para pesos por nome).
+    Returns:
+        None (euclidiana exata) ou a instância de Metrica ajustada.
+    """
+    if metrica is None or metrica == 'euclidiana':
+        return None
+    if isinstance(metrica, str):
+        if metrica not in METRICAS:
+            raise ValueError(f"Métrica desconhecida: '{metrica}'. Opções: {list(METRICAS)}")
+        metrica = METRICAS[metrica]()
+    return metrica if metrica.ajustada else metrica.ajustar(np.asarray(dados), colunas)
+
+
+# --- 1.2 MATRIZ GLOBAL PRÉ-CALCULADA (TODOS OS PACIENTES) ---
+class MatrizDistanciaGlobal:
+    """
+    Matriz de distâncias de TODOS os pacientes, calculada uma única vez (forma condensada, como pdist).
+    Cada amostra recebe o seu bloco (T x T) por indexação, sem recalcular distâncias.
+    Os blocos são idênticos aos de compute_distance_tensor com os dados no mesmo dtype (em float64,
+    também aos de compute_distance_matrix).
+    Para coortes grandes o vetor condensado pode ficar em disco (.npy aberto com memmap).
+    """
+
+    def __init__(self, condensada, n):
+        self.condensada = condensada # vetor (n*(n-1)/2,) - array em memória ou np.memmap
+        self.n = n
+
+    @classmethod
+    def calcular(cls, dados, dtype=np.float64, caminho_memmap=None, linhas_por_bloco=128, colunas_por_bloco=8192):
+        """
+        Calcula a matriz condensada de todos os pacientes.
+        Args:
+            dados: array (N, F) (ou DataFrame) com os dados normalizados.
+            dtype: dtype do cálculo e da matriz: np.float64 ou np.float32 (metade da memória; os dados
+                são convertidos antes, então os blocos são os de compute_distance_tensor nesse dtype).
+            caminho_memmap: (Opcional) arquivo .npy onde a matriz será gravada (np.memmap).
+            linhas_por_bloco, colunas_por_bloco: tamanho do pedaço calculado por vez; a memória
+                intermediária é linhas_por_bloco x colunas_por_bloco x F (não cresce com N).
+        """
+        X = np.asarray(dados, dtype=dtype)
+        n = len(X)
+        tamanho = n * (n - 1) // 2
+
+        if caminho_memmap is None:
+            condensada = np.empty(tamanho, dtype=dtype)
+        else:
+            condensada = np.lib.format.open_memmap(caminho_memmap, mode='w+', dtype=dtype, shape=(tamanho,))
+
+        # Preenche por blocos (linhas x colunas) só do triângulo superior: a linha i guarda as
+        # distâncias (i, j) com j > i. Diferença direta (e não ||a||² + ||b||² - 2ab) para os blocos
+        # continuarem idênticos aos de compute_distance_tensor.
+        for i0 in range(0, n - 1, linhas_por_bloco):
+            i1 = min(i0 + linhas_por_bloco, n - 1)
+            for j0 in range(i0 + 1, n, colunas_por_bloco):
+                j1 = min(j0 + colunas_por_bloco, n)
+                diff = X[i0:i1, None, :] - X[None, j0:j1, :]
+                dist_bloco = np.sqrt((diff * diff).sum(axis=-1))
+                for i in range(i0, i1):
+                    j_inicio = max(j0, i + 1)
+                    if j_inicio >= j1:
+                        continue
+                    inicio = cls._posicao(i, j_inicio, n)
+                    condensada[inicio:inicio + j1 - j_inicio] = dist_bloco[i - i0, j_inicio - j0:]
+
+        if caminho_memmap is not None:
+            condensada.flush()
+
+        return cls(condensada, n)
+
+    @classmethod
+    def abrir(cls, caminho_memmap):
+        """Abre (somente leitura, memmap) uma matriz gravada por calcular(caminho_memmap=...)."""
+        condensada = np.load(caminho_memmap, mmap_mode='r')
+        # n*(n-1)/2 = tamanho -> n
+        n = int(round((1 + np.sqrt(1 + 8 * len(condensada))) / 2))
+        return cls(condensada, n)
+
+    def __reduce__(self):
+        # Com memmap, os processos filhos reabrem o arquivo em vez de copiar a matriz inteira
+        if isinstance(self.condensada, np.memmap):
+            return (MatrizDistanciaGlobal.abrir, (self.condensada.filename,))
+        return (MatrizDistanciaGlobal, (self.condensada, self.n))
+
+    @staticmethod
+    def _posicao(i, j, n):
+        # Posição do par (i, j), i < j, no vetor condensado
+        return n * i - i * (i + 1) // 2 + (j - i - 1)
+
+    def blocos(self, amostras_indices):
+        """
+        Blocos (T x T) de várias amostras.
+        Args:
+            amostras_indices: array (k, T) (ou (T,)) com as posições (iloc) dos pacientes.
+        Returns:
+            tensor_dist: array (k, T, T) (ou (T, T)) no dtype da matriz global.
+        """
+        P = np.asarray(amostras_indices, dtype=np.int64)
+        a = np.minimum(P[..., :, None], P[..., None, :])
+        b = np.maximum(P[..., :, None], P[..., None, :])
+        diagonal = a == b
+        if len(self.condensada) == 0: # coorte com um paciente só: todos os blocos são zero
+            return np.zeros(a.shape, dtype=self.condensada.dtype)
+
+        posicoes = np.where(diagonal, 0, self._posicao(a, b, self.n))
+        tensor_dist = np.asarray(self.condensada[posicoes])
+        tensor_dist[diagonal] = 0
+
+        return tensor_dist
+
+    def bloco_df(self, df_recorte, indices_amostra):
+        """Bloco de uma amostra no mesmo formato (DataFrame rotulado) de compute_distance_matrix."""
+        return pd.DataFrame(self.blocos(indices_amostra), index=df_recorte.index, columns=df_recorte.index)
+
+
 # --- 2. FUNÇÃO PARA PLOTAR A MATRIZ COM NÚMEROS ---
-def plot_numerical_matrix(df_matrix):
+def plot_numerical_matrix(df_matrix, salvar_em=None):
     """
     Recebe o DataFrame já formatado e exibe o Heatmap com números.
+    salvar_em: (Opcional) caminho do arquivo; se definido, salva a figura em vez de abrir a janela.
     """
     plt.figure(figsize=(20, 18)) 
     
@@ -52,6 +331,6 @@ def plot_numerical_matrix(df_matrix):
     plt.title(f"Matriz Numérica - ({n_samples} Pacientes)")
     plt.xticks(rotation=90, fontsize=8)
     plt.yticks(rotation=0, fontsize=8)
-    plt.show()
+    finalizar_figura(salvar_em)
 
 
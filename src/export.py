@@ -0,0 +1,281 @@
+import json
+import numpy as np
+
+FORMATOS = ('csv', 'parquet', 'arrow')
+
+def _importar_pyarrow():
+    # pyarrow é opcional: só é necessário para os formatos colunares
+    try:
+        import pyarrow as pa
+        import pyarrow.ipc
+        import pyarrow.parquet
+    except ImportError as erro:
+        raise ImportError("Os formatos 'parquet' e 'arrow' precisam do pyarrow (pip install pyarrow).") from erro
+    return pa
+
+
+class ExportadorTrajetorias:
+    """
+    Exportador "streaming" das trajetórias: grava cada chunk assim que ele é calculado,
+    então a memória não cresce com k (ao contrário de trajectory.exportar_trajetorias,
+    que junta todas as rodadas antes de salvar).
+    Mesmas colunas de exportar_trajetorias:
+        valores reais | id_trajetoria | posicao_trajetoria | severidade | paciente_id
+    Formatos:
+        'csv'     -> mesmo arquivo de exportar_trajetorias (Excel Brasil: sep=';', decimal=',').
+        'parquet' -> um row group por chunk (precisa do pyarrow).
+        'arrow'   -> arquivo Arrow IPC, um record batch por chunk (precisa do pyarrow).
+    Nos formatos colunares severidade é int8. paciente_id é dictionary-encoded na escrita;
+    o Arrow IPC preserva o dicionário na leitura, mas o parquet o devolve como int64
+    (o pyarrow só restaura dicionários de strings).
+
+    Uso:
+        with ExportadorTrajetorias(df_real, severity_label_serie, "trajetorias.parquet", formato='parquet') as exp:
+            for trajetorias_lote in tj.iterar_trajetorias_lote(...):
+                exp.escrever(trajetorias_lote)
+    """
+
+    def __init__(self, df_original, id_severity_map, nome_arquivo, formato='csv'):
+        """
+        df_original: DataFrame com valores reais (TSH, T4, T3, ...).
+        id_severity_map: Series ou dicionário que mapeia ID do paciente -> Severidade (0, 1, 2).
+        nome_arquivo: caminho do arquivo de saída.
+        formato: 'csv', 'parquet' ou 'arrow'.
+        """
+        if formato not in FORMATOS:
+            raise ValueError(f"Formato desconhecido: '{formato}'. Opções: {FORMATOS}")
+
+        self.df_original = df_original
+        self.nome_arquivo = nome_arquivo
+        self.formato = formato
+        self.severidade = np.asarray(df_original.index.map(id_severity_map))
+        self.proximo_id = 0   # id_trajetoria da próxima trajetória recebida
+        self.linhas_escritas = 0
+
+        if formato == 'csv':
+            self._arquivo = open(nome_arquivo, 'w', newline='')
+        else:
+            pa = _importar_pyarrow()
+            self._pa = pa
+            # Dicionário fixo com todos os pacientes: cada linha guarda só a posição (int32)
+            self._dicionario_ids = pa.array(df_original.index.to_numpy())
+            campos = [pa.field(col, pa.from_numpy_dtype(df_original[col].dtype)) for col in df_original.columns]
+            campos += [
+                pa.field('id_trajetoria', pa.int32()),
+                pa.field('posicao_trajetoria', pa.int32()), # int32: a trajetória da coorte tem N posições
+                pa.field('severidade', pa.int8()),
+                pa.field('paciente_id', pa.dictionary(pa.int32(), self._dicionario_ids.type)),
+            ]
+            self._schema = pa.schema(campos)
+            if formato == 'parquet':
+                self._writer = pa.parquet.ParquetWriter(nome_arquivo, self._schema)
+            else:
+                self._writer = pa.ipc.new_file(nome_arquivo, self._schema)
+
+    def escrever(self, trajetorias):
+        """
+        Grava um chunk de trajetórias (lista de listas de IDs, na ordem da trajetória).
+        Os ids das trajetórias continuam a numeração dos chunks anteriores.
+        """
+        if len(trajetorias) == 0:
+            return
+
+        tamanhos = np.array([len(t) for t in trajetorias])
+        ids = np.concatenate([np.asarray(t) for t in trajetorias])
+        posicoes = self.df_original.index.get_indexer(ids) # posição de cada paciente no df_original
+
+        id_trajetoria = np.repeat(np.arange(self.proximo_id, self.proximo_id + len(trajetorias)), tamanhos)
+        posicao_trajetoria = np.arange(len(ids)) - np.repeat(np.cumsum(tamanhos) - tamanhos, tamanhos)
+
+        if self.formato == 'csv':
+            df_chunk = self.df_original.iloc[posicoes].reset_index(drop=True)
+            df_chunk['id_trajetoria'] = id_trajetoria
+            df_chunk['posicao_trajetoria'] = posicao_trajetoria
+            df_chunk['severidade'] = self.severidade[posicoes]
+            df_chunk['paciente_id'] = ids
+            # Cabeçalho só no primeiro chunk; formatado para Excel Brasil
+            df_chunk.to_csv(self._arquivo, index=False, sep=';', decimal=',', header=self.linhas_escritas == 0)
+        else:
+            pa = self._pa
+            colunas = [pa.array(self.df_original[col].to_numpy()[posicoes]) for col in self.df_original.columns]
+            colunas += [
+                pa.array(id_trajetoria.astype(np.int32)),
+                pa.array(posicao_trajetoria.astype(np.int32)),
+                pa.array(self.severidade[posicoes].astype(np.int8)),
+                pa.DictionaryArray.from_arrays(pa.array(posicoes.astype(np.int32)), self._dicionario_ids),
+            ]
+            self._writer.write_table(pa.Table.from_arrays(colunas, schema=self._schema))
+
+        self.proximo_id += len(trajetorias)
+        self.linhas_escritas += len(ids)
+
+    def fechar(self, sucesso=True):
+        """Fecha o arquivo; sucesso=False (erro no meio da exportação) só fecha, sem a mensagem."""
+        if self.formato == 'csv':
+            self._arquivo.close()
+        else:
+            self._writer.close()
+        if sucesso:
+            print(f"Arquivo '{self.nome_arquivo}' gerado com sucesso! ({self.proximo_id} trajetórias, {self.linhas_escritas} linhas)")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, tipo_erro, erro, traceback):
+        self.fechar(sucesso=tipo_erro is None)
+
+
+def exportar_trajetorias_stream(df_original, lotes_trajetorias, id_severity_map, nome_arquivo, formato='csv'):
+    """
+    Consome um iterável de chunks de trajetórias (ex.: trajectory.iterar_trajetorias_lote)
+    gravando cada chunk assim que ele chega.
+    Returns:
+        total de trajetórias exportadas.
+    """
+    with ExportadorTrajetorias(df_original, id_severity_map, nome_arquivo, formato) as exportador:
+        for trajetorias in lotes_trajetorias:
+            exportador.escrever(trajetorias)
+    return exportador.proximo_id
+
+
+def exportar_resultado(df_original, resultado, id_severity_map, nome_arquivo, formato='csv', tamanho_chunk=500):
+    """
+    Exporta um result.TrajectoryResult em chunks de tamanho_chunk trajetórias.
+    Returns:
+        total de trajetórias exportadas.
+    """
+    lotes = (resultado.trajetorias(inicio, inicio + tamanho_chunk) for inicio in range(0, len(resultado), tamanho_chunk))
+    return exportar_trajetorias_stream(df_original, lotes, id_severity_map, nome_arquivo, formato)
+
+
+# --- DADOS DE VISUALIZAÇÃO DAS MSTs ---
+FORMATOS_ARVORES = ('json', 'arrow')
+
+# Tipo de cada campo por vértice no Arrow (e casas decimais no JSON para os floats).
+# 'indice' (vértice da amostra): int16 até T = 32767, int32 acima (ver _tipo_indice)
+_TIPOS_ARVORE = {'paciente_id': None, 'severidade': 'int8', 'pai': 'indice', 'peso': 'float32',
+                 'pseudotempo': 'float32', 'profundidade': 'indice', 'ordem': 'indice', 'x': 'float32', 'y': 'float32'}
+CASAS_DECIMAIS_JSON = 6
+
+def _tipo_indice(T):
+    # Menor inteiro que guarda os vértices 0..T-1 (e o -1 do pai do vértice inicial)
+    return np.int16 if T <= np.iinfo(np.int16).max else np.int32
+
+
+class ExportadorArvores:
+    """
+    Exportador "streaming" das MSTs de cada amostra (saída de trajectory.iterar_arvores_lote),
+    para dashboards desenharem qualquer amostra sem rodar o pipeline nem abrir o matplotlib.
+    Uma linha/registro por amostra, com os campos por vértice (vértice = posição na amostra):
+        amostra, raiz | paciente_id, severidade, pai, peso, pseudotempo, profundidade, ordem, x, y
+    A aresta do vértice i vai até pai[i] com peso[i] (pai -1 no vértice inicial do Prim);
+    ordem lista os vértices na ordem da trajetória; x, y só existem se houver layout.
+    Formatos:
+        'json'  -> JSON Lines (um objeto JSON por linha), floats com CASAS_DECIMAIS_JSON casas.
+        'arrow' -> arquivo Arrow IPC com listas de tamanho fixo (T), um record batch por lote (precisa do pyarrow).
+    Uso:
+        with ExportadorArvores("data/results/mst_samples.jsonl", formato='json') as exp:
+            for arvores in tj.iterar_arvores_lote(df_norm, severity_label_serie, amostras[selecao]):
+                exp.escrever(arvores)
+    """
+
+    def __init__(self, nome_arquivo, formato='json', ids_amostras=None):
+        """
+        nome_arquivo: caminho do arquivo de saída.
+        formato: 'json' ou 'arrow'.
+        ids_amostras: (Opcional) número de cada amostra recebida na execução original (ex.: quando
+            só um subconjunto é exportado); por padrão as amostras são numeradas 0, 1, 2, ...
+        """
+        if formato not in FORMATOS_ARVORES:
+            raise ValueError(f"Formato desconhecido: '{formato}'. Opções: {FORMATOS_ARVORES}")
+        self.nome_arquivo = nome_arquivo
+        self.formato = formato
+        self.ids_amostras = None if ids_amostras is None else np.asarray(ids_amostras)
+        self.amostras_escritas = 0
+
+        if formato == 'json':
+            self._arquivo = open(nome_arquivo, 'w')
+        else:
+            self._pa = _importar_pyarrow()
+            self._writer = None # criado no primeiro lote (o schema depende de T e dos campos)
+
+    def _ids(self, b):
+        inicio = self.amostras_escritas
+        if self.ids_amostras is None:
+            return np.arange(inicio, inicio + b)
+        return self.ids_amostras[inicio:inicio + b]
+
+    def escrever(self, arvores):
+        """Grava um lote (dicionário de arrays de trajectory.iterar_arvores_lote)."""
+        b, T = arvores['pai'].shape
+        if b == 0:
+            return
+        campos = [nome for nome in _TIPOS_ARVORE if nome in arvores]
+        ids = self._ids(b)
+
+        if self.formato == 'json':
+            colunas = {}
+            for nome in campos:
+                valores = np.asarray(arvores[nome])
+                if _TIPOS_ARVORE[nome] == 'float32':
+                    valores = np.round(valores.astype(np.float64), CASAS_DECIMAIS_JSON)
+                colunas[nome] = valores.tolist()
+            raizes = np.asarray(arvores['raiz']).tolist()
+            for i in range(b):
+                registro = {'amostra': int(ids[i]), 'raiz': raizes[i]}
+                registro.update({nome: colunas[nome][i] for nome in campos})
+                self._arquivo.write(json.dumps(registro, separators=(',', ':')) + '\n')
+        else:
+            pa = self._pa
+            indice = _tipo_indice(T)
+            colunas = [pa.array(ids.astype(np.int32)), pa.array(np.asarray(arvores['raiz']).astype(indice))]
+            for nome in campos:
+                valores = np.asarray(arvores[nome]).ravel()
+                tipo = indice if _TIPOS_ARVORE[nome] == 'indice' else _TIPOS_ARVORE[nome]
+                if tipo is not None:
+                    valores = valores.astype(tipo)
+                colunas.append(pa.FixedSizeListArray.from_arrays(pa.array(valores), T))
+            tabela = pa.Table.from_arrays(colunas, names=['amostra', 'raiz'] + campos)
+            if self._writer is None:
+                self._writer = pa.ipc.new_file(self.nome_arquivo, tabela.schema)
+            self._writer.write_table(tabela)
+
+        self.amostras_escritas += b
+
+    def fechar(self, sucesso=True):
+        """Fecha o arquivo; sucesso=False (erro no meio da exportação) só fecha, sem a mensagem."""
+        if self.formato == 'json':
+            self._arquivo.close()
+        elif self._writer is not None:
+            self._writer.close()
+        if sucesso:
+            print(f"Arquivo '{self.nome_arquivo}' gerado com sucesso! ({self.amostras_escritas} MSTs)")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, tipo_erro, erro, traceback):
+        self.fechar(sucesso=tipo_erro is None)
+
+
+def selecionar_amostras(k, quantidade=None, seed=None):
+    """
+    Números das amostras a exportar: todas (quantidade=None) ou um subconjunto sorteado
+    sem reposição, em ordem crescente.
+    """
+    if quantidade is None or quantidade >= k:
+        return np.arange(k)
+    return np.sort(np.random.default_rng(seed).choice(k, size=quantidade, replace=False))
+
+
+def exportar_arvores_stream(lotes_arvores, nome_arquivo, formato='json', ids_amostras=None):
+    """
+    Consome um iterável de lotes de MSTs (ex.: trajectory.iterar_arvores_lote) gravando cada lote
+    assim que ele chega.
+    Returns:
+        total de amostras exportadas.
+    """
+    with ExportadorArvores(nome_arquivo, formato, ids_amostras) as exportador:
+        for arvores in lotes_arvores:
+            exportador.escrever(arvores)
+    return exportador.amostras_escritas
@@ -1,6 +1,15 @@
+import hashlib
+import json
+import os
+import pickle
+import time
+from functools import partial
+import tracemalloc
 import pandas as pd
 import numpy as np
-from sklearn.impute import KNNImputer
+from sklearn.experimental import enable_iterative_imputer # noqa: F401 (habilita o IterativeImputer)
+from sklearn.impute import KNNImputer, IterativeImputer, SimpleImputer
+from sklearn.neighbors import KDTree, BallTree
 from sklearn.preprocessing import StandardScaler
 
 # --- CONFIGURAÇÕES ---
@@ -29,45 +38,334 @@ limits = {
     'T4U': (0, 2), 'FTI': (0, 300), 'age': (0, 100),
 }
 
-def preprocessing_pts():
-    # Carregar Dataset
-    df = pd.read_csv("data/raw/thyroidDF.csv") 
-    
-    # Limpeza Básica de Target
-    df = df.dropna(subset=['target'])
-    df['target'] = df['target'].str.strip().str.upper()
-    
-    # FILTRAGEM: Manter apenas Saudáveis e Hipo (Remove Hiper)
-    pattern = '|'.join(classes)
-    df = df[df['target'].str.contains(pattern, na=False, regex=True)]
-    
-    # Limpeza de Labels (Pega a primeira letra relevante)
-    # Ex: "ABFC" vira "F"
-    def clean_target(x):
-        for letter in classes:
-            if letter in x:
-                return letter
-        return np.nan
-    
-    df['target_clean'] = df['target'].apply(clean_target)
-    df = df.dropna(subset=['target_clean'])
-    
-    # Mapear para números ordinais 
+# Parâmetros da imputação (KNN)
+imputer_params = {'n_neighbors': 10, 'weights': 'distance'}
+
+# --- ESTRATÉGIAS DE IMPUTAÇÃO ---
+# 'knn'        -> KNNImputer na coorte inteira (original, exato; O(N²) em tempo e memória)
+# 'knn_classe' -> KNNImputer separado por classe de severidade (O(soma dos n_classe²))
+# 'knn_arvore' -> KNN com índice KD-tree/Ball-tree sobre os pacientes completos (O(N log N))
+# 'iterativo'  -> IterativeImputer (regressão de cada feature pelas outras)
+# 'mediana'    -> mediana de cada feature (mais barata)
+ESTRATEGIAS_IMPUTACAO = ('knn', 'knn_classe', 'knn_arvore', 'iterativo', 'mediana')
+
+class KNNImputerArvore:
+    """
+    Imputação KNN com busca de vizinhos por árvore (KD-tree ou Ball-tree), para coortes grandes.
+    Doadores: pacientes sem nenhum valor faltante. Para cada padrão de faltantes, monta o índice
+    só com as colunas observadas e busca os n_neighbors mais próximos; o valor imputado é a
+    média dos vizinhos (ponderada por 1/distância se weights='distance', como no KNNImputer).
+    Com menos doadores que n_neighbors usa todos os doadores; sem nenhum doador completo,
+    cai no KNNImputer do sklearn (que aceita doadores com faltantes).
+    Interface igual à do sklearn (fit / transform / fit_transform).
+    """
+
+    def __init__(self, n_neighbors=10, weights='distance', algoritmo='kd_tree'):
+        self.n_neighbors = n_neighbors
+        self.weights = weights
+        self.algoritmo = algoritmo
+
+    def fit(self, X, y=None):
+        X = np.asarray(X, dtype=float)
+        self.doadores_ = X[~np.isnan(X).any(axis=1)]
+        self.media_ = np.nanmean(X, axis=0) # usada quando não há nenhuma coluna observada
+        self._indices = {} # um índice por padrão de colunas observadas (criado sob demanda)
+        self.n_vizinhos_ = min(self.n_neighbors, len(self.doadores_))
+        self.reserva_ = KNNImputer(n_neighbors=self.n_neighbors, weights=self.weights).fit(X) if self.n_vizinhos_ == 0 else None
+        return self
+
+    def _indice(self, observadas):
+        chave = observadas.tobytes()
+        if chave not in self._indices:
+            Arvore = KDTree if self.algoritmo == 'kd_tree' else BallTree
+            self._indices[chave] = Arvore(self.doadores_[:, observadas])
+        return self._indices[chave]
+
+    def transform(self, X):
+        if self.reserva_ is not None:
+            return self.reserva_.transform(X)
+        X = np.array(X, dtype=float)
+        faltantes = np.isnan(X)
+        padroes, grupo = np.unique(faltantes, axis=0, return_inverse=True)
+
+        for g, padrao in enumerate(padroes):
+            if not padrao.any():
+                continue
+            linhas = np.where(grupo.ravel() == g)[0]
+            observadas = ~padrao
+            if not observadas.any():
+                X[np.ix_(linhas, padrao)] = self.media_[padrao]
+                continue
+
+            dist, vizinhos = self._indice(observadas).query(X[np.ix_(linhas, observadas)], k=self.n_vizinhos_)
+            valores = self.doadores_[vizinhos][:, :, padrao] # (linhas, vizinhos, colunas faltantes)
+            if self.weights == 'distance':
+                # Distância zero: só os vizinhos idênticos contam (mesma regra do KNNImputer)
+                with np.errstate(divide='ignore'):
+                    pesos = 1.0 / dist
+                iguais = np.isinf(pesos)
+                pesos = np.where(iguais.any(axis=1, keepdims=True), iguais.astype(float), pesos)
+            else:
+                pesos = np.ones_like(dist)
+            X[np.ix_(linhas, padrao)] = (valores * pesos[:, :, None]).sum(axis=1) / pesos.sum(axis=1, keepdims=True)
+
+        return X
+
+    def fit_transform(self, X, y=None):
+        return self.fit(X).transform(X)
+
+
+class ImputadorPorClasse:
+    """
+    Um imputador por classe de severidade (os vizinhos vêm só da mesma classe).
+    transform precisa das classes (y) dos pacientes.
+    """
+
+    def __init__(self, criar_imputador):
+        self.criar_imputador = criar_imputador
+
+    def fit(self, X, y):
+        X = np.asarray(X, dtype=float)
+        y = np.asarray(y)
+        self.imputadores_ = {c: self.criar_imputador().fit(X[y == c]) for c in np.unique(y)}
+        return self
+
+    def transform(self, X, y):
+        X = np.array(X, dtype=float)
+        y = np.asarray(y)
+        for c, imputador in self.imputadores_.items():
+            X[y == c] = imputador.transform(X[y == c])
+        return X
+
+    def fit_transform(self, X, y):
+        return self.fit(X, y).transform(X, y)
+
+
+def criar_imputador(estrategia='knn'):
+    """Cria o imputador (ainda não ajustado) da estratégia escolhida."""
+    if estrategia == 'knn':
+        return KNNImputer(**imputer_params)
+    if estrategia == 'knn_classe':
+        return ImputadorPorClasse(partial(KNNImputer, **imputer_params)) # partial (e não lambda): pode ser salvo com pickle
+    if estrategia == 'knn_arvore':
+        return KNNImputerArvore(**imputer_params)
+    if estrategia == 'iterativo':
+        return IterativeImputer(max_iter=10, random_state=0)
+    if estrategia == 'mediana':
+        return SimpleImputer(strategy='median')
+    raise ValueError(f"Estratégia de imputação desconhecida: '{estrategia}'. Opções: {ESTRATEGIAS_IMPUTACAO}")
+
+def imputar(df_model, severity_label, estrategia='knn', medir_memoria=False):
+    """
+    Imputa os valores faltantes com a estratégia escolhida, medindo o tempo (e o pico de memória).
+    Args:
+        df_model: DataFrame só com as features numéricas (com NaN).
+        severity_label: classes dos pacientes (usadas só por 'knn_classe').
+        estrategia: uma de ESTRATEGIAS_IMPUTACAO.
+        medir_memoria: se True, liga o tracemalloc durante a imputação (deixa o KNN mais lento).
+            Se o tracemalloc já estiver ligado (ex.: profiling.Perfilador com memoria=True), o pico
+            é medido de qualquer forma.
+    Returns:
+        df_imputed: DataFrame sem faltantes (mesmo índice/colunas).
+        imputer: imputador ajustado (para imputar pacientes novos depois).
+        relatorio: dicionário com estrategia, n_faltantes, tempo_s e memoria_pico_mb
+            (None quando a memória não foi medida).
+    """
+    imputer = criar_imputador(estrategia)
+
+    # Se o tracemalloc já estiver ligado, não desliga no fim
+    ja_ligado = tracemalloc.is_tracing()
+    medir_memoria = medir_memoria or ja_ligado
+    if ja_ligado:
+        tracemalloc.reset_peak()
+    elif medir_memoria:
+        tracemalloc.start()
+    inicio = time.perf_counter()
+    if estrategia == 'knn_classe':
+        valores = imputer.fit_transform(df_model, severity_label)
+    else:
+        valores = imputer.fit_transform(df_model)
+    tempo = time.perf_counter() - inicio
+    pico = tracemalloc.get_traced_memory()[1] if medir_memoria else None
+    if medir_memoria and not ja_ligado:
+        tracemalloc.stop()
+
+    relatorio = {
+        'estrategia': estrategia,
+        'n_faltantes': int(df_model.isna().sum().sum()),
+        'tempo_s': round(tempo, 4),
+        'memoria_pico_mb': round(pico / 2**20, 2) if medir_memoria else None,
+    }
+    memoria = f" (pico de memória {relatorio['memoria_pico_mb']} MB)" if medir_memoria else ""
+    print(f"Imputação '{estrategia}': {relatorio['n_faltantes']} valores em {relatorio['tempo_s']}s{memoria}")
+
+    df_imputed = pd.DataFrame(valores, columns=df_model.columns, index=df_model.index)
+    return df_imputed, imputer, relatorio
+
+CAMINHO_RAW = "data/raw/thyroidDF.csv"
+
+# --- LEITURA DO CSV BRUTO ---
+# Só as colunas usadas (target + features + limites), com tipos fixos (sem inferência).
+# caminho_raw pode ser um arquivo ou uma pasta de CSVs (shards com o mesmo cabeçalho), lidos um
+# a um em ordem de nome: cada shard é limpo e filtrado antes do próximo, então só os pacientes
+# que ficam ocupam memória. O índice (ID do paciente) é a linha no CSV (ou nos shards concatenados).
+COLUNAS_CSV = ['target'] + num_features + [col for col in limits if col not in num_features]
+
+def _pyarrow_disponivel():
+    try:
+        import pyarrow # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+def esquema_csv(motor):
+    """Tipos das colunas lidas: features float64 e target texto (string do Arrow com o motor pyarrow)."""
+    esquema = {col: 'float64' for col in COLUNAS_CSV}
+    esquema['target'] = 'string[pyarrow]' if motor == 'pyarrow' else 'object'
+    return esquema
+
+def arquivos_csv(caminho_raw):
+    """Lista de CSVs de caminho_raw: o próprio arquivo ou os .csv da pasta, em ordem de nome."""
+    if not os.path.isdir(caminho_raw):
+        return [caminho_raw]
+    arquivos = sorted(os.path.join(caminho_raw, nome) for nome in os.listdir(caminho_raw) if nome.endswith('.csv'))
+    if not arquivos:
+        raise FileNotFoundError(f"Nenhum arquivo .csv em '{caminho_raw}'.")
+    return arquivos
+
+def iterar_csv(caminho_raw, motor=None):
+    """
+    Lê os CSVs brutos um a um (yield), só com COLUNAS_CSV e o esquema fixo.
+    Args:
+        caminho_raw: arquivo CSV ou pasta com shards CSV.
+        motor: 'pyarrow' (padrão, se instalado) ou 'c' (parser em C do pandas).
+    Yields:
+        DataFrame de cada arquivo, com o índice continuando a numeração do anterior.
+    """
+    motor = motor or ('pyarrow' if _pyarrow_disponivel() else 'c')
+    inicio = 0
+    for arquivo in arquivos_csv(caminho_raw):
+        df = pd.read_csv(arquivo, usecols=COLUNAS_CSV, dtype=esquema_csv(motor), engine=motor)
+        df.index = pd.RangeIndex(inicio, inicio + len(df))
+        inicio += len(df)
+        yield df
+
+def limpar_bloco(df):
+    """
+    Limpeza do target e dos outliers de um bloco do CSV bruto (vetorizada).
+    target_clean é a primeira classe de `classes` contida no target (ex.: "ABFC" vira "F");
+    linhas sem nenhuma delas saem. Os limites são aplicados numa máscara única (NaN passa).
+    """
+    target = df['target'].str.strip().str.upper()
+    contem = [target.str.contains(letra, regex=False).fillna(False).to_numpy(dtype=bool) for letra in classes]
+    target_clean = np.select(contem, classes, default='')
+
+    manter = np.logical_or.reduce(contem)
+    for col, (min_val, max_val) in limits.items():
+        valores = df[col].to_numpy()
+        manter &= np.isnan(valores) | ((valores >= min_val) & (valores <= max_val))
+
+    df = df[manter].copy()
+    df['target'] = target[manter].astype(object)
+    df['target_clean'] = target_clean[manter]
     df['severity_label'] = df['target_clean'].map(class_mapping_details)
+    return df
+
+def carregar_csv(caminho_raw=CAMINHO_RAW, motor=None):
+    """Lê e limpa o CSV bruto (ou a pasta de shards): pacientes das classes escolhidas, sem outliers."""
+    return pd.concat([limpar_bloco(df) for df in iterar_csv(caminho_raw, motor)])
+
+# Cache do pré-processamento
+PASTA_CACHE = "data/cache"
+VERSAO_CACHE = 1 # mudar quando o formato/etapas do pré-processamento mudarem
+
+def chave_cache(caminho_raw=CAMINHO_RAW, estrategia_imputacao='knn'):
+    """
+    Chave do cache: hash do arquivo bruto (ou dos shards da pasta, em ordem) + configurações que
+    alteram o resultado (classes, mapeamento, limites, features e parâmetros do imputer).
+    """
+    h = hashlib.sha256()
+    for arquivo in arquivos_csv(caminho_raw):
+        if os.path.isdir(caminho_raw):
+            h.update(os.path.basename(arquivo).encode())
+        with open(arquivo, 'rb') as f:
+            for bloco in iter(lambda: f.read(1 << 20), b''):
+                h.update(bloco)
+    config = {
+        'versao': VERSAO_CACHE,
+        'classes': classes,
+        'class_mapping_details': class_mapping_details,
+        'limits': limits,
+        'num_features': num_features,
+        'imputer_params': imputer_params,
+        'estrategia_imputacao': estrategia_imputacao,
+    }
+    h.update(json.dumps(config, sort_keys=True).encode())
+    return h.hexdigest()[:16]
+
+def _salvar_cache(caminho, df_normalized, df_imputed, severity_label):
+    np.savez(
+        caminho,
+        norm=df_normalized.to_numpy(),
+        real=df_imputed.to_numpy(),
+        label=severity_label.to_numpy(),
+        index=df_normalized.index.to_numpy(),
+        columns=np.array(df_normalized.columns, dtype=str),
+    )
+
+def _carregar_cache(caminho):
+    with np.load(caminho) as dados:
+        index = pd.Index(dados['index'])
+        columns = dados['columns'].tolist()
+        df_normalized = pd.DataFrame(dados['norm'], columns=columns, index=index)
+        df_imputed = pd.DataFrame(dados['real'], columns=columns, index=index)
+        severity_label = pd.Series(dados['label'], index=index, name='severity_label')
+    return df_normalized, df_imputed, severity_label
+
+def preprocessing_pts(caminho_raw=CAMINHO_RAW, usar_cache=False, pasta_cache=PASTA_CACHE, estrategia_imputacao='knn',
+                      retornar_modelos=False, dtype=np.float64, motor_csv=None, medir_memoria=False):
+    """
+    Carrega, limpa, imputa e padroniza os dados.
+    caminho_raw: CSV bruto ou pasta de shards CSV (ver iterar_csv).
+    motor_csv: parser do CSV: 'pyarrow' (padrão, se instalado) ou 'c'.
+    estrategia_imputacao: 'knn' (padrão, original), 'knn_classe', 'knn_arvore', 'iterativo' ou 'mediana'
+        (ver ESTRATEGIAS_IMPUTACAO); o tempo e a memória da imputação são reportados.
+    medir_memoria: repassado a imputar (pico de memória da imputação com tracemalloc).
+    usar_cache: se True, procura o resultado em pasta_cache pela chave (hash do arquivo bruto + configurações);
+        se a chave bater, pula o pré-processamento (inclusive a imputação KNN) e só carrega os arrays.
+    retornar_modelos: se True, devolve também um 4º item, o dicionário de modelos ajustados
+        {'imputer', 'scaler', 'estrategia_imputacao', 'features', 'relatorio_imputacao'}, para processar
+        pacientes novos (ver projection.ModeloProjecao); relatorio_imputacao é o de imputar. Com cache,
+        os modelos ficam num .pkl ao lado do .npz (o relatório é o da execução que gerou o cache).
+    dtype: dtype dos dados padronizados (np.float64 ou np.float32). O resto do pipeline (distâncias,
+        MST e pseudo-tempo) segue o dtype de df_normalized. O cache guarda sempre float64.
+    """
+    if usar_cache:
+        caminho_cache = os.path.join(pasta_cache, f"preprocessing_{chave_cache(caminho_raw, estrategia_imputacao)}.npz")
+        caminho_modelos = caminho_cache.replace('.npz', '.pkl')
+        if os.path.exists(caminho_cache) and (not retornar_modelos or os.path.exists(caminho_modelos)):
+            df_normalized, df_imputed, severity_label = _carregar_cache(caminho_cache)
+            df_normalized = df_normalized.astype(dtype)
+            print(f"Dados carregados do cache '{caminho_cache}'. Total de pacientes: {len(df_normalized)}")
+            if retornar_modelos:
+                with open(caminho_modelos, 'rb') as f:
+                    modelos = pickle.load(f)
+                print("Imputação pulada (cache). Relatório da execução original:", modelos.get('relatorio_imputacao'))
+                return df_normalized, df_imputed, severity_label, modelos
+            return df_normalized, df_imputed, severity_label
+
+    # Carregar Dataset (só as colunas usadas) já filtrado:
+    # mantém apenas Saudáveis e Hipo (remove Hiper), label limpo (ex.: "ABFC" vira "F"),
+    # severidade ordinal e limites de outliers aplicados
+    df = carregar_csv(caminho_raw, motor_csv)
     
-    # Aplicação dos Limites (Outliers)
-    for col, (min_val, max_val) in limits.items():
-        if col in df.columns:
-            df = df[df[col].isna() | ((df[col] >= min_val) & (df[col] <= max_val))]
-            
     # Seleção de Features
     # Focamos nas numéricas para a construção da trajetória
     df_model = df[num_features].copy()
     
-    # Imputação (KNN)
-    imputer = KNNImputer(n_neighbors=10, weights="distance")
-    df_imputed_vals = imputer.fit_transform(df_model)
-    df_imputed = pd.DataFrame(df_imputed_vals, columns=num_features, index=df_model.index)
+    # Imputação (KNN por padrão)
+    df_imputed, imputer, relatorio_imputacao = imputar(df_model, df['severity_label'], estrategia_imputacao,
+                                                       medir_memoria=medir_memoria)
     
     # PADRONIZAÇÃO (Z-SCORE)
     # Deixar as features na mesma escala de importância
@@ -82,7 +380,20 @@ def preprocessing_pts():
     
     print(f"Dados processados. Total de pacientes: {len(df)}")
     print("Distribuição das classes:\n", df['target_clean'].value_counts())
-    
+
+    modelos = {'imputer': imputer, 'scaler': scaler, 'estrategia_imputacao': estrategia_imputacao,
+               'features': num_features, 'relatorio_imputacao': relatorio_imputacao}
+
+    if usar_cache:
+        os.makedirs(pasta_cache, exist_ok=True)
+        _salvar_cache(caminho_cache, df_normalized, df_imputed, df['severity_label'])
+        with open(caminho_modelos, 'wb') as f:
+            pickle.dump(modelos, f)
+        print(f"Cache salvo em '{caminho_cache}'.")
+
+    df_normalized = df_normalized.astype(dtype)
+    if retornar_modelos:
+        return df_normalized, df_imputed, df['severity_label'], modelos
     return df_normalized, df_imputed, df['severity_label']
 
 def export_data_pp(df_norm, df_real, label):
@@ -0,0 +1,184 @@
+import cProfile
+import io
+import json
+import os
+import platform
+import pstats
+import time
+import tracemalloc
+from contextlib import contextmanager
+import numpy as np
+
+try:
+    import resource # só existe em Unix
+except ImportError:
+    resource = None
+
+VERSAO_RELATORIO = 2 # 2: pico_rss_acumulado_mb (antes pico_rss_mb) e séries sem histograma
+
+def _pico_rss_mb():
+    # Pico de memória residente do processo desde o início (ru_maxrss: KB no Linux, bytes no macOS).
+    # É acumulado: nunca diminui, então numa etapa é o maior RSS até o fim dela, não o da etapa.
+    if resource is None:
+        return None
+    pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return pico / (1024 ** 2 if platform.system() == 'Darwin' else 1024)
+
+
+class Perfilador:
+    """
+    Instrumentação leve do pipeline: tempo de parede, tempo de CPU e pico de memória por etapa,
+    séries de tempos (com histograma) e, opcionalmente, cProfile e tracemalloc.
+    O relatório é salvo em JSON para comparar execuções (regressões entre versões).
+    Uso:
+        perfilador = Perfilador(memoria=True)
+        with perfilador.etapa('preprocessamento'):
+            ...
+        perfilador.salvar("data/results/profile.json")
+    Etapas podem ser aninhadas (ex.: 'mst' dentro de 'trajetorias'); cada nome acumula o total das
+    chamadas. No modo paralelo só o processo principal é medido.
+    """
+
+    def __init__(self, memoria=False, cprofile=False, ativo=True, amostras_individuais=0):
+        """
+        memoria: usa tracemalloc para medir o pico de memória alocada (Python/NumPy) em cada etapa.
+            Mais preciso, mas deixa a execução mais lenta. Sem ele é reportado só o pico de RSS do
+            processo acumulado até o fim de cada etapa (pico_rss_acumulado_mb, não é o pico da etapa).
+        cprofile: roda o cProfile durante toda a execução e inclui as funções mais caras no relatório.
+        amostras_individuais: quantas amostras de cada lote do motor em lote são processadas uma a uma,
+            com o tempo de cada uma na série 'tempo_amostra' (com histograma). O resto do lote segue
+            vetorizado; 0 = só a média por amostra de cada lote.
+        ativo: False desliga tudo (etapa() não mede nada); usado como perfilador "nulo".
+        """
+        self.ativo = ativo
+        self.memoria = memoria and ativo
+        self.amostras_individuais = amostras_individuais if ativo else 0
+        self.etapas = {}
+        self.amostras = {}
+        self._sem_histograma = set()
+        self.metadados = {}
+        self._pilha = []
+        self._inicio = time.perf_counter()
+        self._inicio_cpu = time.process_time()
+
+        if self.memoria and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        self._profiler = cProfile.Profile() if (cprofile and ativo) else None
+        if self._profiler is not None:
+            self._profiler.enable()
+
+    @contextmanager
+    def etapa(self, nome):
+        """Mede o bloco como a etapa nome (tempo de parede, CPU e pico de memória)."""
+        if not self.ativo:
+            yield
+            return
+
+        if self.memoria:
+            # O pico visto até aqui pertence à etapa de fora; zera para medir só esta
+            pico = tracemalloc.get_traced_memory()[1]
+            if self._pilha:
+                self._pilha[-1]['pico'] = max(self._pilha[-1]['pico'], pico)
+            tracemalloc.reset_peak()
+        quadro = {'pico': 0}
+        self._pilha.append(quadro)
+        t0, c0 = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            parede, cpu = time.perf_counter() - t0, time.process_time() - c0
+            self._pilha.pop()
+
+            stats = self.etapas.setdefault(nome, {'chamadas': 0, 'parede_s': 0.0, 'cpu_s': 0.0})
+            stats['chamadas'] += 1
+            stats['parede_s'] += parede
+            stats['cpu_s'] += cpu
+            if self.memoria:
+                pico = max(quadro['pico'], tracemalloc.get_traced_memory()[1])
+                stats['pico_mem_mb'] = max(stats.get('pico_mem_mb', 0.0), pico / 1024 ** 2)
+                if self._pilha:
+                    self._pilha[-1]['pico'] = max(self._pilha[-1]['pico'], pico)
+                tracemalloc.reset_peak()
+            else:
+                stats['pico_rss_acumulado_mb'] = _pico_rss_mb()
+
+    def registrar_amostras(self, nome, tempos, histograma=True):
+        """
+        Acrescenta tempos (segundos) à série nome (resumida no relatório com média e percentis).
+        histograma: False para séries em que o histograma não faz sentido (ex.: médias por lote).
+        """
+        if self.ativo:
+            self.amostras.setdefault(nome, []).extend(np.asarray(tempos, dtype=np.float64).ravel().tolist())
+            if not histograma:
+                self._sem_histograma.add(nome)
+
+    def _resumo_amostras(self, tempos, n_bins=20, histograma=True):
+        tempos = np.asarray(tempos)
+        resumo = {
+            'n': int(len(tempos)),
+            'media_s': float(tempos.mean()),
+            'p50_s': float(np.percentile(tempos, 50)),
+            'p95_s': float(np.percentile(tempos, 95)),
+            'max_s': float(tempos.max()),
+        }
+        if histograma:
+            contagens, bordas = np.histogram(tempos, bins=n_bins)
+            resumo['histograma'] = {'bordas_s': bordas.tolist(), 'contagens': contagens.tolist()}
+        return resumo
+
+    def _resumo_cprofile(self, top=25):
+        self._profiler.disable()
+        estatisticas = pstats.Stats(self._profiler, stream=io.StringIO())
+        linhas = []
+        for (arquivo, linha, funcao), (_, chamadas, tempo_proprio, tempo_acum, _) in estatisticas.stats.items():
+            linhas.append({
+                'funcao': f"{os.path.basename(arquivo)}:{linha}({funcao})",
+                'chamadas': chamadas,
+                'tempo_proprio_s': tempo_proprio,
+                'tempo_acumulado_s': tempo_acum,
+            })
+        self._profiler.enable()
+        return sorted(linhas, key=lambda l: l['tempo_acumulado_s'], reverse=True)[:top]
+
+    def relatorio(self):
+        """Dicionário (serializável em JSON) com todas as medições até agora."""
+        relatorio = {
+            'versao': VERSAO_RELATORIO,
+            'data': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'plataforma': platform.platform(),
+            'metadados': self.metadados,
+            'total': {
+                'parede_s': time.perf_counter() - self._inicio,
+                'cpu_s': time.process_time() - self._inicio_cpu,
+                'pico_rss_acumulado_mb': _pico_rss_mb(),
+            },
+            'etapas': self.etapas,
+            'amostras': {nome: self._resumo_amostras(t, histograma=nome not in self._sem_histograma)
+                         for nome, t in self.amostras.items() if t},
+        }
+        if self._profiler is not None:
+            relatorio['cprofile'] = self._resumo_cprofile()
+        return relatorio
+
+    def salvar(self, caminho):
+        """Salva o relatório em JSON (e o .prof do cProfile ao lado, se ativo)."""
+        pasta = os.path.dirname(caminho)
+        if pasta:
+            os.makedirs(pasta, exist_ok=True)
+        with open(caminho, 'w') as arquivo:
+            json.dump(self.relatorio(), arquivo, indent=2)
+        if self._profiler is not None:
+            self._profiler.dump_stats(os.path.splitext(caminho)[0] + '.prof')
+        print(f"Relatório de desempenho salvo em '{caminho}'.")
+
+    def resumo(self):
+        """Imprime uma tabela curta com o tempo de cada etapa."""
+        print(f"{'Etapa':<22}{'Chamadas':>9}{'Parede (s)':>12}{'CPU (s)':>10}")
+        for nome, stats in self.etapas.items():
+            print(f"{nome:<22}{stats['chamadas']:>9}{stats['parede_s']:>12.3f}{stats['cpu_s']:>10.3f}")
+
+
+# Perfilador desligado: usado quando nenhum é passado (etapa() não mede nada)
+NULO = Perfilador(ativo=False)
@@ -0,0 +1,150 @@
+import os
+import pickle
+import numpy as np
+import pandas as pd
+from sklearn.neighbors import KDTree
+from src import euclidean_matrix as me
+
+class ModeloProjecao:
+    """
+    Posiciona pacientes novos numa trajetória de consenso já calculada, sem rodar o pipeline de novo.
+    Guarda o imputador e o scaler ajustados em preprocessing_pts, os pacientes de referência
+    (dados padronizados, severidade e pseudo-tempo de consenso), a métrica ajustada das trajetórias
+    e um índice KD-tree sobre os pacientes de referência no espaço da métrica (metrica.transformar).
+    projetar() imputa, padroniza e dá a cada paciente novo o pseudo-tempo dos vizinhos mais
+    próximos pela mesma métrica entre os pacientes de referência (média ponderada por 1/distância).
+    Uso:
+        df_norm, df_real, sev, modelos = pp.preprocessing_pts(retornar_modelos=True)
+        ...
+        modelo = ModeloProjecao.ajustar(df_norm, severity_label_serie, df_consenso, modelos, metrica=METRICA)
+        modelo.salvar("data/results/projection_model.pkl")
+        ...
+        modelo = ModeloProjecao.carregar("data/results/projection_model.pkl")
+        df_posicoes = modelo.projetar(df_novos) # df_novos: valores reais (TSH, T3, ...), pode ter NaN
+    """
+
+    def __init__(self, imputer, scaler, features, X_ref, rotulos_ref, severidade_ref, pseudotempo_ref, rank_ref,
+                 n_vizinhos=5, estrategia_imputacao='knn', metrica=None):
+        self.imputer = imputer
+        self.scaler = scaler
+        self.features = list(features)
+        self.X_ref = np.asarray(X_ref, dtype=np.float64)
+        self.rotulos_ref = np.asarray(rotulos_ref)
+        self.severidade_ref = np.asarray(severidade_ref)
+        self.pseudotempo_ref = np.asarray(pseudotempo_ref, dtype=np.float64)
+        self.rank_ref = np.asarray(rank_ref, dtype=np.float64)
+        self.n_vizinhos = min(n_vizinhos, len(self.X_ref))
+        self.estrategia_imputacao = estrategia_imputacao
+        # Métrica já ajustada (None = euclidiana); a impressão digital vai junto no arquivo salvo
+        self.metrica = metrica
+        self.impressao_metrica = 'euclidiana' if metrica is None else metrica.impressao_digital()
+        self.arvore = KDTree(self._transformar(self.X_ref))
+
+    def _transformar(self, Z):
+        # Espaço onde a métrica é euclidiana (onde a KD-tree é montada e consultada)
+        return Z if self.metrica is None else np.asarray(self.metrica.transformar(Z), dtype=np.float64)
+
+    @classmethod
+    def ajustar(cls, df_norm, severity_label_serie, df_consenso, modelos, coluna_pseudotempo='pseudotempo_q50',
+                n_vizinhos=5, metrica=None):
+        """
+        Monta o modelo a partir do consenso (consensus.consenso_exato ou AgregadorConsenso.consenso).
+        Args:
+            df_norm: DataFrame normalizado (saída de preprocessing_pts).
+            severity_label_serie: Series com a severidade (0, 1, 2) dos pacientes.
+            df_consenso: DataFrame de consenso indexado pelo ID do paciente.
+            modelos: dicionário de preprocessing_pts(retornar_modelos=True).
+            coluna_pseudotempo: coluna do consenso usada como pseudo-tempo de referência.
+            n_vizinhos: quantidade de vizinhos usados para posicionar cada paciente novo.
+            metrica: a mesma métrica das trajetórias (nome, instância ou None = euclidiana); é ajustada
+                na coorte inteira, como no motor de trajetórias (ver euclidean_matrix.preparar_metrica).
+        """
+        referencia = df_consenso.index
+        features = modelos['features']
+        return cls(
+            modelos['imputer'], modelos['scaler'], modelos['features'],
+            X_ref=df_norm.loc[referencia, modelos['features']].to_numpy(),
+            rotulos_ref=referencia.to_numpy(),
+            severidade_ref=severity_label_serie.loc[referencia].to_numpy(),
+            pseudotempo_ref=df_consenso[coluna_pseudotempo].to_numpy(),
+            rank_ref=df_consenso['rank_norm_media'].to_numpy(),
+            n_vizinhos=n_vizinhos,
+            estrategia_imputacao=modelos['estrategia_imputacao'],
+            metrica=me.preparar_metrica(metrica, df_norm[features].to_numpy(dtype=np.float64), features),
+        )
+
+    def trajetoria_referencia(self):
+        """IDs dos pacientes de referência na ordem da trajetória de consenso (severidade, pseudo-tempo, ID)."""
+        ordem = np.lexsort((self.rotulos_ref, self.pseudotempo_ref, self.severidade_ref))
+        return self.rotulos_ref[ordem].tolist()
+
+    def padronizar(self, df_novos, severidade=None):
+        """
+        Imputa e padroniza os pacientes novos com os modelos ajustados no pré-processamento.
+        severidade: só para a imputação 'knn_classe' (o imputador é escolhido pela classe).
+        Returns:
+            array (n, F) padronizado (mesma escala de df_norm).
+        """
+        df_valores = pd.DataFrame(np.asarray(df_novos[self.features], dtype=float), columns=self.features)
+        if self.estrategia_imputacao == 'knn_classe':
+            if severidade is None:
+                raise ValueError("A imputação 'knn_classe' precisa da severidade dos pacientes novos.")
+            valores = self.imputer.transform(df_valores, np.asarray(severidade))
+        elif df_valores.isna().to_numpy().any():
+            valores = self.imputer.transform(df_valores)
+        else:
+            valores = df_valores.to_numpy()
+        return self.scaler.transform(pd.DataFrame(valores, columns=self.features))
+
+    def projetar(self, df_novos, severidade=None):
+        """
+        Posiciona um lote de pacientes novos na trajetória de referência.
+        Args:
+            df_novos: DataFrame com os valores reais das features (pode ter NaN).
+            severidade: (Opcional) severidade dos pacientes novos (só para a imputação 'knn_classe').
+        Returns:
+            DataFrame (mesmo índice de df_novos) com pseudotempo, rank_norm, severidade_vizinhos
+            (média ponderada da severidade dos vizinhos), paciente_mais_proximo e distancia_mais_proximo.
+        """
+        Z = self.padronizar(df_novos, severidade)
+        dist, vizinhos = self.arvore.query(self._transformar(Z), k=self.n_vizinhos)
+        if self.metrica is not None and self.metrica.quadrado:
+            dist = dist ** 2 / 2 # distância da métrica (ex.: correlação), mesma ordem dos vizinhos
+
+        # Pesos 1/distância; se houver vizinho idêntico (distância zero), só os idênticos contam
+        with np.errstate(divide='ignore'):
+            pesos = 1.0 / dist
+        iguais = np.isinf(pesos)
+        pesos = np.where(iguais.any(axis=1, keepdims=True), iguais.astype(float), pesos)
+        pesos /= pesos.sum(axis=1, keepdims=True)
+
+        return pd.DataFrame({
+            'pseudotempo': (self.pseudotempo_ref[vizinhos] * pesos).sum(axis=1),
+            'rank_norm': (self.rank_ref[vizinhos] * pesos).sum(axis=1),
+            'severidade_vizinhos': (self.severidade_ref[vizinhos] * pesos).sum(axis=1),
+            'paciente_mais_proximo': self.rotulos_ref[vizinhos[:, 0]],
+            'distancia_mais_proximo': dist[:, 0],
+        }, index=df_novos.index)
+
+    # --- Salvar / Carregar ---
+    def salvar(self, caminho):
+        pasta = os.path.dirname(caminho)
+        if pasta:
+            os.makedirs(pasta, exist_ok=True)
+        with open(caminho, 'wb') as f:
+            pickle.dump(self, f)
+        print(f"Modelo de projeção salvo em '{caminho}' ({len(self.rotulos_ref)} pacientes de referência, "
+              f"métrica {self.impressao_metrica}).")
+
+    @classmethod
+    def carregar(cls, caminho, impressao_metrica=None):
+        """
+        impressao_metrica: (Opcional) impressão digital esperada da métrica (Metrica.impressao_digital(),
+            ou 'euclidiana'); se for diferente da gravada no modelo, levanta ValueError.
+        """
+        with open(caminho, 'rb') as f:
+            modelo = pickle.load(f)
+        if impressao_metrica is not None and modelo.impressao_metrica != impressao_metrica:
+            raise ValueError(f"O modelo em '{caminho}' foi ajustado com outra métrica "
+                             f"({modelo.impressao_metrica}, esperada {impressao_metrica}).")
+        return modelo
@@ -0,0 +1,134 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+import matplotlib.pyplot as plt
+
+PASTA_FIGURAS = "figures/amostras"
+
+def finalizar_figura(salvar_em=None):
+    """
+    Mostra a figura atual (plt.show) ou, se salvar_em for um caminho, grava o arquivo e fecha a
+    figura sem abrir janela (modo headless).
+    """
+    if salvar_em is None:
+        plt.show()
+        return
+
+    pasta = os.path.dirname(salvar_em)
+    if pasta:
+        os.makedirs(pasta, exist_ok=True)
+    plt.savefig(salvar_em, dpi=100, bbox_inches='tight')
+    plt.close()
+
+
+def caminhos_figuras(pasta, numero_amostra):
+    """Arquivos das 4 figuras de uma amostra dentro de pasta."""
+    prefixo = os.path.join(pasta, f"amostra_{numero_amostra:04d}")
+    return {
+        'matriz': f"{prefixo}_matriz.png",
+        'mst': f"{prefixo}_mst.png",
+        'trajetoria': f"{prefixo}_trajetoria.png",
+        'evolucao': f"{prefixo}_evolucao.png",
+    }
+
+
+def renderizar_amostra(df_recorte, id_severity_recorte, indices_ordenados, numero_amostra, pasta=None, metrica=None):
+    """
+    Gera as figuras de uma amostra (matriz, MST, trajetória e evolução clínica).
+    Args:
+        df_recorte: DataFrame normalizado só com os pacientes da amostra.
+        id_severity_recorte: Series com a severidade dos pacientes da amostra.
+        indices_ordenados: IDs dos pacientes na ordem da trajetória.
+        numero_amostra: número da amostra (títulos e nomes dos arquivos).
+        pasta: (Opcional) pasta de saída; se None, abre as janelas (plt.show) como antes.
+        metrica: (Opcional) euclidean_matrix.Metrica já ajustada na coorte, a mesma das trajetórias;
+            se None, euclidiana.
+    Returns:
+        dicionário {figura: arquivo} (vazio quando as figuras são só exibidas).
+    """
+    # Import local: MST e euclidean_matrix importam este módulo
+    from src import euclidean_matrix as me, MST as mst
+
+    arquivos = caminhos_figuras(pasta, numero_amostra) if pasta is not None else {}
+
+    _, df_matriz = me.compute_distance_matrix(df_recorte, sample_size=None, metrica=metrica)
+    me.plot_numerical_matrix(df_matriz, salvar_em=arquivos.get('matriz'))
+
+    # O layout Kamada-Kawai é calculado uma vez e reaproveitado pelas duas figuras da MST (cache)
+    grafo_mst = mst.mst(df_matriz)
+    mst.plotar_mst_amostra(grafo_mst, id_severity_recorte, numero_amostra, salvar_em=arquivos.get('mst'))
+    mst.plotar_trajetoria_mst(grafo_mst, indices_ordenados, numero_amostra, salvar_em=arquivos.get('trajetoria'))
+    mst.plotar_evolucao_clinica_individual(df_recorte, indices_ordenados, id_severity_recorte,
+                                           salvar_em=arquivos.get('evolucao'))
+
+    return arquivos
+
+
+def _iniciar_worker_render():
+    # Workers de renderização nunca abrem janelas
+    plt.switch_backend('Agg')
+
+
+class RenderizadorFiguras:
+    """
+    Renderiza as figuras das amostras em arquivos (sem janelas), num pool de processos separado,
+    fora do caminho crítico do cálculo das trajetórias.
+    Uso:
+        with RenderizadorFiguras(pasta="figures/amostras", n_workers=2) as render:
+            render.submeter_amostra(df_norm, severity_label_serie, amostras[i], trajetorias[i], i)
+            ... (cálculo das trajetórias continua enquanto as figuras são geradas)
+        # ao sair do with, espera todas as figuras ficarem prontas
+    metrica: distância das figuras (nome de euclidean_matrix.METRICAS ou Metrica), a mesma das
+    trajetórias; é ajustada uma vez, na coorte da primeira amostra submetida.
+    n_workers=0 renderiza no próprio processo (também sem janelas): o backend do matplotlib
+    passa para 'Agg' e o anterior é restaurado em fechar().
+    """
+
+    def __init__(self, pasta=PASTA_FIGURAS, n_workers=1, metrica=None):
+        self.pasta = pasta
+        self.n_workers = n_workers
+        self.metrica = metrica
+        self._futuros = []
+        self._backend_anterior = None
+        if n_workers > 0:
+            self._executor = ProcessPoolExecutor(max_workers=n_workers, initializer=_iniciar_worker_render)
+        else:
+            self._executor = None
+            self._backend_anterior = plt.get_backend()
+            _iniciar_worker_render()
+
+    def submeter_amostra(self, df_norm, severity_label_serie, indices_amostra, indices_ordenados, numero_amostra):
+        """Agenda as figuras de uma amostra (só os dados da amostra são enviados ao worker)."""
+        from src import euclidean_matrix as me
+
+        # Ajustada na coorte inteira (df_norm) uma vez só; depois preparar_metrica devolve a mesma instância
+        self.metrica = me.preparar_metrica(self.metrica, df_norm.to_numpy(), df_norm.columns)
+        df_recorte = df_norm.iloc[indices_amostra]
+        id_severity_recorte = severity_label_serie.loc[df_recorte.index]
+        args = (df_recorte, id_severity_recorte, list(indices_ordenados), numero_amostra, self.pasta, self.metrica)
+
+        if self._executor is None:
+            self._futuros.append(renderizar_amostra(*args))
+        else:
+            self._futuros.append(self._executor.submit(renderizar_amostra, *args))
+
+    def aguardar(self):
+        """Espera todas as figuras agendadas e devolve a lista de dicionários {figura: arquivo}."""
+        arquivos = [f if self._executor is None else f.result() for f in self._futuros]
+        self._futuros = []
+        return arquivos
+
+    def fechar(self):
+        arquivos = self.aguardar()
+        if self._executor is not None:
+            self._executor.shutdown()
+        if self._backend_anterior is not None:
+            plt.switch_backend(self._backend_anterior)
+            self._backend_anterior = None
+        print(f"Figuras de {len(arquivos)} amostra(s) salvas em '{self.pasta}'.")
+        return arquivos
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.fechar()
@@ -0,0 +1,110 @@
+import os
+import numpy as np
+
+class TrajectoryResult:
+    """
+    Armazena as k trajetórias de uma execução em arrays contíguos (k, T):
+        posicoes     -> int32, posição (iloc) de cada paciente na tabela, na ordem da trajetória
+        pseudotempo  -> float32, distância na MST até a raiz (pseudo-tempo)
+        severidade   -> int8, severidade (0, 1, 2) de cada paciente
+    e o vetor rotulos (N,) que traduz posição -> ID do paciente (índice do DataFrame).
+    Ocupa bem menos memória que a lista de listas de IDs e pode ser salvo/carregado
+    (.npz ou diretório de .npy, que pode ser aberto com memmap).
+    """
+
+    ARRAYS = ('posicoes', 'pseudotempo', 'severidade', 'rotulos')
+
+    def __init__(self, posicoes, pseudotempo, severidade, rotulos):
+        self.posicoes = posicoes
+        self.pseudotempo = pseudotempo
+        self.severidade = severidade
+        self.rotulos = rotulos
+
+    @classmethod
+    def vazio(cls, k, T, rotulos, dtype_pseudotempo=np.float32):
+        """
+        Cria o container já alocado, para ser preenchido lote a lote (ver preencher).
+        dtype_pseudotempo: float32 (padrão, compacto) ou float64 (precisão total).
+        """
+        return cls(
+            np.empty((k, T), dtype=np.int32),
+            np.empty((k, T), dtype=dtype_pseudotempo),
+            np.empty((k, T), dtype=np.int8),
+            np.asarray(rotulos),
+        )
+
+    def preencher(self, inicio, posicoes, pseudotempo, severidade):
+        """Copia um lote de trajetórias (arrays (b, T)) para as linhas [inicio, inicio + b)."""
+        fim = inicio + len(posicoes)
+        self.posicoes[inicio:fim] = posicoes
+        self.pseudotempo[inicio:fim] = pseudotempo
+        self.severidade[inicio:fim] = severidade
+        return fim
+
+    @classmethod
+    def concatenar(cls, resultados, rotulos=None, T=0):
+        """
+        Junta vários TrajectoryResult (ex.: chunks) da mesma coorte, na ordem recebida.
+        rotulos: (Opcional) rótulos da coorte; se None, usa os do primeiro resultado.
+        T: tamanho das trajetórias, usado só quando a lista é vazia (k = 0).
+        Com a lista vazia devolve um resultado com 0 trajetórias (ver vazio).
+        """
+        resultados = list(resultados)
+        if not resultados:
+            return cls.vazio(0, T, rotulos if rotulos is not None else np.empty(0, dtype=np.int64))
+        return cls(
+            np.concatenate([r.posicoes for r in resultados]),
+            np.concatenate([r.pseudotempo for r in resultados]),
+            np.concatenate([r.severidade for r in resultados]),
+            resultados[0].rotulos if rotulos is None else np.asarray(rotulos),
+        )
+
+    def __len__(self):
+        return len(self.posicoes)
+
+    @property
+    def T(self):
+        return self.posicoes.shape[1]
+
+    # --- Acessores no formato antigo (IDs dos pacientes) ---
+    def ids(self):
+        """Array (k, T) com os IDs dos pacientes na ordem de cada trajetória."""
+        return self.rotulos[self.posicoes]
+
+    def trajetoria(self, i):
+        """Trajetória i como lista de IDs (mesmo formato de processar_todas_trajetorias)."""
+        return self.rotulos[self.posicoes[i]].tolist()
+
+    def trajetorias(self, inicio=0, fim=None):
+        """Trajetórias [inicio, fim) como lista de listas de IDs."""
+        return self.rotulos[self.posicoes[inicio:fim]].tolist()
+
+    # --- Salvar / Carregar ---
+    def salvar(self, caminho):
+        """
+        Salva em '.npz' (um arquivo só) ou, se o caminho não terminar em '.npz',
+        num diretório com um '.npy' por array (que pode ser aberto com memmap).
+        Rótulos com dtype object (ex.: IDs em string) são gravados como unicode de
+        largura fixa, para que carregar() não precise de pickle.
+        """
+        arrays = {nome: getattr(self, nome) for nome in self.ARRAYS}
+        if arrays['rotulos'].dtype == object:
+            arrays['rotulos'] = arrays['rotulos'].astype(str)
+        if caminho.endswith('.npz'):
+            np.savez(caminho, **arrays)
+        else:
+            os.makedirs(caminho, exist_ok=True)
+            for nome, array in arrays.items():
+                np.save(os.path.join(caminho, f"{nome}.npy"), array)
+        print(f"Trajetórias salvas em '{caminho}' ({len(self)} trajetórias).")
+
+    @classmethod
+    def carregar(cls, caminho, mmap_mode=None):
+        """
+        Carrega um resultado salvo por salvar().
+        mmap_mode: (Opcional, só para diretório) ex.: 'r' abre os arrays em memmap, sem ler tudo.
+        """
+        if caminho.endswith('.npz'):
+            with np.load(caminho) as dados:
+                return cls(*(dados[nome] for nome in cls.ARRAYS))
+        return cls(*(np.load(os.path.join(caminho, f"{nome}.npy"), mmap_mode=mmap_mode) for nome in cls.ARRAYS))
@@ -1,19 +1,38 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
 import numpy as np
 import pandas as pd
 from src import (
     euclidean_matrix as me,
-    MST as mst
+    MST as mst,
+    bootstrap as bt,
+    render,
+    profiling,
+    checkpoint,
+    consensus as cs
 )
+from src.result import TrajectoryResult
+from scipy.sparse.csgraph import dijkstra
 import networkx as nx
 
-def processar_todas_trajetorias(df_norm, severity_label_serie, amostras_indices, qtd_plots=3):
+def processar_todas_trajetorias(df_norm, severity_label_serie, amostras_indices, qtd_plots=3, backend_mst='networkx',
+                                matriz_global=None):
     """
     Itera sobre as amostras, calcula matriz, gera MST e ordena.
+    É o caminho de referência e usa só a distância euclidiana (para outras métricas, ver
+    processar_trajetorias_lote(metrica=...)).
     Args:
         df_norm: DataFrame normalizado com os dados dos pacientes.
         severity_label_serie: Series com os labels de severidade (0, 1, 2).
         amostras_indices: Lista de arrays, onde cada array contém índices ORIGINAIS (inteiros) do dataframe.
         qtd_plots: quantidade de amostras (primeiras) que serão plotadas.
+        backend_mst: backend da MST (ver MST.BACKENDS_MST). 'networkx' é o caminho de referência
+            (grafo completo + Dijkstra); os demais trabalham só com os arrays (pais, pesos) e
+            montam o grafo apenas para as amostras plotadas.
+        matriz_global: (Opcional) euclidean_matrix.MatrizDistanciaGlobal; se informada, o bloco de cada
+            amostra é recortado dela em vez de recalcular a matriz de distância.
     Returns:
         trajetorias_finais: Lista de trajetórias, onde cada trajetória é uma lista de índices ordenados pelo pseudo-tempo.
     """
@@ -27,13 +46,23 @@ def processar_todas_trajetorias(df_norm, severity_label_serie, amostras_indices,
         # Pega os pacientes completos que correspondem aos índices(id) da amostra atual 
         df_recorte = df_norm.iloc[indices_amostra_atual]
         
-        # Calcula a matriz de distância para essa amostra
-        _, df_matriz = me.compute_distance_matrix(df_recorte, sample_size=None)
+        # Calcula a matriz de distância para essa amostra (ou recorta da matriz global)
+        if matriz_global is None:
+            _, df_matriz = me.compute_distance_matrix(df_recorte, sample_size=None)
+        else:
+            df_matriz = matriz_global.bloco_df(df_recorte, indices_amostra_atual)
         if i < qtd_plots:
             me.plot_numerical_matrix(df_matriz)
 
         # MST (usando Prim) 
-        grafo_mst = mst.mst(df_matriz)
+        if backend_mst == 'networkx':
+            grafo_mst = mst.mst(df_matriz)
+        else:
+            # Árvore em arrays; o grafo só é montado se a amostra for plotada
+            rotulos_recorte = df_recorte.index.tolist()
+            pais, pesos = mst.mst_arvore(df_matriz.to_numpy(), backend=backend_mst,
+                                         inicio=_vertice_inicial_prim(rotulos_recorte))
+            grafo_mst = mst.arvore_para_grafo(pais, pesos, rotulos_recorte) if i < qtd_plots else None
         
         # Cruza o ID do recorte com a severidade para obter a severidade correta dos pacientes da amostra(recorte)
         id_severity_recorte = severity_label_serie.loc[df_recorte.index]
@@ -56,6 +85,20 @@ def processar_todas_trajetorias(df_norm, severity_label_serie, amostras_indices,
         # Obtém o id do vértice inicial
         idx_raiz = candidatos_raiz[posicao_melhor_candidato]
         
+        if backend_mst != 'networkx':
+            # Árvore em arrays: distâncias por BFS (O(T)) e ordenação com um único np.lexsort
+            # 1º Severidade, 2º Distância, 3º ID (mesma ordem da tupla do caminho networkx)
+            posicao_raiz = rotulos_recorte.index(idx_raiz)
+            dists = mst.pseudotempo_arvore_lote(pais[None, :], pesos[None, :], np.array([posicao_raiz]))[0][0]
+            rotulos_array = np.asarray(rotulos_recorte)
+            ordem = np.lexsort((rotulos_array, dists, id_severity_recorte.to_numpy()))
+            indices_ordenados = rotulos_array[ordem].tolist()
+            trajetorias_finais.append(indices_ordenados)
+            if i < qtd_plots:
+                mst.plotar_trajetoria_mst(grafo_mst, indices_ordenados, i)
+                mst.plotar_evolucao_clinica_individual(df_recorte, indices_ordenados, id_severity_recorte)
+            continue
+
         # Calcular distâncias na árvore (Dijkstra)
         # retorna um dicionário: {id_paciente: distancia, ...}
         dists_dict = nx.shortest_path_length(grafo_mst, source=idx_raiz, weight='weight')
@@ -89,6 +132,678 @@ def processar_todas_trajetorias(df_norm, severity_label_serie, amostras_indices,
     return trajetorias_finais
 
 
+def _vertice_inicial_prim(rotulos_amostra):
+    """
+    Posição do vértice onde o networkx começa o Prim (set(G).pop()).
+    Usar o mesmo ponto de partida garante a mesma árvore quando há arestas empatadas.
+    """
+    inicio = next(iter(set(rotulos_amostra)))
+    return rotulos_amostra.index(inicio)
+
+
+REGRAS_RAIZ = ('centroide', 'medoide')
+
+def selecionar_raizes(X_lote, severidade_lote, regra='centroide', tensor_dist=None, sem_saudavel='menor_severidade'):
+    """
+    Raiz (pseudo-tempo zero) de cada amostra do lote, em uma única conta vetorizada sobre
+    arrays posicionais (sem pandas).
+    Regras:
+        'centroide' -> o saudável (0) mais próximo da média dos saudáveis (regra original).
+        'medoide'   -> o saudável com a menor soma de distâncias aos outros saudáveis
+                       (medoide real), reaproveitando o bloco de distâncias já calculado.
+    Args:
+        X_lote: array (k, T, F) com os dados normalizados das amostras.
+        severidade_lote: array (k, T) com a severidade dos pacientes das amostras.
+        regra: 'centroide' ou 'medoide'.
+        tensor_dist: array (k, T, T) com as distâncias das amostras (obrigatório no 'medoide').
+        sem_saudavel: o que fazer com amostras sem paciente saudável:
+            'menor_severidade' -> os candidatos passam a ser os pacientes da menor severidade da amostra;
+            'erro' -> ValueError.
+    Returns:
+        raizes: array (k,) com a posição da raiz dentro de cada amostra (no empate, a primeira posição).
+    """
+    if regra not in REGRAS_RAIZ:
+        raise ValueError(f"Regra de raiz desconhecida: '{regra}'. Opções: {REGRAS_RAIZ}")
+
+    menor_severidade = severidade_lote.min(axis=1, keepdims=True)
+    if sem_saudavel == 'erro':
+        if (menor_severidade > 0).any():
+            raise ValueError("Existe amostra sem paciente saudável (0): não há como definir a raiz.")
+    elif sem_saudavel != 'menor_severidade':
+        raise ValueError("sem_saudavel deve ser 'erro' ou 'menor_severidade'.")
+    # Com saudáveis na amostra, a menor severidade é 0: os candidatos são exatamente os saudáveis
+    candidatos = severidade_lote == menor_severidade
+
+    if regra == 'centroide':
+        # Centro ideal (média) dos candidatos de cada amostra
+        centros = np.where(candidatos[..., None], X_lote, 0.0).sum(axis=1) / candidatos.sum(axis=1)[:, None]
+        # Desvio de cada paciente até o centro (só os candidatos concorrem)
+        custo = np.linalg.norm(X_lote - centros[:, None, :], axis=2)
+    else:
+        if tensor_dist is None:
+            raise ValueError("A regra 'medoide' precisa do bloco de distâncias (tensor_dist).")
+        # Soma das distâncias de cada paciente até os candidatos da amostra
+        custo = np.where(candidatos[:, None, :], tensor_dist, 0.0).sum(axis=2)
+
+    custo[~candidatos] = np.inf
+    return np.argmin(custo, axis=1)
+
+
+def _plotar_amostra(df_norm, severity_label_serie, indices_amostra, indices_ordenados, numero_amostra,
+                    pasta_figuras=None, metrica=None):
+    """
+    Gera os gráficos de uma amostra (matriz, MST, trajetória e evolução clínica).
+    Com pasta_figuras, salva os arquivos em vez de abrir as janelas.
+    metrica: Metrica já ajustada (ou None = euclidiana), a mesma usada nas trajetórias.
+    """
+    df_recorte = df_norm.iloc[indices_amostra]
+    id_severity_recorte = severity_label_serie.loc[df_recorte.index]
+    render.renderizar_amostra(df_recorte, id_severity_recorte, indices_ordenados, numero_amostra, pasta_figuras,
+                              metrica)
+
+
+def _arvores_lote(X, X_lote, lote, severidade_lote, rotulos_lote, matriz_global, regra_raiz, metrica, perf):
+    """
+    Matrizes de distância, raízes e MSTs (Prim) de um lote de amostras.
+    X_lote: pacientes do lote no espaço da métrica (k, T, F); demais argumentos: ver _iterar_ordenacao.
+    Returns:
+        (pais, pesos, raizes): arrays (k, T), (k, T) e (k,) (ver MST.mst_prim_lote).
+    """
+    # Matrizes de distância de todo o lote (calculadas ou recortadas da matriz global)
+    with perf.etapa('matriz_distancia'):
+        if metrica is not None:
+            tensor_dist = metrica.distancias(X_lote)
+        elif matriz_global is None:
+            tensor_dist = me.compute_distance_tensor(X, lote)
+        else:
+            tensor_dist = matriz_global.blocos(lote)
+
+    # Raiz (centro do cluster saudável) e MST (Prim) do lote
+    with perf.etapa('raiz'):
+        raizes = selecionar_raizes(X_lote, severidade_lote, regra_raiz, tensor_dist)
+    with perf.etapa('mst'):
+        inicios_prim = np.array([_vertice_inicial_prim(r) for r in rotulos_lote.tolist()])
+        pais, pesos = mst.mst_prim_lote(tensor_dist, inicios_prim)
+    return pais, pesos, raizes
+
+
+def _iterar_ordenacao(X, rotulos, severidade, amostras, tamanho_lote=256, matriz_global=None, perfilador=None,
+                      regra_raiz='centroide', metrica=None):
+    """
+    Núcleo do motor em lote: recebe só arrays e produz (yield) as trajetórias de cada lote
+    à medida que são calculadas.
+    Args:
+        X: array (N, F) com os dados normalizados.
+        rotulos: array (N,) com os IDs (índice do DataFrame) dos pacientes.
+        severidade: array (N,) com a severidade de cada paciente.
+        amostras: array (k, T) com as posições dos pacientes de cada amostra.
+        tamanho_lote: quantidade de amostras processadas por vez.
+        matriz_global: (Opcional) MatrizDistanciaGlobal de onde os blocos são recortados.
+        perfilador: (Opcional) profiling.Perfilador que mede cada etapa do lote.
+        regra_raiz: 'centroide' ou 'medoide' (ver selecionar_raizes).
+        metrica: (Opcional) euclidean_matrix.Metrica já ajustada; None = euclidiana exata (pdist).
+    Yields:
+        (posicoes, pseudotempo, severidade): arrays (lote, T) na ordem da trajetória, com a posição
+        de cada paciente em X, a distância dele até a raiz na MST e a severidade.
+    """
+    if metrica is not None and matriz_global is not None:
+        raise ValueError("matriz_global só existe para a distância euclidiana (metrica=None).")
+    perf = perfilador or profiling.NULO
+    # Pacientes no espaço da métrica (transformação feita uma vez para a coorte inteira)
+    Z = X if metrica is None else metrica.transformar(X)
+
+    def ordenar(lote):
+        X_lote = Z[lote]
+        severidade_lote = severidade[lote]
+        rotulos_lote = rotulos[lote]
+
+        pais, pesos, raizes = _arvores_lote(X, X_lote, lote, severidade_lote, rotulos_lote, matriz_global,
+                                            regra_raiz, metrica, perf)
+
+        # Distância de cada paciente até a raiz: uma BFS sobre os arrays de pais (sem Dijkstra)
+        with perf.etapa('distancias_arvore'):
+            dist, _, _ = mst.pseudotempo_arvore_lote(pais, pesos, raizes)
+
+        # Ordenação: 1º Severidade, 2º Distância, 3º ID (mesma ordem da tupla do caminho original)
+        with perf.etapa('ordenacao'):
+            ordem = np.lexsort((rotulos_lote, dist, severidade_lote), axis=-1)
+            return (
+                np.take_along_axis(lote, ordem, axis=1),
+                np.take_along_axis(dist, ordem, axis=1),
+                np.take_along_axis(severidade_lote, ordem, axis=1),
+            )
+
+    for inicio in range(0, len(amostras), tamanho_lote):
+        t0 = time.perf_counter()
+        lote = amostras[inicio:inicio + tamanho_lote]
+        # As primeiras perf.amostras_individuais amostras do lote são processadas uma a uma (tempo real
+        # de cada amostra, com histograma); o resto vai junto. O resultado é o mesmo do lote inteiro.
+        individuais = min(perf.amostras_individuais, len(lote))
+        partes, tempos = [], []
+        for i in range(individuais):
+            t_amostra = time.perf_counter()
+            partes.append(ordenar(lote[i:i + 1]))
+            tempos.append(time.perf_counter() - t_amostra)
+        if individuais < len(lote):
+            partes.append(ordenar(lote[individuais:]))
+        saida = partes[0] if len(partes) == 1 else tuple(np.concatenate(p) for p in zip(*partes))
+        perf.registrar_amostras('tempo_amostra', tempos)
+        # Média por amostra do lote inteiro (inclui as individuais; série sem histograma)
+        perf.registrar_amostras('tempo_medio_amostra_por_lote', [(time.perf_counter() - t0) / len(lote)],
+                                histograma=False)
+        yield saida
+
+
+def _ordenar_amostras(X, rotulos, severidade, amostras, tamanho_lote=256, matriz_global=None, perfilador=None,
+                      regra_raiz='centroide', metrica=None):
+    # Mesma coisa que _iterar_ordenacao, mas devolve todas as trajetórias numa lista só (IDs)
+    trajetorias_finais = []
+    for posicoes, _, _ in _iterar_ordenacao(X, rotulos, severidade, amostras, tamanho_lote, matriz_global,
+                                            perfilador, regra_raiz, metrica):
+        trajetorias_finais.extend(rotulos[posicoes].tolist())
+    return trajetorias_finais
+
+
+def processar_trajetorias_resultado(df_norm, severity_label_serie, amostras_indices, tamanho_lote=256,
+                                    matriz_global=None, perfilador=None, regra_raiz='centroide',
+                                    dtype_pseudotempo=np.float32, metrica=None):
+    """
+    Motor em lote devolvendo um result.TrajectoryResult (arrays compactos (k, T) com posições,
+    pseudo-tempo e severidade) em vez da lista de listas de IDs.
+    Mesmos argumentos de processar_trajetorias_lote. As contas são feitas no dtype de df_norm
+    (ver preprocessing_pts(dtype=...)); dtype_pseudotempo é o dtype guardado no resultado.
+    """
+    amostras = np.asarray(amostras_indices)
+    k, T = amostras.shape
+
+    X = df_norm.to_numpy()
+    rotulos = df_norm.index.to_numpy()
+    severidade = severity_label_serie.loc[df_norm.index].to_numpy()
+
+    print(f"Iniciando processamento em lote de {k} amostras...")
+
+    metrica = me.preparar_metrica(metrica, X, df_norm.columns)
+    resultado = TrajectoryResult.vazio(k, T, rotulos, dtype_pseudotempo)
+    inicio = 0
+    for posicoes, pseudotempo, severidade_ord in _iterar_ordenacao(X, rotulos, severidade, amostras,
+                                                                   tamanho_lote, matriz_global, perfilador,
+                                                                   regra_raiz, metrica):
+        inicio = resultado.preencher(inicio, posicoes, pseudotempo, severidade_ord)
+
+    print("Processamento Finalizado.")
+    return resultado
+
+
+def validar_dtype(df_norm, severity_label_serie, amostras, dtype=np.float32, tamanho_lote=256,
+                  regra_raiz='centroide', metrica=None):
+    """
+    Relatório de validação do caminho em dtype reduzido contra float64: as mesmas amostras são
+    processadas nos dois dtypes (df_norm convertido, sem refazer o pré-processamento) e as
+    ordenações/pseudo-tempos são comparados.
+    Args:
+        df_norm: DataFrame normalizado em float64 (a referência).
+        amostras: array (k, T) com as amostras usadas nos dois dtypes.
+        dtype: dtype reduzido a validar (ex.: np.float32).
+    Returns:
+        dicionário com n_amostras, fracao_trajetorias_identicas, posicoes_diferentes_media (nas
+        trajetórias que mudaram), deslocamento_max (maior mudança de posição de um paciente),
+        erro_max_abs e erro_max_rel do pseudo-tempo, e tempo_s / pico_mem_mb de cada dtype.
+    """
+    amostras = np.asarray(amostras)
+    resultados, medicoes = {}, {}
+    for nome, tipo in (('float64', np.float64), (np.dtype(dtype).name, dtype)):
+        perfilador = profiling.Perfilador(memoria=True)
+        with perfilador.etapa('trajetorias'):
+            resultados[nome] = processar_trajetorias_resultado(df_norm.astype(tipo), severity_label_serie, amostras,
+                                                               tamanho_lote, regra_raiz=regra_raiz,
+                                                               dtype_pseudotempo=np.float64, metrica=metrica)
+        stats = perfilador.etapas['trajetorias']
+        medicoes[nome] = {'tempo_s': stats['parede_s'], 'pico_mem_mb': stats['pico_mem_mb']}
+    relatorio = {'dtype': np.dtype(dtype).name}
+    relatorio.update(comparar_ordenacoes(resultados['float64'], resultados[np.dtype(dtype).name]))
+    relatorio.update({f"{chave}_{nome}": valor for nome, m in medicoes.items() for chave, valor in m.items()})
+    return relatorio
+
+
+def comparar_ordenacoes(base, reduzido):
+    """
+    Compara dois TrajectoryResult das mesmas amostras (ex.: base em float64 x reduzido em float32).
+    Returns:
+        dicionário com n_amostras, fracao_trajetorias_identicas, posicoes_diferentes_media,
+        deslocamento_max, erro_max_abs e erro_max_rel (ver validar_dtype).
+    """
+    diferentes = base.posicoes != reduzido.posicoes
+    mudou = diferentes.any(axis=1)
+    # Posição (slot) de cada paciente na trajetória, com os pacientes na mesma ordem (id crescente)
+    # nos dois dtypes: argsort das posições (os pacientes de uma amostra são distintos)
+    slot_base = np.argsort(base.posicoes, axis=1)
+    slot_reduzido = np.argsort(reduzido.posicoes, axis=1)
+    pseudo_base = np.take_along_axis(base.pseudotempo, slot_base, axis=1)
+    pseudo_reduzido = np.take_along_axis(reduzido.pseudotempo, slot_reduzido, axis=1)
+    erro = np.abs(pseudo_base - pseudo_reduzido)
+
+    return {
+        'n_amostras': len(base),
+        'fracao_trajetorias_identicas': float(1 - mudou.mean()),
+        'posicoes_diferentes_media': float(diferentes[mudou].sum(axis=1).mean()) if mudou.any() else 0.0,
+        'deslocamento_max': int(np.abs(slot_base - slot_reduzido).max()),
+        'erro_max_abs': float(erro.max()),
+        'erro_max_rel': float((erro / np.maximum(pseudo_base, np.finfo(np.float64).tiny)).max()),
+    }
+
+
+def processar_trajetorias_lote(df_norm, severity_label_serie, amostras_indices, tamanho_lote=256, qtd_plots=0,
+                               matriz_global=None, pasta_figuras=None, perfilador=None, regra_raiz='centroide',
+                               metrica=None):
+    """
+    Versão em lote (vetorizada) de processar_todas_trajetorias: mesmas trajetórias, sem o loop
+    amostra a amostra com pandas/networkx.
+    Matrizes de distância, MST (Prim denso), raiz e distâncias na árvore são calculadas
+    com NumPy para vários samples ao mesmo tempo, no dtype de df_norm (float64 ou float32).
+    Args:
+        df_norm: DataFrame normalizado com os dados dos pacientes.
+        severity_label_serie: Series com os labels de severidade (0, 1, 2).
+        amostras_indices: array (k, T) (ou lista de arrays) com os índices ORIGINAIS (inteiros) do dataframe.
+        tamanho_lote: quantidade de amostras processadas por vez (limita a memória do tensor (lote, T, T, F)).
+        qtd_plots: quantidade de amostras (primeiras) que serão plotadas.
+        matriz_global: (Opcional) euclidean_matrix.MatrizDistanciaGlobal já calculada; os blocos de cada
+            amostra são recortados dela (sem recalcular distâncias).
+        pasta_figuras: (Opcional) salva as figuras das amostras plotadas nessa pasta, sem abrir janelas
+            (para renderizar em paralelo, fora do loop, use render.RenderizadorFiguras).
+        perfilador: (Opcional) profiling.Perfilador que mede as etapas (matriz, MST, raiz, distâncias,
+            ordenação e gráficos).
+        regra_raiz: 'centroide' (saudável mais próximo da média dos saudáveis, regra original) ou
+            'medoide' (saudável com a menor soma de distâncias aos outros saudáveis).
+        metrica: distância entre pacientes: None/'euclidiana' (exata, igual ao pdist), um nome de
+            euclidean_matrix.METRICAS ('euclidiana_padronizada', 'mahalanobis', 'euclidiana_ponderada',
+            'correlacao') ou uma Metrica. Os parâmetros são ajustados uma vez na coorte inteira.
+    Returns:
+        trajetorias_finais: Lista de trajetórias, onde cada trajetória é uma lista de índices ordenados pelo pseudo-tempo.
+    """
+    amostras = np.asarray(amostras_indices)
+    k = len(amostras)
+
+    X = df_norm.to_numpy()
+    rotulos = df_norm.index.to_numpy()
+    severidade = severity_label_serie.loc[df_norm.index].to_numpy()
+
+    print(f"Iniciando processamento em lote de {k} amostras...")
+
+    metrica = me.preparar_metrica(metrica, X, df_norm.columns)
+    trajetorias_finais = _ordenar_amostras(X, rotulos, severidade, amostras, tamanho_lote, matriz_global,
+                                           perfilador, regra_raiz, metrica)
+
+    perf = perfilador or profiling.NULO
+    for i in range(min(qtd_plots, k)):
+        with perf.etapa('graficos'):
+            _plotar_amostra(df_norm, severity_label_serie, amostras[i], trajetorias_finais[i], i, pasta_figuras,
+                            metrica)
+
+    print("Processamento Finalizado.")
+    return trajetorias_finais
+
+
+def iterar_trajetorias_lote(df_norm, severity_label_serie, amostras_indices, tamanho_lote=256, matriz_global=None,
+                            regra_raiz='centroide', metrica=None):
+    """
+    Versão "streaming" de processar_trajetorias_lote: produz (yield) as trajetórias lote a lote,
+    para que possam ser exportadas enquanto são calculadas (ver export.ExportadorTrajetorias).
+    Yields:
+        trajetorias_lote: lista com as trajetórias (listas de índices ordenados) do lote.
+    """
+    X = df_norm.to_numpy()
+    rotulos = df_norm.index.to_numpy()
+    severidade = severity_label_serie.loc[df_norm.index].to_numpy()
+
+    metrica = me.preparar_metrica(metrica, X, df_norm.columns)
+    for posicoes, _, _ in _iterar_ordenacao(X, rotulos, severidade, np.asarray(amostras_indices),
+                                            tamanho_lote, matriz_global, regra_raiz=regra_raiz, metrica=metrica):
+        yield rotulos[posicoes].tolist()
+
+
+# --- DADOS DE VISUALIZAÇÃO DAS MSTs (PARA DASHBOARDS) ---
+LAYOUTS_ARVORE = ('radial', 'kamada_kawai', None)
+
+def iterar_arvores_lote(df_norm, severity_label_serie, amostras_indices, tamanho_lote=256, regra_raiz='centroide',
+                        metrica=None, layout='radial'):
+    """
+    Dados de visualização das MSTs (sem matplotlib), lote a lote: para um dashboard desenhar
+    qualquer amostra sob demanda (ver export.ExportadorArvores). Mesmas árvores, raízes e
+    ordenações do motor em lote.
+    Args:
+        amostras_indices: array (k, T) com as posições dos pacientes de cada amostra.
+        layout: coordenadas dos vértices: 'radial' (vetorizado, MST.layout_radial_lote: raio =
+            pseudo-tempo), 'kamada_kawai' (o mesmo das figuras; ~20 ms por amostra) ou None.
+        Demais argumentos: ver processar_trajetorias_lote.
+    Yields:
+        dicionário com arrays do lote (b amostras, T vértices por amostra; vértice = posição na amostra):
+            paciente_id, severidade, pai, peso (aresta vértice-pai da MST; pai -1 no vértice inicial),
+            raiz (b,), pseudotempo, profundidade, ordem (vértices na ordem da trajetória) e x, y.
+    """
+    if layout not in LAYOUTS_ARVORE:
+        raise ValueError(f"Layout desconhecido: '{layout}'. Opções: {LAYOUTS_ARVORE}")
+    X = df_norm.to_numpy()
+    rotulos = df_norm.index.to_numpy()
+    severidade = severity_label_serie.loc[df_norm.index].to_numpy()
+    amostras = np.asarray(amostras_indices)
+
+    metrica = me.preparar_metrica(metrica, X, df_norm.columns)
+    Z = X if metrica is None else metrica.transformar(X)
+    for inicio in range(0, len(amostras), tamanho_lote):
+        lote = amostras[inicio:inicio + tamanho_lote]
+        severidade_lote = severidade[lote]
+        rotulos_lote = rotulos[lote]
+        pais, pesos, raizes = _arvores_lote(X, Z[lote], lote, severidade_lote, rotulos_lote, None, regra_raiz,
+                                            metrica, profiling.NULO)
+        dist, profundidade, _ = mst.pseudotempo_arvore_lote(pais, pesos, raizes)
+
+        arvores = {
+            'paciente_id': rotulos_lote, 'severidade': severidade_lote, 'pai': pais, 'peso': pesos,
+            'raiz': raizes, 'pseudotempo': dist, 'profundidade': profundidade,
+            'ordem': np.lexsort((rotulos_lote, dist, severidade_lote), axis=-1),
+        }
+        if layout == 'radial':
+            arvores['x'], arvores['y'] = mst.layout_radial_lote(pais, dist, profundidade)
+        elif layout == 'kamada_kawai':
+            posicoes = [mst.layout_mst(mst.arvore_para_grafo(p, w)) for p, w in zip(pais, pesos)]
+            arvores['x'] = np.array([[pos[v][0] for v in range(len(pos))] for pos in posicoes])
+            arvores['y'] = np.array([[pos[v][1] for v in range(len(pos))] for pos in posicoes])
+        yield arvores
+
+
+# --- TRAJETÓRIA ÚNICA DA COORTE INTEIRA ---
+def trajetoria_coorte(df_norm, severity_label_serie, n_vizinhos=10, metrica=None):
+    """
+    Uma trajetória só com todos os pacientes (sem bootstrap), para coortes grandes (100k+).
+    A MST sai do grafo k-NN esparso (MST.mst_knn, memória O(N*k)); o pseudo-tempo é a distância
+    na árvore até a raiz (saudável mais próximo da média dos saudáveis), via Dijkstra esparso do scipy.
+    Pacientes duplicados são juntados antes (recebem o mesmo pseudo-tempo).
+    A ordem segue a mesma regra das amostras: severidade, distância e ID.
+    Args:
+        df_norm: DataFrame normalizado com os dados dos pacientes.
+        severity_label_serie: Series com os labels de severidade (0, 1, 2).
+        n_vizinhos: vizinhos por paciente no grafo k-NN.
+        metrica: distância entre pacientes (ver processar_trajetorias_lote). O grafo k-NN e a raiz
+            são calculados no espaço da métrica (Metrica.transformar); na correlação a árvore é a
+            mesma (distância monótona) e só os pesos viram ||za - zb||² / 2.
+    Returns:
+        result.TrajectoryResult com uma única trajetória (1, N); compare com o consenso do bootstrap
+        em consensus.comparar_com_consenso.
+    """
+    X = df_norm.to_numpy()
+    rotulos = df_norm.index.to_numpy()
+    severidade = severity_label_serie.loc[df_norm.index].to_numpy()
+
+    print(f"Iniciando trajetória da coorte inteira ({len(X)} pacientes, grafo {n_vizinhos}-NN)...")
+
+    # Pacientes no espaço da métrica, onde a distância é euclidiana
+    metrica = me.preparar_metrica(metrica, X, df_norm.columns)
+    if metrica is not None:
+        X = metrica.transformar(X)
+
+    # Distância zero não vira aresta no grafo esparso: a MST é feita só com os pontos distintos
+    unicos, inverso = np.unique(X, axis=0, return_inverse=True)
+    inverso = inverso.ravel()
+    arvore, n_componentes = mst.mst_knn(unicos, n_vizinhos)
+    if n_componentes > 1:
+        print(f"Grafo k-NN com {n_componentes} componentes: ligados pelas arestas mais curtas entre eles.")
+    if metrica is not None and metrica.quadrado:
+        arvore.data = arvore.data ** 2 / 2
+
+    raiz = selecionar_raizes(X[None], severidade[None])[0]
+    dist = dijkstra(arvore, directed=False, indices=inverso[raiz])[inverso]
+
+    ordem = np.lexsort((rotulos, dist, severidade))
+    print("Processamento Finalizado.")
+    return TrajectoryResult(
+        ordem[None].astype(np.int32),
+        dist[ordem][None].astype(np.float32),
+        severidade[ordem][None].astype(np.int8),
+        rotulos,
+    )
+
+
+# --- EXECUÇÃO PARALELA (VÁRIOS PROCESSOS) ---
+# Estado de cada processo worker (preenchido uma única vez pelo initializer do pool)
+_ESTADO_WORKER = {}
+
+def _iniciar_worker(X, rotulos, severidade, T, seed, tamanho_lote, matriz_global, regra_raiz='centroide',
+                    metrica=None):
+    _ESTADO_WORKER.update(X=X, rotulos=rotulos, severidade=severidade, T=T, seed=seed, tamanho_lote=tamanho_lote,
+                          matriz_global=matriz_global, regra_raiz=regra_raiz, metrica=metrica)
+
+def _processar_chunk(tarefa):
+    # tarefa: (inicio, fim, amostras) -> amostras é None quando o worker sorteia com a seed
+    inicio, fim, amostras = tarefa
+    estado = _ESTADO_WORKER
+    if amostras is None:
+        amostras = _sortear_chunk(estado['severidade'], inicio, fim, estado['T'], estado['seed'])
+    # Devolve arrays compactos (TrajectoryResult): bem menos dados para voltar ao processo principal
+    partes = [
+        TrajectoryResult(posicoes.astype(np.int32), pseudotempo.astype(np.float32), severidade.astype(np.int8), None)
+        for posicoes, pseudotempo, severidade in _iterar_ordenacao(
+            estado['X'], estado['rotulos'], estado['severidade'], amostras, estado['tamanho_lote'], estado['matriz_global'],
+            regra_raiz=estado['regra_raiz'], metrica=estado['metrica'])
+    ]
+    return TrajectoryResult.concatenar(partes, T=np.shape(amostras)[1])
+
+@contextmanager
+def _pool_workers(n_workers, args_worker):
+    # Devolve a função map a ser usada: a do pool de processos ou, com 1 worker, a do próprio processo
+    if n_workers == 1:
+        _iniciar_worker(*args_worker)
+        yield map
+    else:
+        executor = ProcessPoolExecutor(max_workers=n_workers, initializer=_iniciar_worker, initargs=args_worker)
+        try:
+            yield executor.map
+        finally:
+            # Se o consumidor parar antes do fim (ex.: parada antecipada), os chunks ainda na fila são cancelados
+            executor.shutdown(wait=True, cancel_futures=True)
+
+def _sortear_chunk(severidade, inicio, fim, T, seed):
+    # Mesmo sorteio de bootstrap.gerar_amostras_vetorizado(k, T, seed) (amostra i depende só de (seed, i))
+    return np.concatenate(list(bt.iterar_amostras_vetorizado(severidade, k=fim - inicio, T=T, seed=seed,
+                                                             inicio=inicio)))
+
+def _iterar_chunks_paralelo(df_norm, severity_label_serie, amostras_indices, k, T, seed,
+                            n_workers, tamanho_chunk, tamanho_lote, matriz_global, regra_raiz='centroide',
+                            metrica=None):
+    # Produz um TrajectoryResult por chunk, na ordem original
+    if amostras_indices is None and (k is None or seed is None):
+        raise ValueError("Informe amostras_indices ou (k, seed) para os workers sortearem as amostras.")
+
+    X = df_norm.to_numpy()
+    rotulos = df_norm.index.to_numpy()
+    severidade = severity_label_serie.loc[df_norm.index].to_numpy()
+
+    if amostras_indices is not None:
+        amostras = np.asarray(amostras_indices)
+        k = len(amostras)
+
+    # Divide as k amostras em chunks [inicio, fim)
+    tarefas = []
+    for inicio in range(0, k, tamanho_chunk):
+        fim = min(inicio + tamanho_chunk, k)
+        tarefas.append((inicio, fim, amostras[inicio:fim] if amostras_indices is not None else None))
+
+    n_workers = n_workers or os.cpu_count()
+    print(f"Iniciando processamento paralelo de {k} amostras | {n_workers} processo(s), {len(tarefas)} chunk(s)...")
+
+    # Parâmetros da métrica ajustados uma vez aqui; os workers recebem a métrica pronta
+    metrica = me.preparar_metrica(metrica, X, df_norm.columns)
+    args_worker = (X, rotulos, severidade, T, seed, tamanho_lote, matriz_global, regra_raiz, metrica)
+    with _pool_workers(n_workers, args_worker) as mapear:
+        for resultado_chunk in mapear(_processar_chunk, tarefas): # map preserva a ordem dos chunks
+            resultado_chunk.rotulos = rotulos
+            yield resultado_chunk
+
+
+def iterar_trajetorias_paralelo(df_norm, severity_label_serie, amostras_indices=None, k=None, T=30, seed=None,
+                                n_workers=None, tamanho_chunk=500, tamanho_lote=256, matriz_global=None,
+                                regra_raiz='centroide', metrica=None):
+    """
+    Versão "streaming" de processar_trajetorias_paralelo (mesmos argumentos):
+    produz (yield) as trajetórias de cada chunk, na ordem original, assim que ficam prontas.
+    """
+    for resultado_chunk in _iterar_chunks_paralelo(df_norm, severity_label_serie, amostras_indices, k, T, seed,
+                                                   n_workers, tamanho_chunk, tamanho_lote, matriz_global,
+                                                   regra_raiz, metrica):
+        yield resultado_chunk.trajetorias()
+
+
+def processar_trajetorias_paralelo(df_norm, severity_label_serie, amostras_indices=None, k=None, T=30, seed=None,
+                                   n_workers=None, tamanho_chunk=500, tamanho_lote=256, matriz_global=None,
+                                   como_resultado=False, regra_raiz='centroide', metrica=None):
+    """
+    Executa o motor em lote dividido em chunks de amostras entre vários processos.
+    O resultado é idêntico (bit a bit) para qualquer n_workers/tamanho_chunk:
+    a amostra i depende só de (seed, i) (contrato de bootstrap.BLOCO_SORTEIO) e os chunks voltam na ordem original.
+    Args:
+        df_norm: DataFrame normalizado com os dados dos pacientes.
+        severity_label_serie: Series com os labels de severidade (0, 1, 2).
+        amostras_indices: (Opcional) amostras já sorteadas, array (k, T). Se None, cada worker
+            sorteia o próprio chunk com a seed (não precisa guardar nem enviar as k amostras),
+            com as mesmas amostras de bootstrap.gerar_amostras_vetorizado(k, T, seed).
+        k, T, seed: quantidade/tamanho das amostras e seed, usados quando amostras_indices é None.
+        n_workers: quantidade de processos (None = todos os núcleos; 1 = roda no processo atual).
+        tamanho_chunk: quantidade de amostras por tarefa enviada a um worker.
+        tamanho_lote: quantidade de amostras vetorizadas por vez dentro do worker.
+        matriz_global: (Opcional) MatrizDistanciaGlobal compartilhada pelos workers (em memmap,
+            cada worker só reabre o arquivo).
+        como_resultado: se True, devolve um result.TrajectoryResult (arrays compactos) em vez da lista.
+        regra_raiz: 'centroide' ou 'medoide' (ver selecionar_raizes).
+        metrica: distância entre pacientes (ver processar_trajetorias_lote).
+    Returns:
+        trajetorias_finais: Lista de trajetórias (listas de índices ordenados pelo pseudo-tempo).
+    """
+    chunks = list(_iterar_chunks_paralelo(df_norm, severity_label_serie, amostras_indices, k, T, seed,
+                                          n_workers, tamanho_chunk, tamanho_lote, matriz_global, regra_raiz,
+                                          metrica))
+    T = T if amostras_indices is None else np.shape(amostras_indices)[1]
+    resultado = TrajectoryResult.concatenar(chunks, rotulos=df_norm.index.to_numpy(), T=T)
+
+    print("Processamento Finalizado.")
+    return resultado if como_resultado else resultado.trajetorias()
+
+
+
+# --- PARADA ANTECIPADA (ESTABILIDADE DO CONSENSO) ---
+def processar_trajetorias_estabilidade(df_norm, severity_label_serie, amostras_indices=None, k=None, T=30, seed=None,
+                                       n_workers=1, tamanho_chunk=100, tamanho_lote=256, regra_raiz='centroide',
+                                       metrica=None, monitor=None, tolerancia_erro=0.05, tolerancia=None,
+                                       verbose=False):
+    """
+    Igual a processar_trajetorias_paralelo(como_resultado=True), mas com k como limite máximo:
+    depois de cada chunk o consenso.MonitorEstabilidade verifica se as ordenações já estabilizaram
+    e, se sim, para de calcular MSTs. As trajetórias calculadas são idênticas às primeiras do
+    motor sem parada antecipada (mesmas amostras, mesma ordem).
+    Args:
+        tamanho_chunk: amostras entre duas verificações do monitor.
+        monitor: (Opcional) consenso.MonitorEstabilidade já configurado; se None, é criado um
+            com as tolerâncias informadas (demais critérios no padrão).
+        tolerancia_erro: limite do erro padrão relativo do consenso, critério principal (se monitor=None).
+        tolerancia: limite de 1 - Kendall tau entre os consensos de duas metades disjuntas das
+            amostras; None desliga (se monitor=None).
+        verbose: se True, imprime as medidas do monitor a cada chunk.
+        Demais argumentos: ver processar_trajetorias_paralelo.
+    Returns:
+        (resultado, monitor): result.TrajectoryResult com as trajetórias calculadas (k ou menos)
+        e o monitor (monitor.historico() tem as medidas de cada verificação).
+    """
+    monitor = monitor or cs.MonitorEstabilidade(n_pacientes=len(df_norm), tolerancia=tolerancia,
+                                                tolerancia_erro=tolerancia_erro)
+    k_max = len(amostras_indices) if amostras_indices is not None else k
+
+    chunks = []
+    for resultado_chunk in _iterar_chunks_paralelo(df_norm, severity_label_serie, amostras_indices, k, T, seed,
+                                                   n_workers, tamanho_chunk, tamanho_lote, None, regra_raiz,
+                                                   metrica):
+        chunks.append(resultado_chunk)
+        medidas = monitor.atualizar_resultado(resultado_chunk)
+        if verbose:
+            print(f"Estabilidade: {medidas['n_amostras']}/{k_max} amostras | erro relativo {medidas['erro_relativo']:.4f}"
+                  f" | tau metades {medidas['tau_metades']:.4f} | cobertura {medidas['cobertura']:.2f}")
+        if monitor.convergiu:
+            print(f"Consenso estável com {monitor.n_amostras} de {k_max} amostras: parada antecipada.")
+            break
+
+    print("Processamento Finalizado.")
+    T = T if amostras_indices is None else np.shape(amostras_indices)[1]
+    return TrajectoryResult.concatenar(chunks, rotulos=df_norm.index.to_numpy(), T=T), monitor
+
+# --- CHECKPOINT / RETOMADA (EXECUÇÕES LONGAS) ---
+def processar_trajetorias_checkpoint(df_norm, severity_label_serie, pasta_checkpoint, amostras_indices=None, k=None,
+                                     T=30, seed=None, n_workers=1, tamanho_chunk=500, tamanho_lote=256,
+                                     regra_raiz='centroide', retomar=True, metrica=None):
+    """
+    Igual a processar_trajetorias_paralelo(como_resultado=True), mas cada chunk concluído é gravado
+    em disco (checkpoint.CheckpointTrajetorias). Se a execução cair, rodar de novo com retomar=True
+    continua do último chunk completo, com resultado idêntico ao de uma execução sem interrupção.
+    Args:
+        pasta_checkpoint: pasta do checkpoint (amostras, trajetórias concluídas e estado).
+        amostras_indices: (Opcional) amostras já sorteadas (k, T). Se None, são sorteadas aqui com
+            bootstrap.gerar_amostras_vetorizado(k, T, seed) e gravadas no checkpoint; sem seed, a
+            entropia sorteada é guardada no estado (e reaproveitada ao retomar com seed=None).
+        retomar: se True e a pasta tiver um checkpoint desta mesma execução (mesmos dados, k, T, seed,
+            amostras (hash), regra_raiz e métrica com os mesmos parâmetros), continua de onde parou;
+            qualquer diferença é um ValueError. Se False, começa do zero.
+        Demais argumentos: ver processar_trajetorias_paralelo.
+    Returns:
+        result.TrajectoryResult com as k trajetórias.
+    """
+    X = df_norm.to_numpy()
+    severidade = severity_label_serie.loc[df_norm.index].to_numpy()
+    # Métrica ajustada aqui: o config guarda o hash dos parâmetros (pesos, VI...), não só o nome
+    metrica = me.preparar_metrica(metrica, X, df_norm.columns)
+
+    # As amostras são montadas antes do config, que guarda k, a seed e o hash delas: retomar com outro
+    # k ou outra seed (mesmo com os mesmos dados) é recusado em vez de continuar outra execução
+    ck = checkpoint.CheckpointTrajetorias(pasta_checkpoint)
+    retomando = retomar and ck.existe()
+    if amostras_indices is None:
+        if k is None:
+            raise ValueError("Informe amostras_indices ou k para sortear as amostras.")
+        if seed is None:
+            # Sem seed: ao retomar, reaproveita a entropia sorteada na execução interrompida
+            seed = ck.config_gravada().get('seed') if retomando else None
+            seed = np.random.SeedSequence().entropy if seed is None else seed
+        seed = np.asarray(seed).tolist() # int ou lista de ints (gravável em JSON)
+        amostras = bt.gerar_amostras_vetorizado(severity_label_serie.loc[df_norm.index], k=k, T=T, seed=seed)
+    else:
+        amostras = np.asarray(amostras_indices)
+        seed = None # amostras informadas: a seed não é usada (o hash das amostras identifica a execução)
+
+    config = {
+        'dados': checkpoint.impressao_digital(X, severidade),
+        'k': int(amostras.shape[0]),
+        'T': int(amostras.shape[1]),
+        'seed': seed,
+        'amostras': checkpoint.impressao_digital(amostras.astype(np.int64)),
+        'regra_raiz': regra_raiz,
+        'metrica': 'euclidiana' if metrica is None else metrica.nome,
+        'parametros_metrica': None if metrica is None else metrica.impressao_digital(),
+        'dtype': X.dtype.name,
+    }
+
+    if retomando:
+        amostras, concluidas = ck.retomar(config)
+        print(f"Retomando checkpoint '{pasta_checkpoint}': {concluidas}/{len(amostras)} trajetórias já concluídas.")
+    else:
+        ck.iniciar(amostras, df_norm.index.to_numpy(), config, estado_rng={'seed': seed})
+        concluidas = 0
+
+    if concluidas < len(amostras):
+        for resultado_chunk in _iterar_chunks_paralelo(df_norm, severity_label_serie, amostras[concluidas:], None, None,
+                                                       None, n_workers, tamanho_chunk, tamanho_lote, None,
+                                                       regra_raiz, metrica):
+            ck.adicionar(resultado_chunk)
+            print(f"Checkpoint: {ck.estado['concluidas']}/{len(amostras)} trajetórias salvas.")
+
+    print("Processamento Finalizado.")
+    return ck.resultado()
+
+
 def exportar_trajetorias(df_original, trajetorias_finais, id_severity_map, nome_arquivo="data/results/trajectories.csv"):
     """
     df_original: DataFrame com valores reais (TSH, T4, T3, ...).